@@ -78,12 +78,31 @@ from __future__ import (
     division, print_function, absolute_import, unicode_literals)
 
 # Standard libraries.
+import io
 import os
+import abc
 import re
 import sys
+import json
+import mmap
+import zlib
+import struct
+import time
+import uuid
+import ctypes
 import codecs
+import keyword
+import pickle
+import sqlite3
+import filecmp
+import hashlib
 import os.path
 import argparse
+import multiprocessing
+from operator import itemgetter, methodcaller
+from itertools import chain
+from collections import namedtuple
+from timeit import default_timer
 
 # ID: $Id$
 __date__ = "$Date::                            $"[7:-1]
@@ -111,299 +130,2859 @@ True
     return ''.join(outp)
 
 
+_SPACE = re.compile(r'\s*')
+_BIND_NAME = re.compile(
+    r'''
+    ^
+    (?: ''' + casi('NAME') + r''' ) \s* = \s*
+    (?P<quot>[\'\"]) (?P<cName>[\w]+) (?P=quot)
+    $
+    ''', re.VERBOSE)
+
+
+def _scan_parens(line, pos):
+    """Return stripped text between the parenthesis starting at `pos`
+and the next closing one, together with the position behind it::
+
+>>> _scan_parens("f( a, b ) bind(c)", 1)
+('a, b', 9)
+>>> _scan_parens("f a, b", 1) is None
+True
+"""
+    if not line.startswith('(', pos):
+        return None
+    end = line.find(')', pos + 1)
+    if end < 0:
+        return None
+    return line[pos + 1:end].strip(), end + 1
+
+
+def _scan_keyword(line, pos, keyword):
+    """Return position behind `keyword` (given in lower case) and
+following whitespace if `line` continues with it at `pos`.
+"""
+    if line[pos:pos + len(keyword)].lower() != keyword:
+        return None
+    return _SPACE.match(line, pos + len(keyword)).end()
+
+
+def _scan_bind(line, pos):
+    """Scan a `BIND(C, NAME='cName')` clause starting at `pos`::
+
+>>> sorted(_scan_bind("bind(c,name='pstr')", 0).items())
+[('C', 'c'), ('cName', 'pstr'), ('quot', "'")]
+>>> _scan_bind("bind(c,name=pstr)", 0) is None
+True
+"""
+    pos = _scan_keyword(line, pos, 'bind')
+    clause = pos is not None and _scan_parens(line, pos)
+    if not clause or not clause[0]:
+        return None
+    gdict = {'C': None, 'quot': None, 'cName': None}
+    for item in clause[0].split(','):
+        item = item.strip()
+        if item in ('c', 'C'):
+            gdict['C'] = item
+        elif item:
+            name = _BIND_NAME.match(item)
+            if name is None:
+                return None
+            gdict.update(name.groupdict())
+    return gdict
+
+
+def _scan_tail(line, pos, result):
+    """Scan the `(args) [RESULT(x)] BIND(C, NAME='...')` tail of a
+routine declaration starting at `pos`.
+
+Scanning is done from left to right without backtracking, so that the
+time needed is linear in the length of the line even for very long
+argument lists. `result` tells whether a `RESULT` clause is expected.
+Returns a dictionary with the same keys as the former regular
+expression groups or `None`::
+
+>>> tail = _scan_tail("(a, b) result(c) bind(c)", 0, True)
+>>> tail['args'], tail['result'], tail['C']
+('a, b', 'c', 'c')
+"""
+    args = _scan_parens(line, pos)
+    if args is None:
+        return None
+    gdict = {'args': args[0]}
+    pos = _SPACE.match(line, args[1]).end()
+    if result:
+        pos = _scan_keyword(line, pos, 'result')
+        res = pos is not None and _scan_parens(line, pos)
+        if not res or not res[0]:
+            return None
+        gdict['result'] = res[0]
+        pos = _SPACE.match(line, res[1]).end()
+    bind = _scan_bind(line, pos)
+    if bind is None:
+        return None
+    gdict.update(bind)
+    return gdict
+
+
+_WORD = re.compile(r'\s*(\w+)\s*')
+
+
+def _scan_prefix(prefix):
+    """Scan the prefix of a routine declaration, return the type
+specification, as tuple of type and kind or `None`, and the prefix
+keywords in lower case::
+
+>>> _scan_prefix("pure integer(kind = c_int) elemental")
+(('integer', 'c_int'), ('pure', 'elemental'))
+>>> _scan_prefix("RECURSIVE")
+(None, ('recursive',))
+"""
+    type_spec = None
+    keywords = []
+    pos = 0
+    while pos < len(prefix):
+        word = _WORD.match(prefix, pos)
+        if word is None:
+            break
+        pos = word.end()
+        word = word.group(1)
+        if word.lower() in _PREFIX_KEYWORDS:
+            keywords.append(word.lower())
+        elif word.lower() in _TYPE_KEYWORDS:
+            params = _scan_parens(prefix, pos)
+            if params is None:
+                continue
+            pos = _SPACE.match(prefix, params[1]).end()
+            for i, param in enumerate(params[0].split(',')):
+                key, _, value = param.rpartition('=')
+                if key.strip().lower() == 'kind' or (not key and not i):
+                    type_spec = (word, value.strip())
+    return type_spec, tuple(keywords)
+
+
+class _Match(dict):
+
+    """Result of the scanning matchers providing the `groupdict`
+interface of regular expression match objects.
+"""
+
+    def groupdict(self):
+        return dict(self)
+
+    def group(self, name):
+        return self[name]
+
+
+class _RoutineMatcher(object):
+
+    """Match SUBROUTINE declarations. The head up to the routine name
+is matched by a regular expression, the tail is scanned by
+`_scan_tail`.
+"""
+
+    def __init__(self, head, result):
+        self.head = re.compile(head, re.VERBOSE)
+        self.result = result
+
+    def _head(self, line):
+        """Return group dictionary of the routine head and the
+position of the argument list.
+"""
+        head = self.head.match(line)
+        if head is None:
+            return None
+        return head.groupdict(), head.end()
+
+    def match(self, line):
+        head = self._head(line)
+        if head is None:
+            return None
+        gdict = _scan_tail(line, head[1], self.result)
+        if gdict is None:
+            return None
+        gdict.update(head[0])
+        return _Match(gdict)
+
+
+class _FunctionMatcher(_RoutineMatcher):
+
+    """Match FUNCTION declarations. The `FUNCTION` keyword is searched
+for, everything in front of it is the prefix. Only occurrences of the
+keyword are tried, so the prefix does not cause backtracking.
+"""
+
+    def _head(self, line):
+        for head in self.head.finditer(line):
+            pos = _SPACE.match(line, head.end()).end()
+            if line.startswith('(', pos):
+                gdict = head.groupdict()
+                gdict['prefix'] = line[:head.start()].rstrip() or None
+                return gdict, pos
+        return None
+
+
+# Keywords allowed in the prefix of routine declarations.
+_PREFIX_KEYWORDS = ('pure', 'impure', 'elemental', 'recursive',
+                    'non_recursive', 'module')
+
 # SUBROUTINE SXFGeRh (iUnit, oRelName, oNoOAttr, oNoORows, oAttName,
 #                     oAttType, oAttLeng) BIND(C,NAME="SXFGeRh")
-_BIND = casi("BIND") + r'''
-\( \s*
-(?:
-  (?:
-    (?P<C>[Cc]) |
-    (?:''' + casi('NAME') + r''' ) \s* =
-       \s* (?P<quot>[\'\"]) (?P<cName>[\w]+) (?P=quot)
-  ) \s* ,? \s*
-)+
-\s* \)
-'''
-# This solution becomes to slow to long argument lists.
-# _ARGS = '\( \s* (?P<args> (?: \w+? \s* ,? \s* )* ) \s* \) \s*'
-_ARGS = r'\( \s* (?P<args> .*? ) \s* \) \s*'
-_SUBROUTINE = re.compile(
+_SUBROUTINE = _RoutineMatcher(
     r'''
     ^
+    (?P<prefix> (?: (?: ''' + "|".join(casi(i) for i in _PREFIX_KEYWORDS) +
+    r''' ) \s+ )* )
     (?: ''' + casi("SUBROUTINE") + r''' ) \s+
     (?P<fName> \w+ ) \s*
-    ''' + _ARGS + _BIND, re.VERBOSE)
+    ''', result=False)
+
+# FUNCTION C_CALLOC(elt_count, elt_size) RESULT(ptr) BIND(C, NAME="calloc")
+_FUNCTION = _FunctionMatcher(
+    r'''
+    \b (?: ''' + casi("FUNCTION") + r''' ) \s+
+    (?P<fName> \w+ )
+    ''', result=True)
+
+# INTEGER(C_INT), INTENT(IN), VALUE :: iUnit
+#
+# Every part of the expression can only be matched in one way, so
+# failing matches need time linear in the length of the line.
+_VARTYPE = re.compile(
+    r'''
+    ^
+    (?P<ftype>
+      (?: ''' + casi("INTEGER") + ''' ) |
+      (?: ''' + casi("REAL") + ''' ) |
+      (?: ''' + casi("COMPLEX") + ''' ) |
+      (?: ''' + casi("LOGICAL") + ''' ) |
+      (?: ''' + casi("CHARACTER") + ''' ) |
+      (?: ''' + casi("TYPE") + r''' )
+    )
+    \( \s*
+      (?:
+        (?:
+          (?: ''' + casi("LEN") + r''' ) \s* = \s* (?P<length> \d+ ) |
+          (?: (?: ''' + casi("KIND") + r''' ) \s* = \s* )? (?P<kind> \w+ )
+        )
+        (?: \s* , \s* | (?= \s* \) ) )
+      )*
+    \s* \) \s*
+    (?P<modifier> , (?: [^:] | :(?!:) )* )? :: \s*
+    (?P<args> (?: \w+ (?: \s* , \s* \w+ )* )? )
+    ''', re.VERBOSE)
+
+_INTENT = re.compile(".*" + casi("intent") + r"\s*\(\s*(?P<dir> " +
+                     '(?:' + casi("IN") + ")|" +
+                     '(?:' + casi("OUT") + ")|" +
+                     '(?:' + casi("INOUT") + ")|" +
+                     '(?:' + casi("IN,OUT") + r"))\s*\).*", re.VERBOSE)
+
+_INTERFACE = re.compile('^' + casi('INTERFACE') + '$')
+# TYPE, BIND(C) :: point
+_TYPE_DEFINITION = re.compile(
+    '^' + casi('TYPE') + r'\s*,(?P<attrs>(?:[^:]|:(?!:))*)::\s*(?P<name>\w+)$')
+_BIND_C = re.compile(
+    r'\b' + casi('BIND') + r'\s*\(\s*' + casi('C') + r'\s*\)')
+_END_TYPE = re.compile('^' + casi('END') + r'\s*' + casi('TYPE') + r'\b')
+# Entity of a component declaration, like `v(3, 2)`.
+_ENTITY = re.compile(r'^(?P<name>\w+)\s*(?:\((?P<shape>[^)]*)\))?')
+_DIMENSION = re.compile(casi('DIMENSION') + r'\s*\((?P<shape>[^)]*)\)')
+# Array specification following an entity name, like '(n, 3)'.
+_SHAPE = re.compile(r'\(\s*(?P<shape>[^)]*)\)')
+_END_INTERFACE = re.compile('^' + casi('END INTERFACE') + '$')
+_END_ROUTINE = re.compile(
+    '^' + casi('END') + r'\s*(?:' + casi('SUBROUTINE') + '|' +
+    casi('FUNCTION') + r')\b')
+# INCLUDE 'common.inc', and '#include "common.inc"' for preprocessed
+# sources.
+_INCLUDE = re.compile(
+    r'''
+    ^ (?: \# \s* )? (?: ''' + casi('INCLUDE') + r''' ) \s*
+    (?P<quot>[\'\"]) (?P<name> [^\'\"]+ ) (?P=quot)
+    ''', re.VERBOSE)
+
+# Leading keyword of a statement, used to select the one matcher that
+# can apply to a line. Preprocessor directives are identified by the
+# keyword following the '#'.
+_KEYWORD = re.compile(r'(?:\#\s*)?([A-Za-z]\w*)')
+_TYPE_KEYWORDS = frozenset(
+    ('integer', 'real', 'complex', 'logical', 'character', 'type'))
+_ROUTINE_KEYWORD = re.compile(
+    r'\b(?:' + casi('SUBROUTINE') + '|' + casi('FUNCTION') + r')\b')
+# All END statements are handled by the _END_INTERFACE branch.
+_STATEMENTS = {
+    'subroutine': _SUBROUTINE,
+    'interface': _INTERFACE,
+    'end': _END_INTERFACE,
+    'endsubroutine': _END_INTERFACE,
+    'endfunction': _END_INTERFACE,
+    'endtype': _END_INTERFACE,
+    'include': _INCLUDE}
+
+
+def _statement(line):
+    """Return the matcher responsible for `line`, selected from the
+leading keyword, or `None` if the line can not be of interest::
+
+>>> _statement("SUBROUTINE a(b) BIND(C)") is _SUBROUTINE
+True
+>>> _statement("integer(c_int), value :: b") is _VARTYPE
+True
+>>> _statement("integer(c_int) function a(b) result(c) bind(c)") is _FUNCTION
+True
+>>> _statement("#include 'a.inc'") is _INCLUDE
+True
+>>> _statement("pure subroutine a(b) bind(c)") is _SUBROUTINE
+True
+>>> _statement("type, bind(c) :: point") is _TYPE_DEFINITION
+True
+>>> _statement("call a(b)") is None
+True
+"""
+    key = _KEYWORD.match(line)
+    key = key.group(1).lower() if key else ''
+    matcher = _STATEMENTS.get(key)
+    if matcher is not None:
+        return matcher
+    if key in _PREFIX_KEYWORDS:
+        routine = _ROUTINE_KEYWORD.search(line)
+        if routine is not None:
+            return (_SUBROUTINE if routine.group().lower() == 'subroutine'
+                    else _FUNCTION)
+    if '::' in line:
+        if key == 'type' and not line[4:].lstrip().startswith('('):
+            return _TYPE_DEFINITION
+        return _VARTYPE if key in _TYPE_KEYWORDS else None
+    if 'function' in line.lower():
+        return _FUNCTION
+    return None
+
+
+def file_digest(name):
+    """Return SHA1 hex digest of the content of file `name`.
+"""
+    digest = hashlib.sha1()
+    with open(name, 'rb') as data:
+        for block in iter(lambda: data.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _create_temp(name):
+    """Create temporary file for writing `name` in the same directory,
+return file descriptor and name.
+"""
+    tmp_name = os.path.join(
+        os.path.dirname(os.path.abspath(name)),
+        ".%s.%d.%s.tmp" % (os.path.basename(name), os.getpid(),
+                           uuid.uuid4().hex[:8]))
+    fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_BINARY', 0), 0o666)
+    return fd, tmp_name
+
+
+def _replace(tmp_name, name):
+    if os.name == 'nt' and os.path.exists(name):
+        os.remove(name)
+    os.rename(tmp_name, name)
+
+
+def write_atomic(name, data):
+    """Write `data` (bytes) to file `name` by writing a temporary file
+in the same directory and renaming it, so that readers never see a
+partially written file.
+"""
+    fd, tmp_name = _create_temp(name)
+    try:
+        with os.fdopen(fd, 'wb') as ofile:
+            ofile.write(data)
+        _replace(tmp_name, name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def write_if_changed(name, data, force=False):
+    """Atomically write `data` (bytes) to file `name` unless the file
+already has exactly this content. Returns whether the file was
+written.
+"""
+    if not force:
+        try:
+            with open(name, 'rb') as old:
+                if old.read() == data:
+                    return False
+        except (IOError, OSError):
+            pass
+    write_atomic(name, data)
+    return True
+
+
+class OutputFile(object):
+
+    """Text output file written incrementally to a temporary file. On
+`close` the temporary file replaces file `name` if the content
+differs, otherwise it is removed. `status` is then 'written' or
+'unchanged'.
+"""
+
+    def __init__(self, name, force=False):
+        self.name = name
+        self.force = force
+        self.status = None
+        fd, self.tmp_name = _create_temp(name)
+        self.file = io.open(fd, 'w', encoding='utf-8')
+
+    def write(self, text):
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+        if (not self.force and os.path.exists(self.name) and
+                filecmp.cmp(self.tmp_name, self.name, shallow=False)):
+            os.remove(self.tmp_name)
+            self.status = 'unchanged'
+        else:
+            _replace(self.tmp_name, self.name)
+            self.status = 'written'
+
+    def discard(self):
+        """Close and remove the temporary file without touching the
+output file.
+"""
+        self.file.close()
+        if os.path.exists(self.tmp_name):
+            os.remove(self.tmp_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ParseCache(object):
+
+    """Persistent cache for parse results and generated outputs.
+
+Parse results are stored keyed by a hash of the input content and the
+options influencing the parse. For every generated output the key it
+was generated from and the digest of its content are recorded, so that
+unchanged outputs are detected independent of file modification times.
+"""
+
+    version = 14
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    @classmethod
+    def key(cls, lines, *options):
+        """Return key for the input `lines` and `options`.
+"""
+        digest = hashlib.sha1(
+            repr((cls.version,) + options).encode('utf-8'))
+        lines = list(lines)
+        text = "".join(lines)
+        if text and text[-1] != '\n':
+            text += '\n'
+        if '\r' in text or text.count('\n') != len(lines) or not all(
+                map(methodcaller('endswith', '\n'), lines[:-1])):
+            # Normalize line ends, the joined text is only used as is for
+            # lines as read from text files, ending in a single newline.
+            text = "".join(line.rstrip('\r\n') + '\n' for line in lines)
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def load(self, key):
+        """Return parse result stored for `key`, `None` if there is
+none.
+"""
+        try:
+            with open(self._path(key, '.pickle'), 'rb') as data:
+                return pickle.load(data)
+        except Exception:
+            return None
+
+    def store(self, key, info):
+        """Store parse result `info` for `key`.
+"""
+        write_atomic(self._path(key, '.pickle'),
+                     pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+
+    def _output_record(self, name):
+        return self._path(self.key((os.path.abspath(name),)), '.output')
+
+    def output_current(self, name, key):
+        """Return whether output file `name` exists unchanged since it
+was generated for `key`.
+"""
+        try:
+            with open(self._output_record(name)) as data:
+                record = data.read().split()
+            return record == [key, file_digest(name)]
+        except (IOError, OSError):
+            return False
+
+    def output_written(self, name, key):
+        """Record that output file `name` was generated for `key`.
+"""
+        write_atomic(self._output_record(name), "{} {}\n".format(
+            key, file_digest(name)).encode('ascii'))
+
+
+class MemoryCache(ParseCache):
+
+    """In-memory variant of `ParseCache` for long running processes.
+Parse results are kept as objects, so cache hits need neither reading
+nor unpickling files.
+"""
+
+    def __init__(self):
+        self.results = {}
+        self.outputs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key):
+        info = self.results.get(key)
+        if info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return info
+
+    def store(self, key, info):
+        self.results[key] = info
+
+    def forget(self, key):
+        """Drop parse result stored for `key`.
+"""
+        self.results.pop(key, None)
+
+    def forget_output(self, name):
+        """Drop the record for output file `name`.
+"""
+        self.outputs.pop(os.path.abspath(name), None)
+
+    def clear(self):
+        self.results.clear()
+        self.outputs.clear()
+
+    def output_current(self, name, key):
+        try:
+            return self.outputs.get(os.path.abspath(name)) == (
+                key, file_digest(name))
+        except (IOError, OSError):
+            return False
+
+    def output_written(self, name, key):
+        self.outputs[os.path.abspath(name)] = (key, file_digest(name))
+
+
+class SymbolIndex(object):
+
+    """Project wide index of the generated C symbols, kept in the
+SQLite database `name`. For every input file the generated header and
+the symbols are stored, updating a file replaces its entries. Symbols
+are recorded with the line number of their declaration, so symbols
+defined twice in the same file are kept.
+"""
+
+    version = 2
+
+    def __init__(self, name):
+        self.name = name
+        self.db = sqlite3.connect(name)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != \
+                self.version:
+            self.db.executescript("""
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS symbols;
+CREATE TABLE files (path TEXT PRIMARY KEY, header TEXT);
+CREATE TABLE symbols (name TEXT, fname TEXT, path TEXT, lineno INTEGER,
+                      PRIMARY KEY (name, path, lineno));
+CREATE INDEX symbols_name ON symbols (name);
+PRAGMA user_version = %d;
+""" % self.version)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, path, header, symbols):
+        """Replace the entries for input file `path` by the generated
+`header` and the `symbols`, a sequence of C and Fortran names and line
+numbers.
+"""
+        path = os.path.abspath(path)
+        with self.db:
+            self.db.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                            (path, os.path.abspath(header)))
+            self.db.executemany(
+                "INSERT INTO symbols VALUES (?, ?, ?, ?)",
+                ((name, fname, path, lineno)
+                 for name, fname, lineno in symbols))
+
+    def prune(self):
+        """Remove the entries for input files that no longer exist,
+return their paths.
+"""
+        gone = [path for path, in self.db.execute("SELECT path FROM files")
+                if not os.path.exists(path)]
+        with self.db:
+            for path in gone:
+                self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                self.db.execute(
+                    "DELETE FROM symbols WHERE path = ?", (path,))
+        return gone
+
+    def which(self, name):
+        """Return tuples of input file, line number, header, and Fortran
+name for the declarations of C symbol `name`.
+"""
+        return self.db.execute(
+            "SELECT symbols.path, lineno, header, fname FROM symbols "
+            "JOIN files ON symbols.path = files.path "
+            "WHERE name = ? ORDER BY symbols.path, lineno",
+            (name,)).fetchall()
+
+    def conflicts(self):
+        """Return dictionary mapping C symbols declared more than once
+to lists of tuples of input file and line number of the declarations.
+"""
+        result = {}
+        for name, path, lineno in self.db.execute(
+                "SELECT name, path, lineno FROM symbols WHERE name IN ("
+                "SELECT name FROM symbols GROUP BY name "
+                "HAVING COUNT(*) > 1) ORDER BY name, path, lineno"):
+            result.setdefault(name, []).append((path, lineno))
+        return result
+
+    def headers(self):
+        """Return the generated headers of all input files.
+"""
+        return [header for header, in self.db.execute(
+            "SELECT DISTINCT header FROM files ORDER BY header")]
+
+    def gen_umbrella(self, name):
+        """Write umbrella header `name` including the headers of all
+indexed files. Returns whether the file was written.
+"""
+        guard = re.sub(r'\W', '_', os.path.basename(name)).upper()
+        base = os.path.dirname(os.path.abspath(name))
+        lines = [CHeaderRenderer.comment("\n".join((
+            os.path.basename(name),
+            "Umbrella header including all headers generated from "
+            "parsing",
+            "ISO_C_BINDING information."))).rstrip(),
+                 "",
+                 "#ifndef %s" % guard,
+                 "#define %s" % guard,
+                 ""]
+        lines.extend('#include "%s"' % os.path.relpath(header, base).replace(
+            os.sep, '/') for header in self.headers())
+        lines.extend(("", "#endif /* %s */" % guard, ""))
+        return write_if_changed(name, "\n".join(lines).encode('utf-8'))
+
+
+def _strip_comment(line):
+    """Return `line` stripped from surrounding whitespace and trailing
+comment.
+"""
+    line = line.strip()
+    pos = line.find('!')
+    if pos >= 0:
+        line = line[:pos].rstrip()
+    return line
+
+
+# Keywords of all statements that can change the parser state while
+# no `BIND(C)` routine is being processed.
+_CANDIDATES = (b'bind', b'interface', b'include')
+# Line continuations, keywords might be split by them. A comment may
+# follow the ampersand.
+_CONTINUATION = re.compile(br'&[ \t\r]*(?:![^\n]*)?\n')
+_MIN_BLOCK_SIZE = 1 << 12
+_MAX_BLOCK_SIZE = 1 << 22
+
+
+class MappedSource(object):
+
+    """Provide the raw lines of a memory mapped Fortran source file.
+
+Regions without any `BIND(C)` routine, `INTERFACE` or `INCLUDE`
+statement can be skipped without processing single lines.
+"""
+
+    def __init__(self, name):
+        with open(name, 'rb') as data:
+            self.size = os.fstat(data.fileno()).st_size
+            if self.size:
+                self.map = mmap.mmap(
+                    data.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = b''
+        self.pos = 0
+        self.skipped = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.pos >= self.size:
+            raise StopIteration
+        end = self.map.find(b'\n', self.pos)
+        end = self.size if end < 0 else end + 1
+        line = self.map[self.pos:end]
+        self.pos = end
+        return line.decode('utf-8', 'replace')
+
+    __next__ = next
+
+    def close(self):
+        if self.size:
+            self.map.close()
+
+    def _find_candidate(self, pos):
+        """Return position of the next keyword of interest starting at
+`pos`, or the file size if there is none.
+
+The file is searched blockwise in lower case using plain substring
+search, with growing block size to keep the effort proportional to the
+distance of the next candidate. Line continuations directly following
+a letter are treated as candidates, as they might split a keyword.
+"""
+        overlap = max(len(i) for i in _CANDIDATES) - 1
+        block_size = _MIN_BLOCK_SIZE
+        while pos < self.size:
+            end = min(pos + block_size, self.size)
+            block_size = min(2 * block_size, _MAX_BLOCK_SIZE)
+            block = self.map[pos:end + overlap].lower()
+            found = [i for i in (block.find(j) for j in _CANDIDATES)
+                     if i >= 0]
+            for cont in _CONTINUATION.finditer(block, 0, end - pos):
+                if self.map[pos + cont.start() - 1:
+                            pos + cont.start()].isalpha():
+                    found.append(cont.start())
+                    break
+            if found:
+                return pos + min(found)
+            pos = end
+        return self.size
+
+    def has_candidates(self):
+        """Return whether the file contains any of the keywords of
+interest.
+"""
+        return self._find_candidate(0) < self.size
+
+    def _line_start(self, pos):
+        """Return start of the line containing `pos`, not going back
+before the current position.
+"""
+        return max(self.map.rfind(b'\n', self.pos, pos) + 1, self.pos)
+
+    def skip(self):
+        """Skip to the start of the statement containing the next
+keyword of interest, return the number of lines skipped.
+"""
+        start = self._find_candidate(self.pos)
+        if start < self.size:
+            start = self._line_start(start)
+        # Go back to the first line of a continued statement.
+        while start > self.pos:
+            prev = self._line_start(start - 1)
+            line = self.map[prev:start].decode('utf-8', 'replace')
+            if not _strip_comment(line).endswith('&'):
+                break
+            start = prev
+        lines = 0
+        for pos in range(self.pos, start, 1 << 20):
+            lines += self.map[pos:min(pos + (1 << 20), start)].count(b'\n')
+        self.skipped += start - self.pos
+        self.pos = start
+        return lines
+
+
+# Statements that can end a block of the source for incremental
+# parsing, or change the parser state relevant for that.
+_BLOCK_STATEMENT = re.compile(
+    r'\n[ \t]*(?:' + casi('END') + r'[ \t]*(?:' + casi('SUBROUTINE') + '|' +
+    casi('FUNCTION') + '|' + casi('INTERFACE') + ')|' + casi('INTERFACE') +
+    r')[^\n]*')
+_LETTER_CONTINUATION = re.compile(r'[a-z]&[ \t\r]*(?:![^\n]*)?\n')
+
+
+def split_blocks(text):
+    """Split Fortran source `text` into blocks ending after the END
+statements of routines outside of `INTERFACE` blocks. At these points
+no routine is being processed, so the blocks can be parsed separately.
+"""
+    blocks = []
+    start = 0
+    interface = False
+    # Matches start with the newline before the statement, positions in
+    # the extended text are the positions of the lines in `text`.
+    for match in _BLOCK_STATEMENT.finditer("\n" + text):
+        pos = match.start()
+        if pos:
+            prev = text.rfind("\n", 0, pos - 1) + 1
+            if (text.find('&', prev, pos) >= 0 and
+                    _strip_comment(text[prev:pos]).endswith('&')):
+                continue
+        line = _strip_comment(match.group())
+        if _INTERFACE.match(line):
+            interface = True
+        elif _END_INTERFACE.match(line):
+            interface = False
+        elif (not interface and _END_ROUTINE.match(line) and
+              not line.endswith('&')):
+            end = match.end()
+            blocks.append(text[start:end])
+            start = end
+    if start < len(text):
+        blocks.append(text[start:])
+    return blocks
+
+
+def _has_candidates(block):
+    """Return whether `block` may contain statements relevant for the
+parser, see `MappedSource`.
+"""
+    lower = block.lower()
+    return (any(i.decode('ascii') in lower for i in _CANDIDATES) or
+            _LETTER_CONTINUATION.search(lower) is not None)
+
+
+class FortranSourceProvider(object):
+
+    """Provide concatenated Fortran source lines for analysis.
+
+`lineno` is the number of raw lines read so far, `start_lineno` the
+number of the first raw line of the last returned line. If `idle` is
+set and the input is a `MappedSource`, the next returned line is the
+next line that can change the state of the parser when no routine is
+being processed.
+"""
+
+    def __init__(self, data):
+        self.file = iter(data)
+        self.lineno = 0
+        self.start_lineno = 0
+        self.idle = False
+
+    def __iter__(self):
+        return self
+
+    def _read(self):
+        """Return next raw line from input file, ignoring empty lines
+and comments.
+"""
+        line = _strip_comment(next(self.file))
+        self.lineno += 1
+        return line
+
+    def next(self):
+        """Return next line.
+"""
+        if self.idle and isinstance(self.file, MappedSource):
+            self.lineno += self.file.skip()
+        line = self._read()
+        self.start_lineno = self.lineno
+        parts = []
+        while line.endswith('&'):
+            parts.append(line[:-1])
+            line = self._read()
+            if line.startswith('&'):
+                line = line[1:]
+        parts.append(line)
+        return ''.join(parts).strip()
+
+    __next__ = next
+
+
+class _AliasingSourceProvider(FortranSourceProvider):
+
+    """Source provider collecting the kind aliases from the lines read
+into dictionary `aliases`, for inputs that can only be read once. As
+Fortran requires USE statements and named constants to precede their
+use, every alias is known before it is needed.
+"""
+
+    def __init__(self, data, modules, aliases):
+        super(_AliasingSourceProvider, self).__init__(data)
+        self.scanner = _KindScanner()
+        self.lookup = modules.lookup(self.scanner.modules)
+        self.aliases = aliases
+
+    def next(self):
+        line = super(_AliasingSourceProvider, self).next()
+        lower = line.lower()
+        if ('use' in lower or 'parameter' in lower or 'module' in lower or
+                lower.startswith(('contains', 'end', 'type'))):
+            _resolve(self.scanner.feed(line), self.lookup, self.aliases)
+        return line
+
+    __next__ = next
+
+
+class Comment(object):
+
+    """Comment text, formatted by the renderers.
+"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return CHeaderRenderer.comment(self.text)
+
+
+# C types for the Fortran types and `ISO_C_BINDING` kinds.
+F_KINDS = {
+    'integer': {
+        "c_int": "int",
+        "c_short": "short int",
+        "c_long": "long int",
+        "c_long_long": "long long int",
+        "c_size_t": "size_t",
+        "c_int8_t": "int8_t",
+        "c_int16_t": "int16_t",
+        "c_int32_t": "int32_t",
+        "c_int64_t": "int64_t",
+        "c_int_least8_t": "int_least8_t",
+        "c_int_least16_t": "int_least16_t",
+        "c_int_least32_t": "int_least32_t",
+        "c_int_least64_t": "int_least64_t",
+        "c_int_fast8_t": "int_fast8_t",
+        "c_int_fast16_t": "int_fast16_t",
+        "c_int_fast32_t": "int_fast32_t",
+        "c_int_fast64_t": "int_fast64_t",
+        "c_intmax_t": "intmax_t",
+        "c_intptr_t": "intptr_t",
+        "c_signed_char": "signed char"},
+    'real': {
+        "c_float": "float",
+        "c_double": "double",
+        "c_long_double": "long double"},
+
+
+    'complex': {
+        "c_float_complex": "float _Complex",
+        "c_double_complex": "double _Complex",
+        "c_long_double_complex": "long double _Complex"},
+    'logical': {
+        "c_bool": "char"},  # "_Bool"},
+    'character': {
+        "c_char": "char"},
+    'type': {
+        "c_ptr": "void*",
+        "c_funptr": "(*)"}}
+
+_INTERNED = {}
+
+
+def _intern(text):
+    """Return the single shared instance of string `text`.
+"""
+    return _INTERNED.setdefault(text, text)
+
+
+def _qualified(c_type, const=False, pointer=False):
+    """Return `c_type` made const and pointer as requested, interned.
+"""
+    return _intern("".join((
+        "const " if const else "", c_type, "*" if pointer else "")))
+
+
+class TypeTable(object):
+
+    """C types for Fortran types and kinds in one configuration. The
+table is built once per configuration, see `get`, and returns interned
+strings, so all arguments of the same type share one string.
+"""
+
+    __slots__ = ('types',)
+
+    _tables = {}
+
+    def __init__(self, signed_to_unsigned_char):
+        self.types = {}
+        for ftype, kinds in F_KINDS.items():
+            for kind, c_type in kinds.items():
+                self.types[(ftype, kind, False, False)] = _intern(c_type)
+        if signed_to_unsigned_char:
+            self.types[('integer', 'c_signed_char', False, False)] = (
+                _intern("unsigned char"))
+
+    @classmethod
+    def get(cls, signed_to_unsigned_char):
+        """Return the table for the configuration.
+"""
+        key = bool(signed_to_unsigned_char)
+        table = cls._tables.get(key)
+        if table is None:
+            table = cls._tables.setdefault(key, cls(key))
+        return table
+
+    def c_type(self, ftype, kind, const=False, pointer=False):
+        """Return C type for Fortran type `ftype` with kind `kind`,
+`None` if there is none.
+"""
+        key = (ftype.lower(), kind.lower(), const, pointer)
+        try:
+            return self.types[key]
+        except KeyError:
+            pass
+        c_type = self.types.get(key[:2] + (False, False))
+        if c_type is not None:
+            c_type = _qualified(c_type, const, pointer)
+        return self.types.setdefault(key, c_type)
+
+
+# Kind names defined by `ISO_C_BINDING`.
+C_KINDS = frozenset(kind for kinds in F_KINDS.values() for kind in kinds)
+# Modules provided by the compiler, never searched for.
+_INTRINSIC_MODULES = frozenset(
+    ('iso_c_binding', 'iso_fortran_env', 'ieee_arithmetic',
+     'ieee_exceptions', 'ieee_features'))
+
+# Lines starting statements relevant for resolving kind aliases and
+# derived types: MODULE, CONTAINS, END MODULE, USE, declarations of named
+# constants, and derived type definitions with attributes.
+_KIND_STATEMENT = (
+    r'^[ \t]*(?:(?:' + casi('MODULE') + '|' + casi('CONTAINS') + '|' +
+    casi('END') + r'[ \t]*' + casi('MODULE') + '|' + casi('USE') + '|' +
+    casi('PARAMETER') + r')\b|' + casi('TYPE') + r'[ \t]*,|[^\n!]*\b' +
+    casi('PARAMETER') + r'\b)[^\n]*')
+_KIND_STATEMENT_TEXT = re.compile(_KIND_STATEMENT, re.MULTILINE)
+_KIND_STATEMENT_BYTES = re.compile(
+    _KIND_STATEMENT.encode('ascii'), re.MULTILINE)
+_MODULE = re.compile(r'^module\s+(\w+)$')
+_USE = re.compile(
+    r'^use\s*(?:,\s*(?:non_)?intrinsic\s*)?(?:::)?\s*(\w+)\s*'
+    r'(?:,\s*(only\s*:)?\s*(.*))?$')
+_PARAMETER = re.compile(
+    r'^(?:(?:integer|real|complex|logical|character|type)\b.*,\s*parameter'
+    r'\b.*?::(.*)|parameter\s*\((.*)\))$')
+_RENAME = re.compile(r'^(\w+)\s*(?:=>\s*(\w+))?$')
+_NAMED_CONSTANT = re.compile(r'^(\w+)\s*=\s*(\w+)$')
+
+
+def _split_list(text):
+    """Split `text` at the commas not enclosed in parentheses.
+"""
+    items = []
+    depth = 0
+    start = 0
+    for pos, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and not depth:
+            items.append(text[start:pos].strip())
+            start = pos + 1
+    items.append(text[start:].strip())
+    return items
+
+
+def _kind_statements(text):
+    """Yield the statements of Fortran source `text`, a string or a
+bytes like object, that are relevant for kind aliases and derived
+types, with continuation lines joined.
+"""
+    regex = _KIND_STATEMENT_TEXT
+    newline = '\n'
+    if not isinstance(text, type("")):
+        regex = _KIND_STATEMENT_BYTES
+        newline = b'\n'
+    end = 0
+    for match in regex.finditer(text):
+        if match.start() < end:
+            continue
+        end = match.end()
+        line = match.group()
+        if not isinstance(line, type("")):
+            line = line.decode('utf-8', 'replace')
+        parts = []
+        line = _strip_comment(line)
+        while line.endswith('&') and end < len(text):
+            parts.append(line[:-1])
+            start = end + 1
+            end = text.find(newline, start)
+            if end < 0:
+                end = len(text)
+            line = text[start:end]
+            if not isinstance(line, type("")):
+                line = line.decode('utf-8', 'replace')
+            line = _strip_comment(line)
+            if line.startswith('&'):
+                line = line[1:]
+        parts.append(line)
+        yield ''.join(parts).strip()
+
+
+class _KindScanner(object):
+
+    """Collect the statements relevant for kind aliases from the lines
+passed to `feed`, see `scan_kinds`.
+"""
+
+    def __init__(self):
+        self.modules = {}
+        self.statements = []
+        self.module = None
+
+    def feed(self, line):
+        """Process statement `line`, with continuation lines joined.
+Returns the USE statements, named constants, and `BIND(C)` derived type
+definitions found.
+"""
+        found = []
+        definition = _TYPE_DEFINITION.match(line)
+        if definition:
+            if _BIND_C.search(definition.group('attrs')):
+                found.append(('type', definition.group('name')))
+                self.statements.extend(found)
+                if self.module is not None:
+                    self.module.extend(found)
+            return found
+        line = line.lower()
+        match = _MODULE.match(line)
+        if match:
+            if match.group(1) != 'procedure':
+                self.module = self.modules.setdefault(match.group(1), [])
+            return found
+        if line.startswith('contains') or line.replace(' ', '').startswith(
+                'endmodule'):
+            self.module = None
+            return found
+        match = _USE.match(line)
+        if match:
+            names = []
+            for item in _split_list(match.group(3) or ''):
+                rename = _RENAME.match(item)
+                if rename:
+                    names.append((rename.group(1),
+                                  rename.group(2) or rename.group(1)))
+            found.append(('use', match.group(1), bool(match.group(2)),
+                          names))
+        match = _PARAMETER.match(line)
+        if match:
+            for item in _split_list(match.group(1) or match.group(2)):
+                constant = _NAMED_CONSTANT.match(item)
+                if constant:
+                    found.append(('parameter',) + constant.groups())
+        self.statements.extend(found)
+        if self.module is not None:
+            self.module.extend(found)
+        return found
+
+
+def scan_kinds(text):
+    """Return the USE statements, named constants, and `BIND(C)` derived
+type definitions of Fortran source `text` that can define kind aliases
+and derived types.
+
+Returns a dictionary mapping the names of the modules defined in `text`
+to the statements of their specification part, and the statements of
+the whole source. Statements are tuples `('use', module, only, names)`,
+with `names` a list of tuples of local and module name,
+`('parameter', name, value)`, and `('type', name)`.
+
+>>> scan_kinds('''module m
+...   use iso_c_binding, only: c_double
+...   integer, parameter :: dp = c_double, &
+...     n = 3
+... end module m''')[0]['m'][1:] == [
+...     ('parameter', 'dp', 'c_double'), ('parameter', 'n', '3')]
+True
+"""
+    scanner = _KindScanner()
+    for line in _kind_statements(text):
+        scanner.feed(line)
+    return scanner.modules, scanner.statements
+
+
+class TypeAlias(namedtuple('TypeAlias', 'name origin')):
+
+    """`BIND(C)` derived type made available by a module, `name` is the
+type name as defined, `origin` the path of the file defining it, `None`
+for the file being processed.
+"""
+    __slots__ = ()
+
+
+def _resolve(statements, lookup, aliases=None, origin=None):
+    """Return dictionary mapping kind aliases defined by `statements`
+to `ISO_C_BINDING` kinds, and the lower case names of derived types to
+`TypeAlias` instances, `lookup` returns the aliases exported by a
+module. `origin` is the file the statements are taken from. The aliases
+are added to `aliases` if given.
+"""
+    if aliases is None:
+        aliases = {}
+    for statement in statements:
+        if statement[0] == 'type':
+            aliases[statement[1].lower()] = TypeAlias(statement[1], origin)
+        elif statement[0] == 'use':
+            exported = lookup(statement[1])
+            if not statement[2]:
+                aliases.update(exported)
+            for local, name in statement[3]:
+                kind = name if name in C_KINDS else exported.get(name)
+                if kind and kind != local:
+                    aliases[local] = kind
+        else:
+            name, value = statement[1:]
+            kind = value if value in C_KINDS else aliases.get(value)
+            if kind and not isinstance(kind, TypeAlias):
+                aliases[name] = kind
+    return aliases
+
+
+class ModuleTable(object):
+
+    """Kind aliases and `BIND(C)` derived types exported by Fortran
+modules, resolving declarations like `REAL(dp)` with
+`INTEGER, PARAMETER :: dp = c_double`, or `TYPE(point)`, in a module
+used.
+
+Modules are searched for in the Fortran files and directories `paths`.
+Every file is scanned once, the result is kept as long as modification
+time and size of the file do not change, and stored in `cache`, a
+`ParseCache`, if given. The aliases of a module are resolved once, until
+`refresh` is called.
+"""
+
+    def __init__(self, paths=(), cache=None):
+        self.paths = list(paths)
+        self.cache = cache
+        self.files = {}
+        self._index = None
+        self._kinds = {}
+
+    def refresh(self):
+        """Forget the resolved aliases, files are checked for changes
+again.
+"""
+        self._index = None
+        self._kinds = {}
+
+    def scan(self, path):
+        """Return dictionary mapping the names of the modules defined in
+file `path` to their statements, see `scan_kinds`.
+"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {}
+        path = os.path.abspath(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        known = self.files.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        modules = None
+        if self.cache:
+            key = self.cache.key((), 'modules', path, stamp)
+            modules = self.cache.load(key)
+        if modules is None:
+            with open(path, 'rb') as data:
+                modules = scan_kinds(data.read())[0]
+            if self.cache:
+                self.cache.store(key, modules)
+        self.files[path] = (stamp, modules)
+        return modules
+
+    def index(self):
+        """Return dictionary mapping module names to the files defining
+them.
+"""
+        index = self._index
+        if index is None:
+            index = {}
+            for path in input_files(self.paths):
+                for name in self.scan(path):
+                    index.setdefault(name, path)
+            self._index = index
+        return index
+
+    def kinds(self, name, _active=frozenset()):
+        """Return dictionary mapping the kind aliases exported by module
+`name` to `ISO_C_BINDING` kinds, and its derived types to `TypeAlias`
+instances.
+"""
+        kinds = self._kinds.get(name)
+        if kinds is None:
+            if name in _INTRINSIC_MODULES or name in _active:
+                return {}
+            path = self.index().get(name)
+            statements = self.scan(path).get(name, ()) if path else ()
+            active = _active | frozenset((name,))
+            kinds = _resolve(
+                statements, lambda module: self.kinds(module, active),
+                origin=path and os.path.abspath(path))
+            self._kinds[name] = kinds
+        return kinds
+
+    def lookup(self, modules):
+        """Return function returning the aliases exported by a module,
+modules defined in `modules`, see `scan_kinds`, take precedence over
+those found in `paths`.
+"""
+        resolved = {}
+
+        def lookup(name, active=frozenset()):
+            if name not in modules:
+                return self.kinds(name)
+            if name in active:
+                return {}
+            if name not in resolved:
+                resolved[name] = _resolve(modules[name], lambda module: (
+                    lookup(module, active | frozenset((name,)))))
+            return resolved[name]
+
+        return lookup
+
+    def dependencies(self, text):
+        """Return the sorted absolute paths of the files defining the
+modules used by Fortran source `text`, directly or through other modules.
+Modules defined in `text` itself are not searched for.
+"""
+        modules, statements = scan_kinds(text)
+        seen = set(modules) | _INTRINSIC_MODULES
+        pending = [i[1] for i in statements if i[0] == 'use']
+        paths = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            path = self.index().get(name)
+            if path:
+                paths.add(os.path.abspath(path))
+                pending.extend(i[1] for i in self.scan(path).get(name, ())
+                               if i[0] == 'use')
+        return sorted(paths)
+
+    def aliases(self, text):
+        """Return dictionary mapping the kind aliases usable in Fortran
+source `text` to `ISO_C_BINDING` kinds. Aliases are collected for the
+whole source, not per scope.
+"""
+        modules, statements = scan_kinds(text)
+        if not statements:
+            return {}
+        return _resolve(statements, self.lookup(modules))
+
+
+class Argument(namedtuple('Argument',
+                          'name c_type intent value dimension shape kind')):
+
+    """Routine argument, `c_type` is `None` if the type is unknown.
+`intent` is one of 'in', 'out', 'inout', or `None`, `value` and
+`dimension` tell whether the argument has the respective attribute.
+`shape` is the Fortran array specification of array arguments, like
+'n, 0:2' or '*', `None` for scalars. `kind` is the `ISO_C_BINDING` kind
+or the C name of the derived type, `None` if it is unknown.
+"""
+    __slots__ = ()
+
+
+Argument.__new__.__defaults__ = (None, None, False, False, None, None)
+
+
+class _Routine(tuple):
+
+    """Base class for representing Fortran routines. Routines are
+immutable, `name` is the C name, `fname` the Fortran name, `line` the
+Fortran declaration, `result` the C result type, `args` a tuple of
+`Argument` instances, `lineno` the line number of the declaration in
+the source, if known, `prefix` a tuple of the prefix keywords of the
+declaration, like `pure` or `elemental`, in lower case, and `result_kind`
+the `ISO_C_BINDING` kind of the result, if known.
+"""
+    __slots__ = ()
+
+    def __new__(cls, name, fname, line, result, args, lineno=None,
+                prefix=(), result_kind=None):
+        return tuple.__new__(
+            cls, (name, fname, line, result, tuple(args), lineno,
+                  tuple(prefix), result_kind))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    name = property(itemgetter(0))
+    fname = property(itemgetter(1))
+    line = property(itemgetter(2))
+    result = property(itemgetter(3))
+    args = property(itemgetter(4))
+    lineno = property(itemgetter(5))
+    prefix = property(itemgetter(6))
+    result_kind = property(itemgetter(7))
+
+    @property
+    def pure(self):
+        """Whether the routine is declared `PURE`, or `ELEMENTAL` but not
+`IMPURE`.
+"""
+        return ('impure' not in self.prefix and
+                ('pure' in self.prefix or 'elemental' in self.prefix))
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r, %r, %r, %r, %r)" % (
+            (type(self).__name__,) + self)
+
+    def moved(self, offset):
+        """Return the routine with line number moved by `offset`.
+"""
+        if self.lineno is None or not offset:
+            return self
+        return type(self)(*self[:5] + (self.lineno + offset,) + self[6:])
+
+    @property
+    def comment(self):
+        return Comment("%s\nGenerated from FORTRAN routine '%s'\n"
+                       "FORTRAN declaration:\n    %s" % self[:3])
+
+    def __str__(self):
+        return CHeaderRenderer().routine(self)
+
+
+class Subroutine(_Routine):
+
+    """Representing Fortran SUBBROUTINEs
+"""
+    __slots__ = ()
+
+
+class Function(_Routine):
+
+    """Representing Fortran FUNCTIONs
+"""
+    __slots__ = ()
+
+
+class Field(namedtuple('Field', 'name c_type kind shape')):
+
+    """Component of a `BIND(C)` derived type. `c_type` is `None` if the
+type is unknown, `kind` is the `ISO_C_BINDING` kind or the C name of a
+derived type, and `shape` the tuple of the array extents in C order,
+empty for scalars and `None` if the extents are not constant.
+"""
+    __slots__ = ()
+
+
+class Struct(namedtuple('Struct', 'name line fields lineno')):
+
+    """`BIND(C)` derived type, represented by a C struct. `name` is the
+type name, `line` the Fortran definition, `fields` a tuple of `Field`
+instances, and `lineno` the line number of the definition in the
+source, if known.
+"""
+    __slots__ = ()
+
+    @property
+    def complete(self):
+        """Whether all components have a C equivalent.
+"""
+        return all(i.c_type is not None and i.shape is not None
+                   for i in self.fields)
+
+    def moved(self, offset):
+        """Return the type with line number moved by `offset`.
+"""
+        if self.lineno is None or not offset:
+            return self
+        return self._replace(lineno=self.lineno + offset)
+
+    @property
+    def comment(self):
+        return Comment('\n'.join((
+            "%s" % self.name,
+            "Generated from FORTRAN derived type '%s'" % self.name,
+            "FORTRAN declaration:\n    %s" % self.line)))
+
+
+def _extents(spec):
+    """Return the extents of Fortran array specification `spec` in C
+order, `None` if they are not constant::
+
+>>> _extents("3, 0:1")
+(2, 3)
+>>> _extents("n") is None
+True
+"""
+    extents = []
+    for dim in spec.split(','):
+        lower, _, upper = dim.rpartition(':')
+        try:
+            extents.append(int(upper) - int(lower or 1) + 1)
+        except ValueError:
+            return None
+    return tuple(reversed(extents))
+
+
+# Normalized array specifications, by specification as written.
+_SHAPES = {}
+
+
+def _shape(spec):
+    """Return Fortran array specification `spec` normalized::
+
+>>> _shape(" n ,0 : 2")
+'n, 0:2'
+"""
+    try:
+        return _SHAPES[spec]
+    except KeyError:
+        pass
+    return _SHAPES.setdefault(spec, _intern(", ".join(
+        ":".join(i.strip() for i in dim.split(':'))
+        for dim in spec.split(','))))
+
+
+class _Builder(object):
+
+    """Common part of the builders collecting information while
+parsing. Kinds that are not `ISO_C_BINDING` kinds are resolved using
+the function `aliases` returning the kind aliases and the derived types
+of the modules used, and the dictionary `derived` mapping the lower
+case names of the `BIND(C)` derived types defined so far to their C
+names. The derived types used from modules of other files are recorded
+in the dictionary `external`, see `Fortran2CHeader.external`.
+"""
+
+    def __init__(self, types, line, aliases=None, derived=None,
+                 lineno=None, external=None):
+        self.types = types
+        self.line = line
+        self.aliases = aliases
+        self.derived = {} if derived is None else derived
+        self.lineno = lineno
+        self.external = {} if external is None else external
+
+    def kind(self, ftype, kind):
+        """Return the `ISO_C_BINDING` kind or the C name of the derived
+type Fortran type `ftype` with kind `kind` stands for, `None` if it is
+unknown.
+"""
+        kind = kind.lower()
+        if kind in C_KINDS:
+            return kind
+        if ftype.lower() == 'type':
+            return self.derived_name(kind)
+        alias = self.aliases and self.aliases().get(kind)
+        return None if isinstance(alias, TypeAlias) else alias
+
+    def derived_name(self, name):
+        """Return the C name of the `BIND(C)` derived type `name`,
+defined before or in a module used, `None` if it is unknown.
+"""
+        name = name.lower()
+        if name in self.derived:
+            return self.derived[name]
+        alias = self.aliases and self.aliases().get(name)
+        if not isinstance(alias, TypeAlias):
+            return None
+        if alias.origin:
+            self.external[alias.name] = ".".join(
+                os.path.basename(alias.origin).split(".")[:-1])
+        return alias.name
+
+    def c_type(self, ftype, kind, const=False, pointer=False):
+        """Return C type for Fortran type `ftype` with kind `kind`,
+resolving derived types and, if the kind is not an `ISO_C_BINDING`
+kind, kind aliases.
+"""
+        c_type = self.types.c_type(ftype, kind, const, pointer)
+        if c_type is not None:
+            return c_type
+        if ftype.lower() == 'type':
+            name = self.derived_name(kind)
+            return name and _qualified(name, const, pointer)
+        if self.aliases is not None:
+            alias = self.aliases().get(kind.lower())
+            if alias is not None and not isinstance(alias, TypeAlias):
+                c_type = self.types.c_type(ftype, alias, const, pointer)
+        return c_type
+
+
+class _StructBuilder(_Builder):
+
+    """Collect the components of a `BIND(C)` derived type while its
+definition is parsed, `build` returns the immutable `Struct`.
+"""
+
+    def __init__(self, types, line, name, aliases=None, derived=None,
+                 lineno=None, external=None):
+        super(_StructBuilder, self).__init__(
+            types, line, aliases, derived, lineno, external)
+        self.name = name
+        self.fields = []
+
+    def add_fields(self, ftype, kind, modifier, length, entities):
+        """Add the components declared with Fortran type `ftype` of kind
+`kind` for the entity list `entities`, the text following '::'.
+"""
+        c_type = self.c_type(ftype, kind)
+        kind = self.kind(ftype, kind)
+        dimension = modifier and _DIMENSION.search(modifier)
+        # CHARACTER components of length n are arrays of n characters.
+        length = (int(length),) if length and int(length) > 1 else ()
+        for entity in _split_list(entities):
+            entity = _ENTITY.match(entity)
+            if entity is None:
+                continue
+            shape = entity.group('shape') or (
+                dimension and dimension.group('shape'))
+            shape = _extents(shape) if shape else ()
+            self.fields.append(Field(
+                entity.group('name'), c_type, kind,
+                shape if shape is None else shape + length))
+
+    def build(self):
+        return Struct(self.name, self.line, tuple(self.fields), self.lineno)
+
+
+class _RoutineBuilder(_Builder):
+
+    """Collect the information of a routine while its declaration
+part is parsed, `build` returns the immutable routine.
+"""
+
+    def __init__(self, cls, types, line, cName, fName, args, prefix=None,
+                 result=None, aliases=None, lineno=None, derived=None,
+                 external=None):
+        super(_RoutineBuilder, self).__init__(
+            types, line, aliases, derived, lineno, external)
+        self.cls = cls
+        self.name = cName
+        self.fname = fName
+        self.args = [a.strip() for a in args if a]
+        self.attrs = dict((a.upper(), (None, None, False, False, None, None))
+                          for a in self.args)
+        self.resolved = {}
+        self.result = "void"
+        self.result_name = None
+        self.result_kind = None
+        type_spec, self.prefix = _scan_prefix(prefix or "")
+        if cls is Function:
+            self.result_name = (result or fName).upper()
+            self.result = type_spec and self.c_type(*type_spec)
+            self.result_kind = type_spec and self.kind(*type_spec)
+
+    def add_arg(self, args, ftype, kind, modifier, length, array=None,
+                shape=None):
+        """Add argument information to routine information. `array` is
+the name of an argument declared with array specification `shape`, like
+`x(*)`.
+"""
+        intent = spec = None
+        value = dimension = False
+        if modifier:
+            intent = _INTENT.match(modifier)
+            intent = intent and _intern(
+                intent.group('dir').lower().replace(',', ''))
+            lower = modifier.lower()
+            value = 'value' in lower
+            dimension = 'dimension' in lower
+            spec = dimension and _DIMENSION.search(modifier)
+            spec = spec and _shape(spec.group('shape'))
+        key = (ftype, kind, intent == 'in',
+               bool(modifier) and (not value or dimension))
+        # Long argument lists repeat a few types.
+        resolved = self.resolved.get(key)
+        if resolved is None:
+            resolved = self.resolved[key] = (
+                self.c_type(*key), self.kind(ftype, kind))
+        c_type, kind = resolved
+        for arg in [a.strip().upper() for a in args.split(',')]:
+            if arg in self.attrs:
+                self.attrs[arg] = (
+                    c_type, intent or None, value, dimension or arg == array,
+                    _shape(shape) if arg == array and shape else spec or None,
+                    kind)
+            if arg == self.result_name:
+                self.result = c_type
+                self.result_kind = kind
+        return c_type
+
+    def build(self):
+        return self.cls(
+            self.name, self.fname, self.line, self.result,
+            (Argument._make((a,) + self.attrs[a.upper()])
+             for a in self.args),
+            self.lineno, self.prefix, self.result_kind)
+
+
+IR_FORMAT = 'fortran2cheader-ir'
+IR_VERSION = 7
+IR_SUFFIXES = ('.json', '.f2cir')
+
+_IR_MAGIC = b'F2CIR'
+_IR_NONE = 0xffffffff
+_IR_KINDS = ('subroutine', 'function')
+_IR_INTENTS = (None, 'in', 'out', 'inout')
+_IR_HEAD = struct.Struct('<H')
+_IR_COUNT = struct.Struct('<I')
+_IR_FILE = struct.Struct('<IIBI')
+_IR_ROUTINE = struct.Struct('<BIIIIIIII')
+_IR_ARG = struct.Struct('<IIBBII')
+_IR_STRUCT = struct.Struct('<IIII')
+_IR_FIELD = struct.Struct('<IIII')
+
+
+def ir_data(header):
+    """Return the interface parsed by the `Fortran2CHeader` instance
+`header` as dictionary, ready for JSON export.
+"""
+    return {
+        'format': IR_FORMAT,
+        'version': IR_VERSION,
+        'source': header.name,
+        'input': "%s" % header.input,
+        'signed_to_unsigned_char': bool(header.signed_to_unsigned_char),
+        'includes': list(header.includes),
+        'external': dict(header.external),
+        'routines': [{
+            'kind': _IR_KINDS[isinstance(routine, Function)],
+            'name': routine.name,
+            'fname': routine.fname,
+            'line': routine.line,
+            'result': routine.result,
+            'lineno': routine.lineno,
+            'prefix': list(routine.prefix),
+            'result_kind': routine.result_kind,
+            'args': [dict(zip(Argument._fields, arg))
+                     for arg in routine.args]}
+                     for routine in header.info],
+        'structs': [{
+            'name': derived.name,
+            'line': derived.line,
+            'lineno': derived.lineno,
+            'fields': [{'name': field.name, 'c_type': field.c_type,
+                        'kind': field.kind, 'shape': list(field.shape)}
+                       for field in derived.fields]}
+                    for derived in header.structs]}
+
+
+def ir_routines(data):
+    """Return the routines stored in IR dictionary `data`.
+"""
+    return [(Function if routine['kind'] == 'function' else Subroutine)(
+        routine['name'], routine['fname'], routine['line'],
+        routine['result'] and _intern(routine['result']),
+        (Argument(arg['name'], arg['c_type'] and _intern(arg['c_type']),
+                  arg['intent'] and _intern(arg['intent']), arg['value'],
+                  arg['dimension'], arg['shape'] and _intern(arg['shape']),
+                  arg['kind'] and _intern(arg['kind']))
+         for arg in routine['args']), routine['lineno'], routine['prefix'],
+        routine['result_kind'] and _intern(routine['result_kind']))
+        for routine in data['routines']]
+
+
+def ir_structs(data):
+    """Return the derived types stored in IR dictionary `data`.
+"""
+    return [Struct(derived['name'], derived['line'], tuple(
+        Field(field['name'], _intern(field['c_type']),
+              _intern(field['kind']), tuple(field['shape']))
+        for field in derived['fields']), derived['lineno'])
+        for derived in data['structs']]
+
+
+def dump_ir(data, binary=False):
+    """Return IR dictionary `data` encoded as JSON, or in the compact
+binary format if `binary` is true.
+
+The binary format is the magic bytes 'F2CIR' and the version as
+16 bit integer, followed by the zlib compressed table of all strings and
+the file and routine records referring to the strings by index.
+"""
+    if not binary:
+        return (json.dumps(data, indent=1, sort_keys=True) +
+                "\n").encode('utf-8')
+    strings = {}
+
+    def ref(text):
+        if text is None:
+            return _IR_NONE
+        return strings.setdefault(text, len(strings))
+
+    body = [_IR_FILE.pack(
+        ref(data['source']), ref(data['input']),
+        data['signed_to_unsigned_char'], len(data['includes']))]
+    body.extend(_IR_COUNT.pack(ref(i)) for i in data['includes'])
+    body.append(_IR_COUNT.pack(len(data['routines'])))
+    for routine in data['routines']:
+        body.append(_IR_ROUTINE.pack(
+            _IR_KINDS.index(routine['kind']), ref(routine['name']),
+            ref(routine['fname']), ref(routine['line']),
+            ref(routine['result']), len(routine['args']),
+            _IR_NONE if routine['lineno'] is None else routine['lineno'],
+            ref(" ".join(routine['prefix']) or None),
+            ref(routine['result_kind'])))
+        body.extend(_IR_ARG.pack(
+            ref(arg['name']), ref(arg['c_type']),
+            _IR_INTENTS.index(arg['intent']),
+            arg['value'] | arg['dimension'] << 1, ref(arg['shape']),
+            ref(arg['kind']))
+            for arg in routine['args'])
+    body.append(_IR_COUNT.pack(len(data['structs'])))
+    for derived in data['structs']:
+        body.append(_IR_STRUCT.pack(
+            ref(derived['name']), ref(derived['line']),
+            _IR_NONE if derived['lineno'] is None else derived['lineno'],
+            len(derived['fields'])))
+        for field in derived['fields']:
+            body.append(_IR_FIELD.pack(
+                ref(field['name']), ref(field['c_type']),
+                ref(field['kind']), len(field['shape'])))
+            body.append(struct.pack(
+                '<%dI' % len(field['shape']), *field['shape']))
+    body.append(_IR_COUNT.pack(len(data['external'])))
+    body.extend(_IR_COUNT.pack(ref(name)) + _IR_COUNT.pack(ref(base))
+                for name, base in sorted(data['external'].items()))
+    texts = [text.encode('utf-8') for text in sorted(strings, key=strings.get)]
+    table = [_IR_COUNT.pack(len(texts)),
+             struct.pack('<%dI' % len(texts), *(len(i) for i in texts))]
+    return b"".join((_IR_MAGIC, _IR_HEAD.pack(IR_VERSION), zlib.compress(
+        b"".join(table + texts + body))))
+
+
+def load_ir(raw):
+    """Return IR dictionary from `raw` bytes in JSON or binary format.
+"""
+    if not raw.startswith(_IR_MAGIC):
+        data = json.loads(raw.decode('utf-8'))
+        if data.get('format') != IR_FORMAT:
+            raise ValueError("not a fortran2cheader IR file")
+        if data.get('version') != IR_VERSION:
+            raise ValueError("unsupported IR version {}".format(
+                data.get('version')))
+        return data
+    pos = len(_IR_MAGIC)
+    version, = _IR_HEAD.unpack_from(raw, pos)
+    if version != IR_VERSION:
+        raise ValueError("unsupported IR version {}".format(version))
+    raw = zlib.decompress(raw[pos + _IR_HEAD.size:])
+
+    def unpack(fmt):
+        values = fmt.unpack_from(raw, unpack.pos)
+        unpack.pos += fmt.size
+        return values
+
+    unpack.pos = 0
+    count, = unpack(_IR_COUNT)
+    strings = []
+    pos = unpack.pos + 4 * count
+    for size in unpack(struct.Struct('<%dI' % count)):
+        strings.append(raw[pos:pos + size].decode('utf-8'))
+        pos += size
+    unpack.pos = pos
+
+    def string(index):
+        return None if index == _IR_NONE else strings[index]
+
+    source, input_, signed_to_unsigned_char, count = unpack(_IR_FILE)
+    data = {'format': IR_FORMAT,
+            'version': version,
+            'source': string(source),
+            'input': string(input_),
+            'signed_to_unsigned_char': bool(signed_to_unsigned_char),
+            'includes': [string(unpack(_IR_COUNT)[0]) for _ in range(count)],
+            'routines': []}
+    for _ in range(unpack(_IR_COUNT)[0]):
+        (kind, name, fname, line, result, count, lineno, prefix,
+         result_kind) = unpack(_IR_ROUTINE)
+        fields = unpack(struct.Struct('<' + 'IIBBII' * count))
+        args = [{'name': string(fields[i]),
+                 'c_type': string(fields[i + 1]),
+                 'intent': _IR_INTENTS[fields[i + 2]],
+                 'value': bool(fields[i + 3] & 1),
+                 'dimension': bool(fields[i + 3] & 2),
+                 'shape': string(fields[i + 4]),
+                 'kind': string(fields[i + 5])}
+                for i in range(0, len(fields), 6)]
+        data['routines'].append({
+            'kind': _IR_KINDS[kind], 'name': string(name),
+            'fname': string(fname), 'line': string(line),
+            'result': string(result),
+            'lineno': None if lineno == _IR_NONE else lineno,
+            'prefix': (string(prefix) or "").split(),
+            'result_kind': string(result_kind), 'args': args})
+    data['structs'] = []
+    for _ in range(unpack(_IR_COUNT)[0]):
+        name, line, lineno, count = unpack(_IR_STRUCT)
+        fields = []
+        for _ in range(count):
+            field, c_type, kind, ndim = unpack(_IR_FIELD)
+            fields.append({
+                'name': string(field), 'c_type': string(c_type),
+                'kind': string(kind),
+                'shape': list(unpack(struct.Struct('<%dI' % ndim)))})
+        data['structs'].append({
+            'name': string(name), 'line': string(line),
+            'lineno': None if lineno == _IR_NONE else lineno,
+            'fields': fields})
+    count, = unpack(_IR_COUNT)
+    refs = unpack(struct.Struct('<%dI' % (2 * count)))
+    data['external'] = dict((string(refs[i]), string(refs[i + 1]))
+                            for i in range(0, len(refs), 2))
+    return data
+
+
+def value_candidates(routines):
+    """Yield tuples of routine and argument for the scalar `INTENT(IN)`
+arguments of `routines` passed by reference, that could be passed with
+the `VALUE` attribute instead.
+"""
+    for routine in routines:
+        for arg in routine.args:
+            if (arg.intent == 'in' and not arg.value and
+                    not arg.dimension and arg.c_type is not None):
+                yield routine, arg
+
+
+ABI_SUFFIX = '.abi'
+_ABI_HEAD = "# fortran2cheader ABI "
+# The C name is the identifier directly followed by the argument list.
+_ABI_NAME = re.compile(r'(\w+)\(')
+
+
+def abi_signature(routine):
+    """Return the normalized C signature of `routine`. It covers the C
+name, the result type, and the argument types, but not the argument
+names or anything else only affecting the text of the outputs.
+"""
+    return "%s %s(%s)" % (routine.result, routine.name, ", ".join(
+        "%s" % arg.c_type for arg in routine.args) or "void")
+
+
+def struct_signature(derived):
+    """Return the normalized C definition of derived type `derived`,
+covering the component types but not their names.
+"""
+    return "struct %s {%s}" % (derived.name, "; ".join(
+        field.c_type + "".join("[%d]" % i for i in field.shape)
+        for field in derived.fields))
+
+
+def abi_signatures(routines, structs=()):
+    """Return dictionary mapping the C names of `routines` to their
+normalized signatures, and 'struct' followed by the names of the derived
+types `structs` to their normalized definitions. Routines that can not
+be declared, see `untyped`, are not part of the ABI.
+"""
+    signatures = dict((routine.name, abi_signature(routine))
+                      for routine in routines if untyped(routine) is None)
+    signatures.update(("struct " + derived.name, struct_signature(derived))
+                      for derived in structs)
+    return signatures
+
+
+def abi_fingerprint(signatures):
+    """Return the ABI fingerprint for the `signatures` dictionary. The
+fingerprint is independent of the order of the routines.
+
+>>> abi_fingerprint({})
+'da39a3ee5e6b4b0d3255bfef95601890afd80709'
+"""
+    digest = hashlib.sha1()
+    for name in sorted(signatures):
+        digest.update((signatures[name] + "\n").encode('utf-8'))
+    return digest.hexdigest()
+
+
+def dump_abi(signatures):
+    """Return the content of an ABI file for `signatures`: the
+fingerprint followed by the signatures sorted by C name, one per line.
+"""
+    return "".join(
+        [_ABI_HEAD + abi_fingerprint(signatures) + "\n"] +
+        [signatures[name] + "\n" for name in sorted(signatures)])
+
+
+def load_abi(text):
+    """Return the signatures dictionary from the content of an ABI
+file.
+"""
+    lines = text.splitlines()
+    if not lines or not lines[0].startswith(_ABI_HEAD):
+        raise ValueError("not a fortran2cheader ABI file")
+    return dict((_abi_name(line), line) for line in lines[1:] if line.strip())
+
+
+def _abi_name(signature):
+    """Return the key of `signature` in signature dictionaries::
+
+>>> _abi_name("int f(double*)")
+'f'
+>>> _abi_name("(*) getf((*)*)")
+'getf'
+>>> _abi_name("struct point {double; double}")
+'struct point'
+"""
+    if signature.startswith("struct "):
+        return " ".join(signature.split()[:2])
+    return _ABI_NAME.search(signature).group(1)
+
+
+def abi_diff(old, new):
+    """Compare the signatures dictionaries `old` and `new`. Returns
+lists of the added and removed signatures and of tuples of old and new
+signature for the changed ones, all sorted by C name.
+"""
+    added = [new[name] for name in sorted(set(new) - set(old))]
+    removed = [old[name] for name in sorted(set(old) - set(new))]
+    changed = [(old[name], new[name]) for name in sorted(set(old) & set(new))
+               if old[name] != new[name]]
+    return added, removed, changed
+
+
+def read_abi(name, signed_to_unsigned_char=False):
+    """Return the signatures dictionary for file `name`, an ABI file, an
+IR file, or a Fortran source that is parsed.
+"""
+    if name.lower().endswith(ABI_SUFFIX):
+        with io.open(name, encoding='utf-8') as data:
+            return load_abi(data.read())
+    if name.lower().endswith(IR_SUFFIXES):
+        with open(name, 'rb') as data:
+            data = load_ir(data.read())
+            return abi_signatures(ir_routines(data), ir_structs(data))
+    with open(name) as data:
+        header = Fortran2CHeader(
+            data, signed_to_unsigned_char=signed_to_unsigned_char)
+        header.parse()
+        return header.abi()
+
+
+class _IRInput(object):
+
+    """Stand-in for the input file of an interface loaded from an IR
+file.
+"""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def __iter__(self):
+        return iter(())
+
+    def __str__(self):
+        return self.text
+
+
+# C types of `C_FUNPTR` arguments, components, and results.
+FUNPTR_TYPES = frozenset(
+    _qualified("(*)", const, pointer)
+    for const in (False, True) for pointer in (False, True))
+
+
+def declaration(c_type, name):
+    """Return the C declaration of `name` with type `c_type`. The type
+'(*)' used for `C_FUNPTR` is declared as pointer to function::
+
+>>> declaration("const double*", "x")
+'const double* x'
+>>> declaration("(*)", "f")
+'void (*f)(void)'
+>>> declaration("const (*)*", "f")
+'void (* const *f)(void)'
+"""
+    if c_type not in FUNPTR_TYPES:
+        return c_type + " " + name
+    head, _, tail = c_type.partition('(*)')
+    return "void (*%s%s%s)(void)" % (
+        " const " if head.startswith('const') else "", tail, name)
+
+
+# Base class with `abc.ABCMeta` metaclass for Python 2 and 3.
+_ABC = abc.ABCMeta(str('ABC'), (object,), {})
+
+
+class Renderer(_ABC):
+
+    """Base class for rendering parse results to an output format.
+
+A renderer holds all state needed for rendering, so renderers for
+different files and formats may be used concurrently. `header` is the
+`Fortran2CHeader` instance the output is generated for, it is only
+needed for the file head.
+"""
+
+    def __init__(self, header=None):
+        self.header = header
+
+    @staticmethod
+    @abc.abstractmethod
+    def comment(text):
+        """Return `text` formatted as comment.
+"""
+
+    @abc.abstractmethod
+    def head(self, name):
+        """Return the head of output file `name`.
+"""
+
+    def tail(self):
+        """Return the tail of the output file, `None` if there is none.
+"""
+        return None
+
+    @abc.abstractmethod
+    def routine(self, routine):
+        """Return the declaration of `routine`.
+"""
+
+    @abc.abstractmethod
+    def struct(self, derived):
+        """Return the declaration of derived type `derived`.
+"""
+
+    @staticmethod
+    def arg(arg):
+        """Return the declaration of argument `arg`.
+"""
+        return declaration(arg.c_type, arg.name)
+
+    @staticmethod
+    def field(field):
+        """Return the declaration of struct component `field`.
+"""
+        return declaration(field.c_type, field.name + "".join(
+            "[%d]" % i for i in field.shape))
+
+    def _args(self, routine):
+        """Return the declarations of the arguments of `routine`.
+Arguments of other than `C_FUNPTR` type are declared directly, renderers
+changing `arg` for them override this method.
+"""
+        return ', '.join([
+            arg.c_type + " " + arg.name if arg.c_type not in FUNPTR_TYPES
+            else self.arg(arg) for arg in routine.args])
+
+    def begin(self, name):
+        return self.head(name) + "\n"
+
+    def end(self):
+        tail = self.tail()
+        if tail is None:
+            return "\n"
+        return "\n" + tail + "\n"
+
+    def render(self, name, routines, structs=()):
+        """Return the content of output file `name` declaring the
+derived types `structs` and `routines`.
+"""
+        return "".join((
+            self.begin(name),
+            "\n".join([self.struct(i) for i in structs] +
+                      [self.routine(routine) for routine in routines]),
+            self.end()))
+
+
+# Qualifier for pointer arguments, defined by headers generated with
+# `restrict`.
+RESTRICT = "F2CH_RESTRICT"
+_RESTRICT_DEFINITION = (
+    "#ifndef %s" % RESTRICT,
+    "#if defined(__cplusplus) && defined(_MSC_VER)",
+    "#define %s __restrict" % RESTRICT,
+    "#elif defined(__cplusplus)",
+    "#define %s __restrict__" % RESTRICT,
+    "#elif defined(__STDC_VERSION__) && __STDC_VERSION__ >= 199901L",
+    "#define %s restrict" % RESTRICT,
+    "#else",
+    "#define %s" % RESTRICT,
+    "#endif",
+    "#endif /* %s */" % RESTRICT,
+    "")
+
+
+# Attributes for routines without side effects, defined by headers
+# generated with `attributes`. `const` is not used, `PURE` routines may
+# read module variables and the targets of pointer arguments.
+PURE = "F2CH_PURE"
+NOTHROW = "F2CH_NOTHROW"
+_ATTRIBUTE_DEFINITION = (
+    "#ifndef %s" % PURE,
+    "#if defined(__GNUC__)",
+    "#define %s __attribute__((__pure__, __nothrow__))" % PURE,
+    "#define %s __attribute__((__nothrow__))" % NOTHROW,
+    "#else",
+    "#define %s" % PURE,
+    "#define %s" % NOTHROW,
+    "#endif",
+    "#endif /* %s */" % PURE,
+    "")
+
+
+def restrictable(arg):
+    """Return whether argument `arg` is passed as pointer to the actual
+argument. Fortran does not allow such arguments to alias, so they can be
+declared `restrict`. `C_PTR` values are pointers to arbitrary data.
+"""
+    return (arg.c_type is not None and arg.c_type.endswith('*') and
+            not arg.c_type.endswith('void*') and
+            (not arg.value or arg.dimension))
+
+
+def untyped(routine):
+    """Return why `routine` can not be declared, as the C type of its
+result or of an argument is unknown, `None` if all types are known.
+"""
+    if routine.result is None:
+        return "the result type is unknown"
+    for arg in routine.args:
+        if arg.c_type is None:
+            return "argument '%s' has no C type" % arg.name
+    return None
+
+
+def base_type(c_type):
+    """Return `c_type` without qualifiers and pointers::
+
+>>> base_type("const point**")
+'point'
+"""
+    return c_type.replace('const ', '').rstrip('*').strip()
+
 
-# FUNCTION C_CALLOC(elt_count, elt_size) RESULT(ptr) BIND(C, NAME="calloc")
-_FUNCTION = re.compile(
-    r'''
-    ^
-    (?P<prefix> .+)?? \s*
-    (?: ''' + casi("FUNCTION") + r''' ) \s+
-    (?P<fName> \w+ ) \s*
-    ''' + _ARGS +
-    '''
-    (?: ''' + casi("RESULT") + r''' \s*
-    [(] \s* (?P<result> .+? ) [)] ) \s*
-    ''' +
-    _BIND, re.VERBOSE)
-# INTEGER(C_INT), INTENT(IN), VALUE :: iUnit
-_VARTYPE = re.compile(
-    r'''
-    ^
-    (?P<ftype>
-      (?: ''' + casi("INTEGER") + ''' ) |
-      (?: ''' + casi("REAL") + ''' ) |
-      (?: ''' + casi("COMPLEX") + ''' ) |
-      (?: ''' + casi("LOGICAL") + ''' ) |
-      (?: ''' + casi("CHARACTER") + ''' ) |
-      (?: ''' + casi("TYPE") + r''' )
-    )
-    \( \s*
-      (?:
-        (?:
-          (?: (?: ''' + casi("KIND=") + r''' )? (?P<kind> [\w\d]+ ) )? |
-          (?: (?: ''' + casi("LEN=") + r''' ) (?P<length> [\d]+ ) )?
-        ) \s* ,?
-      )*
-    \s* \) \s*
-    (?P<modifier> (?: , \s* [*\w()]+ \s* )+ )? :: \s*
-    (?P<args> (?: [\w]+ \s* ,? \s* )* )
-    ''', re.VERBOSE)
+class CHeaderRenderer(Renderer):
 
-_INTENT = re.compile(".*" + casi("intent") + r"\s*\(\s*(?P<dir> " +
-                     '(?:' + casi("IN") + ")|" +
-                     '(?:' + casi("OUT") + ")|" +
-                     '(?:' + casi("INOUT") + ")|" +
-                     '(?:' + casi("IN,OUT") + r"))\s*\).*", re.VERBOSE)
+    """Render C/C++ header files. If `restrict` is true, arguments
+passed by reference are declared with the `restrict` qualifier, using
+the `RESTRICT` macro defined in the head as `restrict` for C99 and as
+`__restrict__` or `__restrict` for C++. If `attributes` is true, `PURE`
+and `ELEMENTAL` functions are declared with the `PURE` macro, such
+subroutines with the `NOTHROW` macro, both defined in the head as GCC
+attributes.
+"""
 
-_TYPE = re.compile(
-    r'''(?P<ftype>
-      (?: ''' + casi("INTEGER") + ''' ) |
-      (?: ''' + casi("REAL") + ''' ) |
-      (?: ''' + casi("COMPLEX") + ''' ) |
-      (?: ''' + casi("LOGICAL") + ''' ) |
-      (?: ''' + casi("CHARACTER") + ''' ) |
-      (?: ''' + casi("TYPE") + r''' )
-    )
-    \( \s* (?P<kind> [\w\d=]+ ) \s* \)
-    ''', re.VERBOSE)
+    def __init__(self, header=None, restrict=False, attributes=False):
+        super(CHeaderRenderer, self).__init__(header)
+        self.restrict = restrict
+        self.attributes = attributes
 
-_INTERFACE = re.compile('^' + casi('INTERFACE') + '$')
-_END_INTERFACE = re.compile('^' + casi('END INTERFACE') + '$')
+    @staticmethod
+    def comment(text):
+        return "/*\n%s\n */\n" % ('\n'.join([
+            ('  ' + i).rstrip() for i in text.split('\n')]),)
 
+    def head(self, name):
+        header = self.header
+        external = header.external
+        return "\n".join(s.rstrip() for s in (
+            self.comment("\n".join((
+                "%s" % name,
+                "Header file generated from parsing ISO_C_BINDING "
+                "information",
+                "from %s." % header.name,
+                "",
+                "Generated by %s, version %s." % (
+                    sys.argv[0], __scm_version__.strip())))),
+            "",
+            "#ifndef %s_H" % header.basename.upper(),
+            "#define %s_H" % header.basename.upper(),
+            "") + tuple(
+            '#include "%s.h"' % i for i in sorted(set(external.values()))) + (
+            ("",) if external else ()) + (
+            _RESTRICT_DEFINITION if self.restrict else ()) + (
+            _ATTRIBUTE_DEFINITION if self.attributes else ()) + (
+            "#ifdef __cplusplus",
+            'extern "C" {',
+            "#endif /* __cplusplus */",
+            ""))
 
-def file_newer(new, old):
-    n_time = os.path.getmtime(new)
-    o_time = os.path.getmtime(old)
-    return n_time > o_time
+    def tail(self):
+        return "\n".join((
+            "",
+            "#ifdef __cplusplus",
+            '} /* extern "C" */',
+            "#endif /* __cplusplus */",
+            "",
+            "#endif /* %s_H */" % self.header.basename.upper()))
 
+    def arg(self, arg):
+        if self.restrict and restrictable(arg):
+            return declaration(arg.c_type, "%s %s" % (RESTRICT, arg.name))
+        return declaration(arg.c_type, arg.name)
 
-class FortranSourceProvider(object):
+    def _args(self, routine):
+        if not self.restrict:
+            return super(CHeaderRenderer, self)._args(routine)
+        return ', '.join([self.arg(arg) for arg in routine.args])
 
-    """Provide concatenated Fortran source lines for analysis.
+    def attribute(self, routine):
+        """Return the attribute macro for `routine`, prefixed by a
+blank, or an empty string.
 """
+        if not (self.attributes and routine.pure):
+            return ""
+        return " " + (PURE if isinstance(routine, Function) else NOTHROW)
 
-    def __init__(self, data):
-        self.file = iter(data)
+    def routine(self, routine):
+        problem = untyped(routine)
+        if problem is not None:
+            return "/* %s: not declared, %s. */\n" % (routine.name, problem)
+        return "".join((
+            self.comment(routine.comment.text),
+            "extern ", declaration(routine.result, "%s(%s)" % (
+                routine.name, self._args(routine) or 'void')),
+            "%s;\n" % self.attribute(routine)))
 
-    def __iter__(self):
-        return self
+    def struct(self, derived):
+        return "".join((
+            self.comment(derived.comment.text),
+            "typedef struct %s {\n" % derived.name,
+            "".join("    %s;\n" % self.field(i) for i in derived.fields),
+            "} %s;\n" % derived.name))
 
-    def _read(self):
-        """Return next raw line from input file, ignoring empty lines
-and comments.
+
+class PxdRenderer(Renderer):
+
+    """Render Cython pxd files. `c_header` is the name of the C header
+file declared, default is the header generated for the input file.
 """
-        line = None
-        while line is None:
-            line = next(self.file).strip()
-            pos = line.find('!')
-            if pos >= 0:
-                line = line[:pos]
-        return line
 
-    def next(self):
-        """Return next line.
+    def __init__(self, header=None, c_header=None):
+        super(PxdRenderer, self).__init__(header)
+        self.c_header = c_header
+
+    @staticmethod
+    def comment(text):
+        return '\n'.join([("# " + t).strip() for t in text.split('\n')])
+
+    def head(self, name):
+        c_header = self.c_header
+        if c_header is None:
+            c_header = "%s.h" % self.header.basename
+        external = self.header.external
+        return "\n".join(s.rstrip() for s in (
+            self.comment("\n".join((
+                "%s" % name,
+                "Cython Header file generated from parsing ISO_C_BINDING "
+                "information",
+                "from %s." % self.header.input,
+                "",
+                "Generated by %s, version %s." % (
+                    os.path.split(sys.argv[0])[-1],
+                    __scm_version__.strip())))),
+            "") + tuple(
+            "from %s cimport %s" % (module, name) for name, module in
+            sorted(external.items())) + (("",) if external else ()) + (
+            'cdef extern from "%s" nogil:' % (c_header,),))
+
+    def routine(self, routine):
+        problem = untyped(routine)
+        if problem is not None:
+            return "\n" + self.comment(
+                "%s: not declared, %s." % (routine.name, problem))
+        return "".join((
+            self.comment(routine.comment.text),
+            "\n    %s" % declaration(routine.result, "%s(%s)" % (
+                routine.name, self._args(routine))).replace(
+                    '_Complex', 'complex').replace('(void)', '()')))
+
+    @staticmethod
+    def field(field):
+        return Renderer.field(field).replace('_Complex', 'complex').replace(
+            '(void)', '()')
+
+    def struct(self, derived):
+        return "".join((
+            self.comment(derived.comment.text),
+            "\n    ctypedef struct %s:" % derived.name,
+            "".join("\n        %s" % self.field(i) for i in derived.fields)))
+
+
+# ctypes type and NumPy type code for the `ISO_C_BINDING` kinds, used
+# for the layout of derived types. The `c_int_fast*_t` kinds are
+# missing, their size differs between C libraries.
+_LAYOUTS = {
+    'c_int': ('c_int', 'i'),
+    'c_short': ('c_short', 'i'),
+    'c_long': ('c_long', 'i'),
+    'c_long_long': ('c_longlong', 'i'),
+    'c_size_t': ('c_size_t', 'u'),
+    'c_int8_t': ('c_int8', 'i'),
+    'c_int16_t': ('c_int16', 'i'),
+    'c_int32_t': ('c_int32', 'i'),
+    'c_int64_t': ('c_int64', 'i'),
+    'c_int_least8_t': ('c_int8', 'i'),
+    'c_int_least16_t': ('c_int16', 'i'),
+    'c_int_least32_t': ('c_int32', 'i'),
+    'c_int_least64_t': ('c_int64', 'i'),
+    'c_intmax_t': ('c_int64', 'i'),
+    'c_intptr_t': ('c_ssize_t', 'i'),
+    'c_signed_char': ('c_byte', 'i'),
+    'c_float': ('c_float', 'f'),
+    'c_double': ('c_double', 'f'),
+    'c_long_double': ('c_longdouble', 'f'),
+    'c_float_complex': ('c_float', 'c'),
+    'c_double_complex': ('c_double', 'c'),
+    'c_long_double_complex': ('c_longdouble', 'c'),
+    'c_bool': ('c_bool', '?'),
+    'c_char': ('c_char', 'S'),
+    'c_ptr': ('c_void_p', 'u'),
+    'c_funptr': ('c_void_p', 'u')}
+
+
+def _identifier(name):
+    """Return `name` usable as Python identifier.
 """
-        line = self._read()
-        while line.endswith('&'):
-            line = line[:-1]
-            nLine = self._read()
-            if nLine.startswith('&'):
-                nLine = nLine[1:]
-            line += nLine
-        return line.strip()
+    return name + '_' if keyword.iskeyword(name) else name
 
-    __next__ = next
 
+def _element_layout(field, layouts):
+    """Return size, alignment, and NumPy format, as Python expression,
+of one element of struct component `field`, `None` if the layout is not
+known.
+"""
+    if field.kind in layouts:
+        layout = layouts[field.kind]
+        return layout[1], layout[2], _identifier(field.kind)
+    if field.kind not in _LAYOUTS:
+        return None
+    name, code = _LAYOUTS[field.kind]
+    c_class = getattr(ctypes, name)
+    size = ctypes.sizeof(c_class)
+    if code == 'c':
+        size *= 2
+    elif code == 'i' and field.c_type.startswith('unsigned'):
+        code = 'u'
+    fmt = code if code in '?S' else code + "%d" % size
+    return size, ctypes.alignment(c_class), "'%s'" % fmt
 
-class Comment(object):
 
-    """Provide C comments.
+def struct_layout(derived, layouts=None):
+    """Return the layout of derived type `derived` following the C ABI
+of the running platform, as tuple of the offsets of the components, the
+size, and the alignment. `layouts` maps the C names of the derived types
+used as component types to their layouts. Returns `None` if the layout
+of a component type is not known.
 """
-    flavour = "C"
+    offsets = []
+    size = 0
+    alignment = 1
+    for field in derived.fields:
+        element = _element_layout(field, layouts or {})
+        if element is None:
+            return None
+        count = 1
+        for extent in field.shape:
+            count *= extent
+        size += -size % element[1]
+        offsets.append(size)
+        size += count * element[0]
+        alignment = max(alignment, element[1])
+    return tuple(offsets), size + -size % alignment, alignment
 
-    def __init__(self, text):
-        self.text = text
 
-    def __str__(self):
-        text = self.text.split('\n')
-        if Comment.flavour == 'C':
-            return "/*\n%s\n */\n" % ('\n'.join(
-                ('  %s' % i).rstrip() for i in text),)
-        if Comment.flavour == 'pxd':
-            return '\n'.join((("# %s" % t).strip() for t in text))
-        return '\n'.join(text)
-
-
-class _Routine(object):
-
-    """Base class for representing Fortran routines.
-"""
-    f_kinds = {
-        'integer': {
-            "c_int": "int",
-            "c_short": "short int",
-            "c_long": "long int",
-            "c_long_long": "long long int",
-            "c_size_t": "size_t",
-            "c_int8_t": "int8_t",
-            "c_int16_t": "int16_t",
-            "c_int32_t": "int32_t",
-            "c_int64_t": "int64_t",
-            "c_int_least8_t": "int_least8_t",
-            "c_int_least16_t": "int_least16_t",
-            "c_int_least32_t": "int_least32_t",
-            "c_int_least64_t": "int_least64_t",
-            "c_int_fast8_t": "int_fast8_t",
-            "c_int_fast16_t": "int_fast16_t",
-            "c_int_fast32_t": "int_fast32_t",
-            "c_int_fast64_t": "int_fast64_t",
-            "c_intmax_t": "intmax_t",
-            "c_intptr_t": "intptr_t"},
-        'real': {
-            "c_float": "float",
-            "c_double": "double",
-            "c_long_double": "long double"},
-
-
-        'complex': {
-            "c_float_complex": "float _Complex",
-            "c_double_complex": "double _Complex",
-            "c_long_double_complex": "long double _Complex"},
-        'logical': {
-            "c_bool": "char"},  # "_Bool"},
-        'character': {
-            "c_char": "char"},
-        'type': {
-            "c_ptr": "void*",
-            "c_funptr": "(*)"}}
+class DtypeRenderer(Renderer):
 
-    def __init__(self, signed_to_unsigned_char):
-        if signed_to_unsigned_char:
-            self.f_kinds['integer']["c_signed_char"] = "unsigned char"
-        else:
-            self.f_kinds['integer']["c_signed_char"] = "signed char"
-        self.argdict = {}
-        self.uargs = []
-        self.comment = None
-        self.name = None
-        self.result = None
+    """Render Python modules defining NumPy structured dtypes for the
+`BIND(C)` derived types. Offsets and item sizes are explicit and follow
+the C ABI of the platform generating the module, so NumPy arrays of
+these dtypes can be passed to the Fortran routines without copying.
+Routines are not rendered.
+"""
 
-    def __str__(self):
-        out = "%s" % self.comment
-        args = ', '.join("%s %s" % tuple(self.argdict[arg])
-                         for arg in self.uargs)
-        if Comment.flavour == 'C':
-            if not args:
-
-                args = 'void'
-            proto = (" ".join(("extern", self.result, self.name)) +
-                     '(%s);\n' % args)
-        elif Comment.flavour == 'pxd':
-            proto = "\n    %s" % (
-                " ".join((self.result, self.name)) +
-                '(%s)\n' % args.replace('_Complex', 'complex'))
-
-        out += proto
-        return out
-
-    def add_arg(self, args, ftype, kind, modifier, length):
-        """Add argument information to Subroutine information.
-"""
-        c_type = self.f_kinds.get(ftype.lower(), {}).get(kind.lower(), None)
-        intent = modifier and _INTENT.match(modifier)
-        if c_type and modifier and intent and \
-           intent.groupdict()['dir'].lower() == 'in':
-            c_type = "const " + c_type
-        if c_type and modifier and \
-            ('value' not in modifier.lower() or
-             'dimension' in modifier.lower()):
-            c_type += '*'
-        # if c_type and modifier and 'dimension' in modifier.lower():
-        #     c_type += '*'
-        for arg in (a.strip().upper() for a in args.split(',')):
-            if arg in self.uargs:
-                self.argdict[arg][0] = c_type
+    def __init__(self, header=None):
+        super(DtypeRenderer, self).__init__(header)
+        self.layouts = {}
+
+    @staticmethod
+    def comment(text):
+        return '\n'.join((("# %s" % t).strip() for t in text.split('\n')))
+
+    def head(self, name):
+        return "\n".join((
+            self.comment("\n".join((
+                "%s" % name,
+                "NumPy dtypes generated from parsing ISO_C_BINDING "
+                "information",
+                "from %s." % self.header.name,
+                "",
+                "Offsets and sizes follow the C ABI of the generating "
+                "platform.",
+                "",
+                "Generated by %s, version %s." % (
+                    os.path.split(sys.argv[0])[-1],
+                    __scm_version__.strip())))),
+            "",
+            "import numpy",
+            ""))
+
+    def routine(self, routine):
+        return ""
+
+    def _format(self, field):
+        fmt = _element_layout(field, self.layouts)[2]
+        shape = field.shape
+        if fmt == "'S'":
+            fmt = "'S%d'" % (shape[-1] if shape else 1)
+            shape = shape[:-1]
+        return "(%s, %r)" % (fmt, shape) if shape else fmt
+
+    def struct(self, derived):
+        layout = struct_layout(derived, self.layouts)
+        if layout is None:
+            return "".join((
+                self.comment(derived.comment.text),
+                "\n# No dtype, the layout of the component types is "
+                "platform dependent.\n"))
+        self.layouts[derived.name] = layout
+        return "".join((
+            self.comment(derived.comment.text),
+            "\n%s = numpy.dtype({\n" % _identifier(derived.name),
+            "    'names': [%s],\n" % ", ".join(
+                "'%s'" % i.name for i in derived.fields),
+            "    'formats': [%s],\n" % ", ".join(
+                self._format(i) for i in derived.fields),
+            "    'offsets': [%s],\n" % ", ".join(
+                "%d" % i for i in layout[0]),
+            "    'itemsize': %d,\n" % layout[1],
+            "    'aligned': True})\n"))
+
+    def render(self, name, routines, structs=()):
+        return "".join((
+            self.begin(name),
+            "\n".join(self.struct(i) for i in structs),
+            self.end()))
+
+
+# C types of the scalar arguments usable as array extents.
+_EXTENT_TYPES = frozenset(
+    F_KINDS['integer'].values()) | frozenset(("unsigned char",))
+
+
+class PyxRenderer(Renderer):
+
+    """Render Cython modules defining Python wrappers for the routines,
+which call them with the GIL released, so threads can run them in
+parallel. The routines are taken from the generated pxd file, `module`
+is its module name, default is the one of the input file.
+
+Array arguments are taken as contiguous typed memoryviews, like NumPy
+arrays flattened in Fortran order, and passed without copying. Arrays
+with extents given by constants or integer arguments are checked to have
+enough elements before the call, raising `ValueError` otherwise. `VALUE`
+arguments are passed directly, other scalars by reference to a local
+copy. The wrappers return the function result followed by the values of
+the `INTENT(OUT)` and `INTENT(INOUT)` scalars. `C_PTR` values are
+passed as integer addresses. Routines with argument types that can not
+be wrapped are listed in comments only.
+"""
+
+    def __init__(self, header=None, module=None):
+        super(PyxRenderer, self).__init__(header)
+        self.module = module
+        # Derived types declared by the pxd file.
+        self.derived = frozenset() if header is None else frozenset(
+            chain(header.derived.values(), header.external))
+
+    @staticmethod
+    def comment(text):
+        return '\n'.join((("# %s" % t).strip() for t in text.split('\n')))
+
+    def head(self, name):
+        module = self.module or self.header.basename
+        return "\n".join((
+            self.comment("\n".join((
+                "%s" % name,
+                "Cython module generated from parsing ISO_C_BINDING "
+                "information",
+                "from %s." % self.header.name,
+                "",
+                "Generated by %s, version %s." % (
+                    os.path.split(sys.argv[0])[-1],
+                    __scm_version__.strip())))),
+            "",
+            "cimport %s" % module))
+
+    def _type(self, c_type):
+        """Return Cython spelling of C type `c_type`, derived types are
+qualified by the module name.
+"""
+        c_type = c_type.replace('_Complex', 'complex')
+        base = base_type(c_type)
+        if base in self.derived:
+            c_type = c_type.replace(
+                base, "%s.%s" % (self.module or self.header.basename, base))
         return c_type
 
+    @staticmethod
+    def _unsupported(routine):
+        """Return why `routine` can not be wrapped, `None` if it can.
+"""
+        problem = untyped(routine)
+        if problem is not None:
+            return problem
+        for arg in routine.args:
+            if '(*)' in arg.c_type:
+                return "argument '%s' is a procedure" % arg.name
+            if arg.dimension and arg.c_type.endswith('void**'):
+                return "argument '%s' is an array of pointers" % arg.name
+        return None
 
-class Subroutine(_Routine):
+    @staticmethod
+    def _size(shape, known):
+        """Return Cython expression for the number of elements of an
+array with Fortran array specification `shape`, `None` if it is not
+known before the call. `known` maps the lower case names of the scalar
+arguments passed in to their Python names.
+"""
+        factors = []
+        for dim in shape.split(', '):
+            lower, _, upper = dim.rpartition(':')
+            lower = lower or '1'
+            try:
+                factors.append("%d" % max(int(upper) - int(lower) + 1, 0))
+            except ValueError:
+                if lower != '1' or upper.lower() not in known:
+                    return None
+                factors.append(known[upper.lower()])
+        return " * ".join(factors)
 
-    """Representing Fortran SUBBROUTINEs
+    def _checks(self, routine):
+        """Return the statements checking that the arrays passed to
+`routine` have at least the number of elements given by their array
+specifications.
 """
+        known = dict(
+            (arg.name.lower(), _identifier(arg.name)) for arg in routine.args
+            if not arg.dimension and arg.intent != 'out' and
+            base_type(arg.c_type) in _EXTENT_TYPES)
+        checks = []
+        for arg in routine.args:
+            size = arg.dimension and arg.shape and self._size(
+                arg.shape, known)
+            if size:
+                name = _identifier(arg.name)
+                checks.extend((
+                    "if %s.shape[0] < %s:" % (name, size),
+                    "    raise ValueError(",
+                    "        \"argument '%s' needs %%d elements, "
+                    "got %%d\" %%" % arg.name,
+                    "        (%s, %s.shape[0]))" % (size, name)))
+        return checks
 
-    def __init__(self, line, cName, fName, args, signed_to_unsigned_char):
-        super(Subroutine, self).__init__(signed_to_unsigned_char)
-        self.comment = Comment(
-            '\n'.join((
-                "%s" % cName,
-                "Generated from FORTRAN routine '%s'" % fName,
-                "FORTRAN declaration:\n    %s" % line)))
-        self.name = cName
-        args = [a.strip() for a in args if a]
-        self.uargs = [a.upper() for a in args]
-        self.argdict = {a.upper(): [None, a] for a in args}
-        self.result = "void"
+    def routine(self, routine):
+        problem = self._unsupported(routine)
+        if problem is not None:
+            return "\n\n" + self.comment(
+                "%s: not wrapped, %s." % (routine.name, problem))
+        module = self.module or self.header.basename
+        params, decls, call, results = [], [], [], []
+        for arg in routine.args:
+            name = _identifier(arg.name)
+            local = "_" + arg.name
+            c_type = self._type(arg.c_type)
+            # `C_PTR` values are passed as addresses.
+            address = c_type.endswith('void*')
+            if not c_type.endswith('*') or address:
+                if address:
+                    params.append(("size_t", name))
+                    call.append("<%s>%s" % (c_type, name))
+                else:
+                    params.append((c_type, name))
+                    call.append(name)
+            elif arg.dimension:
+                params.append(("%s[::1]" % c_type[:-1], name))
+                decls.append("cdef %s %s = &%s[0] if %s.shape[0] else NULL" %
+                             (c_type, local, name, name))
+                call.append(local)
+            else:
+                pointee = c_type[:-1].replace('const ', '')
+                address = pointee.endswith('void*')
+                if arg.intent == 'out':
+                    decls.append("cdef %s %s" % (pointee, local))
+                else:
+                    params.append(("size_t" if address else pointee, name))
+                    decls.append("cdef %s %s = %s%s" % (
+                        pointee, local, "<void*>" if address else "", name))
+                call.append("<%s>&%s" % (c_type, local)
+                            if address and c_type.startswith('const') else
+                            "&" + local)
+                if arg.intent != 'in':
+                    results.append((arg.name, "<size_t>" + local
+                                    if address else local))
+        call = "%s.%s(%s)" % (module, routine.name, ", ".join(call))
+        if routine.result != 'void':
+            result = self._type(routine.result)
+            decls.insert(0, "cdef %s _result" % result)
+            call = "_result = " + call
+            results.insert(0, ("result", "<size_t>_result"
+                               if result.endswith('void*') else "_result"))
+        signature = "%s(%s)" % (
+            routine.name, ", ".join(i[1] for i in params))
+        if results:
+            signature += " -> " + ", ".join(i[0] for i in results)
+        lines = [
+            "",
+            "",
+            "def %s(%s):" % (_identifier(routine.name), ", ".join(
+                "%s %s%s" % (c_type, name, " not None" * (
+                    c_type.endswith(']')))
+                for c_type, name in params)),
+            '    """%s' % signature,
+            "",
+            "    Call FORTRAN routine '%s' with the GIL released." %
+            routine.fname,
+            '    """']
+        lines.extend("    " + i for i in decls + self._checks(routine))
+        lines.extend(("    with nogil:", "        " + call))
+        if results:
+            lines.append("    return " + ", ".join(i[1] for i in results))
+        return "\n".join(lines)
 
+    def struct(self, derived):
+        return ""
 
-class Function(_Routine):
+    def render(self, name, routines, structs=()):
+        return "".join((
+            self.begin(name),
+            "\n".join(self.routine(routine) for routine in routines),
+            self.end()))
 
-    """Representing Fortran FUNCTIONs
+
+# C types the cffi parser does not support.
+_CFFI_UNSUPPORTED = ('long double _Complex',)
+
+
+class CffiRenderer(Renderer):
+
+    """Render cffi build scripts, an alternative to the Cython modules
+not needing Cython and usable with PyPy. The script defines the cdef
+string `CDEF` declaring the derived types and routines, and builds the
+extension module `module`, default is the basename of the input file
+with prefix '_' and suffix '_cffi', in API mode, compiling against the
+C header `c_header`, default is the header generated for the input
+file. Routines and components with types cffi does not support are
+listed in comments only, derived types with such components are
+declared partial, leaving their layout to the C compiler.
 """
 
-    def __init__(self, line, cName, fName, prefix, result, args,
-                 signed_to_unsigned_char):
-        super(Function, self).__init__(signed_to_unsigned_char)
-        self.comment = Comment(
-            '\n'.join((
-                "%s" % cName,
-                "Generated from FORTRAN routine '%s'" % fName,
-                "FORTRAN declaration:\n    %s" % line)))
-        self.name = cName
-        args = [a.strip() for a in args if a]
-        self.uargs = [a.upper() for a in args]
-        self.argdict = {a.upper(): [None, a] for a in args}
-        if result:
-            self.resultN = result
-        else:
-            self.resultN = fName
-        prefix = prefix and _TYPE.match(prefix)
-        if prefix:
-            self.result = self.f_kinds.get(
-                prefix.group('ftype').lower(), {}
-            ).get(prefix.group('kind').lower(), None)
-        else:
-            self.result = None
+    def __init__(self, header=None, c_header=None, module=None):
+        super(CffiRenderer, self).__init__(header)
+        self.c_header = c_header
+        self.module = module
+
+    @staticmethod
+    def comment(text):
+        return '\n'.join((("# %s" % t).strip() for t in text.split('\n')))
 
-    def add_arg(self, args, ftype, kind, modifier, length):
-        """Add argument information to Subroutine information.
+    def head(self, name):
+        module = self.module or "_%s_cffi" % self.header.basename
+        c_header = self.c_header or "%s.h" % self.header.basename
+        return "\n".join((
+            self.comment("\n".join((
+                "%s" % name,
+                "cffi build script generated from parsing ISO_C_BINDING "
+                "information",
+                "from %s." % self.header.name,
+                "",
+                "Builds the extension module '%s' in API mode. Add the "
+                "libraries" % module,
+                "providing the routines to LIBRARIES before running it.",
+                "",
+                "Generated by %s, version %s." % (
+                    os.path.split(sys.argv[0])[-1],
+                    __scm_version__.strip())))),
+            "",
+            "import os",
+            "",
+            "from cffi import FFI",
+            "",
+            'MODULE = "%s"' % module,
+            'HEADER = "%s"' % c_header,
+            "LIBRARIES = []",
+            "",
+            'CDEF = """') + tuple(
+            "/* derived type '%s' from '%s.h' */\n"
+            "typedef struct %s { ...; } %s;\n" % (name, base, name, name)
+            for name, base in sorted(self.header.external.items())))
+
+    def tail(self):
+        return "\n".join((
+            '"""',
+            "",
+            "ffibuilder = FFI()",
+            "ffibuilder.cdef(CDEF)",
+            "ffibuilder.set_source(",
+            "    MODULE, '#include \"%s\"' % HEADER, libraries=LIBRARIES,",
+            "    include_dirs=[os.path.dirname(os.path.abspath(__file__))])",
+            "",
+            'if __name__ == "__main__":',
+            "    ffibuilder.compile(verbose=True)"))
+
+    @staticmethod
+    def _unsupported(routine):
+        """Return why `routine` can not be declared, `None` if it can.
 """
-        c_type = super(Function, self).add_arg(
-            args, ftype, kind, modifier, length)
-        args = [a.strip().upper() for a in args.split(',')]
-        if self.resultN.upper() in args:
-            self.result = c_type
+        problem = untyped(routine)
+        if problem is not None:
+            return problem
+        if routine.result.startswith(_CFFI_UNSUPPORTED):
+            return "cffi does not support '%s'" % routine.result
+        for arg in routine.args:
+            if arg.c_type.replace('const ', '').startswith(
+                    _CFFI_UNSUPPORTED):
+                return "cffi does not support '%s'" % arg.c_type
+        return None
+
+    @staticmethod
+    def arg(arg):
+        # `C_BOOL` values are declared as `_Bool`, so cffi converts them
+        # from and to Python booleans. The header declares them as `char`,
+        # which C converts implicitly, but not for pointers.
+        if arg.kind == 'c_bool' and arg.c_type == 'char':
+            return declaration("_Bool", arg.name)
+        return Renderer.arg(arg)
+
+    def _args(self, routine):
+        return ', '.join([self.arg(arg) for arg in routine.args])
+
+    def routine(self, routine):
+        problem = self._unsupported(routine)
+        if problem is not None:
+            return "/* %s: not declared, %s. */\n" % (routine.name, problem)
+        result = routine.result
+        if routine.result_kind == 'c_bool' and result == 'char':
+            result = "_Bool"
+        return "/* FORTRAN routine '%s' */\n%s;\n" % (
+            routine.fname, declaration(result, "%s(%s)" % (
+                routine.name, self._args(routine) or 'void')))
+
+    def struct(self, derived):
+        fields = [i for i in derived.fields
+                  if not i.c_type.startswith(_CFFI_UNSUPPORTED)]
+        return "".join((
+            "/* FORTRAN derived type '%s' */\n" % derived.name,
+            "typedef struct %s {\n" % derived.name,
+            "".join("    %s;\n" % self.field(i) for i in fields),
+            "    ...;\n" if len(fields) < len(derived.fields) else "",
+            "} %s;\n" % derived.name))
 
 
 class Fortran2CHeader(object):
@@ -422,144 +3001,592 @@ Only arguments with type kinds from `ISO_C_BINDING` module."""
 
         self.signed_to_unsigned_char = kw.get(
             'signed_to_unsigned_char', False)
+        self.types = TypeTable.get(self.signed_to_unsigned_char)
         self.force = kw.get('force', False)
         self.generate_pxd = kw.get('generate_pxd', True)
+        self.generate_dtypes = kw.get('generate_dtypes', False)
+        self.generate_pyx = kw.get('generate_pyx', False)
+        self.generate_cffi = kw.get('generate_cffi', False)
+        self.restrict = kw.get('restrict', False)
+        self.attributes = kw.get('attributes', False)
+        self.line_budget = kw.get('line_budget', 1.)
+        self.slow_lines = []
+        self.include_dirs = kw.get('include_dirs', ())
+        self.includes = []
+        self.structs = []
+        self.derived = {}
+        # C names of the `BIND(C)` derived types used, but defined in
+        # modules of other files, mapped to the basenames of these files.
+        # The outputs generated for them declare the types.
+        self.external = {}
+        self.prefilter = kw.get('prefilter', True)
+        self.incremental = kw.get('incremental', True)
+        self.parsed_blocks = None
+        self.skipped_file = False
+        self.skipped_bytes = 0
+        self.total_bytes = 0
+        self.info = None
+        self.streamed = []
+        cache_dir = kw.get('cache_dir', None)
+        self.cache = kw.get('cache', None) or (
+            cache_dir and ParseCache(cache_dir))
+        self.key = None
+        self.modules = kw.get('modules', None) or ModuleTable()
+        self.aliases = None
+        self.aliases_used = False
+        self._alias_source = None
+
+    def kind_aliases(self):
+        """Return dictionary mapping the kind aliases usable in the input
+to `ISO_C_BINDING` kinds. They are only resolved when first needed
+during parsing.
+"""
+        self.aliases_used = True
+        if self.aliases is None:
+            source = self._alias_source
+            if isinstance(source, list):
+                source = "".join(source)
+            self.aliases = self.modules.aliases(source or "")
+        return self.aliases
 
     def parse(self):
         """Parse the input file for `ISO_C_BINDING` information.
 """
-        fname = ''
+        self.aliases = None
+        self.aliases_used = False
+        self._alias_source = None
+        self.structs = []
+        self.derived = {}
+        self.external = {}
+        if self.cache:
+            lines = list(self.input)
+            self._alias_source = lines
+            self.key = self.cache.key(lines, self.signed_to_unsigned_char)
+            info = self.cache.load(self.key)
+            # Results depending on kind aliases are only valid as long as
+            # the aliases do not change.
+            if info is not None and (
+                    info[2] is None or info[2] == self.kind_aliases()):
+                print("*** fortran2cheader - Using cached result for "
+                      "{}".format(self._fname()))
+                self.info, self.includes = info[:2]
+                self._add_structs(info[3])
+                self.external = dict(info[4])
+                return
+            if self.incremental:
+                self.info, self.includes = self._parse_blocks(lines)
+            else:
+                self.data = FortranSourceProvider(lines)
+                self.info = list(self.routines())
+            self.cache.store(self.key, (
+                self.info, self.includes,
+                self.kind_aliases() if self.aliases_used else None,
+                tuple(self.structs), dict(self.external)))
+            return
+        self.info = list(self.routines())
+
+    def save_ir(self, name, binary=None):
+        """Write the parse result to IR file `name`, in the compact
+binary format if `binary` is true, as JSON otherwise. `binary` defaults
+to `name` not ending in '.json'. The file is only replaced if its
+content changed, returns whether it was written.
+"""
+        if binary is None:
+            binary = not name.lower().endswith('.json')
+        return write_if_changed(name, dump_ir(ir_data(self), binary))
+
+    @classmethod
+    def load_ir(cls, name, *args, **kw):
+        """Return instance holding the interface read from IR file
+`name`, ready for generating output without parsing.
+"""
+        with open(name, 'rb') as data:
+            data = load_ir(data.read())
+        self = cls(_IRInput(data['source'], data['input']), *args, **kw)
+        self.signed_to_unsigned_char = data['signed_to_unsigned_char']
+        self.types = TypeTable.get(self.signed_to_unsigned_char)
+        self.includes = data['includes']
+        self.external = data['external']
+        self.info = ir_routines(data)
+        self._add_structs(ir_structs(data))
+        return self
+
+    def lint(self):
+        """Return the findings of the performance lint for the routines
+found, see `value_candidates`, as dictionaries.
+"""
+        return [{'file': self.name,
+                 'line': routine.lineno,
+                 'routine': routine.name,
+                 'fname': routine.fname,
+                 'argument': arg.name,
+                 'c_type': arg.c_type}
+                for routine, arg in value_candidates(self.info)]
+
+    def abi(self):
+        """Return dictionary mapping the C names of the routines and
+derived types found to their normalized signatures, see
+`abi_signatures`.
+"""
+        return abi_signatures(self.info, self.structs)
+
+    def fingerprint(self):
+        """Return the ABI fingerprint of the routines found. It only
+changes if a C name, argument type, or result type changes, but not
+for changes of comments, formatting, or order in the Fortran source.
+"""
+        return abi_fingerprint(self.abi())
+
+    def save_abi(self, name):
+        """Write the ABI fingerprint and the normalized signatures to
+file `name`. The file is only replaced if the ABI changed, so build
+steps depending on it rerun only then. Returns whether it was written.
+"""
+        return write_if_changed(name, dump_abi(self.abi()).encode('utf-8'))
+
+    def _fname(self):
         import types
         if isinstance(self.input, types.GeneratorType):
-            fname = 'generator'
-        else:
-            fname = self.input.name
+            return 'generator'
+        return self.input.name
+
+    def routines(self):
+        """Parse the input file, yielding every routine with `BIND(C)`
+attribute as soon as its declaration part ends.
+"""
+        fname = self._fname()
+        self.includes = []
+        # Cleared in place, `stream_output` writes the derived types
+        # while parsing.
+        del self.structs[:]
+        self.derived.clear()
+        self.external.clear()
+        self.slow_lines = []
+        source = self._mapped_source()
+        if source is not None:
+            self.total_bytes = source.size
+            if not source.has_candidates():
+                print("*** fortran2cheader - No BIND(C) found, skipping "
+                      "{}".format(fname))
+                source.close()
+                self.skipped_file = True
+                self.skipped_bytes = source.size
+                return
+            if self._alias_source is None:
+                self._alias_source = source.map
+            self.data = FortranSourceProvider(source)
+        elif self._alias_source is None:
+            # The input can only be read once, collect the aliases while
+            # reading.
+            self.aliases = {}
+            self.data = _AliasingSourceProvider(
+                self.data.file, self.modules, self.aliases)
         print("*** fortran2cheader - Parsing {}".format(fname))
+        for routine in self._scan(self.data, fname):
+            yield routine
+        if source is not None:
+            self.skipped_bytes = source.skipped
+            source.close()
+            if self._alias_source is source.map:
+                self._alias_source = None
+
+    def _scan(self, data, fname, offset=0):
+        """Yield the routines with `BIND(C)` attribute from the lines
+provided by `data`. `offset` is added to the line numbers reported.
+"""
         subr = None
+        derived = None
         interface = False
-        self.info = []
-        for i in self.data:
-            vartype = _VARTYPE.match(i)
-            if not interface and _SUBROUTINE.match(i):
-                if subr:
-                    self.info.append(subr)
-                line = _SUBROUTINE.match(i)
-                gdict = line.groupdict()
-                if not gdict['C']:
-                    subr = None
-                    continue
-                subr = Subroutine(
-                    signed_to_unsigned_char=self.signed_to_unsigned_char,
-                    fName=gdict['fName'],
-                    cName=gdict['cName'],
-                    args=gdict['args'].split(','),
-                    line=i)
-            elif not interface and _FUNCTION.match(i):
-                if subr:
-                    self.info.append(subr)
-                line = _FUNCTION.match(i)
-                gdict = line.groupdict()
-                if not gdict['C']:
+        data.idle = True
+        budget = self.line_budget
+        for i in data:
+            if budget is not None:
+                start = default_timer()
+            matcher = _statement(i)
+            if matcher is _SUBROUTINE or matcher is _FUNCTION:
+                line = None if interface else matcher.match(i)
+                if line:
+                    if subr:
+                        yield self._built(subr, fname)
+                    subr = self._routine(matcher, i, line.groupdict())
+                    if subr:
+                        subr.lineno = data.start_lineno + offset
+            elif matcher is _INTERFACE:
+                if _INTERFACE.match(i):
+                    interface = True
+            elif matcher is _TYPE_DEFINITION:
+                definition = None if interface else _TYPE_DEFINITION.match(i)
+                if definition and _BIND_C.search(definition.group('attrs')):
+                    derived = _StructBuilder(
+                        self.types, i, definition.group('name'),
+                        self.kind_aliases, self.derived,
+                        data.start_lineno + offset, self.external)
+            elif matcher is _END_INTERFACE:
+                if _END_INTERFACE.match(i):
+                    interface = False
+                elif derived and _END_TYPE.match(i):
+                    derived = derived.build()
+                    if derived.complete:
+                        self._add_structs((derived,))
+                    else:
+                        print("*** fortran2cheader - {}:{}: derived type "
+                              "'{}' has components without C equivalent, "
+                              "skipping it.".format(
+                                  fname, derived.lineno, derived.name))
+                    derived = None
+                elif subr and not interface and _END_ROUTINE.match(i):
+                    yield self._built(subr, fname)
                     subr = None
-                    continue
-                subr = Function(
-                    signed_to_unsigned_char=(
-                        self.signed_to_unsigned_char),
-                    fName=gdict['fName'],
-                    cName=gdict['cName'],
-                    args=gdict['args'].split(','),
-                    prefix=gdict['prefix'],
-                    result=gdict['result'],
-                    line=i)
-            elif _INTERFACE.match(i):
-                interface = True
-            elif _END_INTERFACE.match(i):
-                interface = False
-            elif (not interface and subr and
-                  vartype and vartype.groupdict()['kind']):
-                gdict = vartype.groupdict()
-                subr.add_arg(**gdict)
-
+            elif matcher is _INCLUDE:
+                include = _INCLUDE.match(i)
+                if include and include.group('name') not in self.includes:
+                    self.includes.append(include.group('name'))
+            elif matcher is _VARTYPE and derived:
+                vartype = _VARTYPE.match(i)
+                if vartype and vartype.group('kind'):
+                    derived.add_fields(
+                        vartype.group('ftype'), vartype.group('kind'),
+                        vartype.group('modifier'), vartype.group('length'),
+                        i[i.index('::') + 2:])
+            elif matcher is _VARTYPE and not interface and subr:
+                vartype = _VARTYPE.match(i)
+                fields = vartype and vartype.groupdict()
+                if fields and fields['kind']:
+                    # An array specification following the last name.
+                    rest = i[vartype.end():].lstrip()
+                    shape = rest.startswith('(') and _SHAPE.match(rest)
+                    array = shape and (
+                        fields['args'].split(',')[-1].strip().upper())
+                    subr.add_arg(array=array,
+                                 shape=shape and shape.group('shape'),
+                                 **fields)
+            elapsed = budget is not None and default_timer() - start
+            if elapsed and elapsed > budget:
+                lineno = data.start_lineno + offset
+                self.slow_lines.append((lineno, elapsed))
+                print("*** fortran2cheader - {}:{}: statement took {:.3f}s, "
+                      "exceeding budget of {:.3f}s.".format(
+                          fname, lineno, elapsed, budget))
+            data.idle = subr is None and derived is None
         if subr:
-            self.info.append(subr)
-
-    def gen_chead(self, outf):
-        """Generating the output file.
-"""
-        Comment.flavour = "C"
-        print("\n".join(
-            (("%s" % s).rstrip() for s in
-             (Comment("\n".join((
-                 "%s" % outf.name,
-                 "Header file generated from parsing ISO_C_BINDING "
-                 "information",
-                 "from %s." % self.name,
-                 "",
-                 "Generated by %s, version %s." % (
-                     sys.argv[0], __scm_version__.strip())))),
-              "",
-              "#ifndef %s_H" % self.basename.upper(),
-              "#define %s_H" % self.basename.upper(),
-              "",
-              "#ifdef __cplusplus",
-              'extern "C" {',
-              "#endif /* __cplusplus */",
-              ""))), file=outf)
-        print("\n".join(("%s" % s for s in self.info)), file=outf)
-        print("\n".join(
-            ("%s" % s for s in
-             ("",
-              "#ifdef __cplusplus",
-              '} /* extern "C" */',
-              "#endif /* __cplusplus */",
-              "",
-              "#endif /* %s_H */" % self.basename.upper()))), file=outf)
-
-    def gen_pxd(self, outf, header=None):
-        """Generating the output file.
-"""
-        if header is None:
-            header = "%s.h" % self.basename
-        Comment.flavour = "pxd"
-        print("\n".join(
-            (("%s" % s).rstrip() for s in
-             (Comment("\n".join((
-                 "%s" % outf.name,
-                 "Cython Header file generated from parsing ISO_C_BINDING "
-                 "information",
-                 "from %s." % self.input,
-                 "",
-                 "Generated by %s, version %s." % (
-                     os.path.split(sys.argv[0])[-1],
-                     __scm_version__.strip())))),
-              "",
-              'cdef extern from "%s" nogil:' % (header,)))), file=outf)
-        print("\n".join((("%s" % s).rstrip() for s in self.info)), file=outf)
-
-    def gen_output(self, h_name, pxd_name):
-
-        if (not self.force and os.path.exists(h_name) and
-                file_newer(h_name, self.input.name)):
-            print("*** fortran2cheader - output file is newer than input, "
-                  "keeping '{}'.".format(h_name))
-        else:
-            print("*** fortran2cheader - generating output '{}'.".format(
-                h_name))
-            with open(h_name, 'w') as ofile:
-                self.gen_chead(ofile)
+            yield self._built(subr, fname)
 
-        if not self.generate_pxd:
-            return
+    @staticmethod
+    def _built(subr, fname):
+        """Return the routine built by `subr`, reporting it if it can
+not be declared.
+"""
+        routine = subr.build()
+        problem = untyped(routine)
+        if problem is not None:
+            print("*** fortran2cheader - {}:{}: routine '{}' not declared, "
+                  "{}.".format(fname, routine.lineno, routine.name, problem))
+        return routine
+
+    def _add_structs(self, structs):
+        """Add the derived types `structs` to the ones found, making
+them usable as argument types.
+"""
+        for derived in structs:
+            self.structs.append(derived)
+            self.derived[derived.name.lower()] = derived.name
+
+    def _parse_blocks(self, lines):
+        """Parse `lines` block by block, reusing the cached results of
+unchanged blocks. Returns the routines and the includes found.
+"""
+        fname = self._fname()
+        blocks = split_blocks("".join(lines))
+        block_key = self.cache.key(
+            ('blocks', os.path.abspath(self.name)),
+            self.signed_to_unsigned_char)
+        known = self.cache.load(block_key) or {}
+        options = hashlib.sha1(repr((
+            self.cache.version,
+            self.signed_to_unsigned_char)).encode('utf-8'))
+        results = {}
+        info = []
+        self.includes = []
+        self.structs = []
+        self.derived = {}
+        self.external = {}
+        self.slow_lines = []
+        parsed = 0
+        offset = 0
+        used = False
+        for block in blocks:
+            key = options.copy()
+            key.update(block.encode('utf-8'))
+            if self.derived:
+                # The argument types depend on the derived types known.
+                key.update(repr(sorted(self.derived)).encode('utf-8'))
+            key = key.digest()
+            result = results.get(key) or known.get(key)
+            if result is not None and result[2] is not None and (
+                    result[2] != self.kind_aliases()):
+                result = None
+            if result is None:
+                parsed += 1
+                includes, self.includes = self.includes, []
+                structs, self.structs = self.structs, []
+                external, self.external = self.external, {}
+                self.aliases_used = False
+                if _has_candidates(block):
+                    # Line numbers are stored relative to the block.
+                    routines = [i.moved(-offset) for i in self._scan(
+                        FortranSourceProvider(block.splitlines(True)),
+                        fname, offset)]
+                else:
+                    routines = []
+                result = (routines, self.includes,
+                          self.aliases if self.aliases_used else None,
+                          tuple(i.moved(-offset) for i in self.structs),
+                          self.external)
+                self.includes, self.structs = includes, structs
+                self.external = external
+            used = used or result[2] is not None
+            results[key] = result
+            info.extend(i.moved(offset) for i in result[0])
+            self.includes.extend(
+                i for i in result[1] if i not in self.includes)
+            self._add_structs(i.moved(offset) for i in result[3])
+            self.external.update(result[4])
+            offset += block.count("\n")
+        self.aliases_used = used
+        self.parsed_blocks = (parsed, len(blocks))
+        print("*** fortran2cheader - Parsed {} of {} blocks of {}".format(
+            parsed, len(blocks), fname))
+        self.cache.store(block_key, results)
+        return info, self.includes
+
+    def _mapped_source(self):
+        """Return `MappedSource` for the input file if pre-filtering
+is enabled and the input is a file on disk, `None` otherwise.
+"""
+        if not self.prefilter:
+            return None
+        try:
+            self.input.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        if not os.path.isfile(self.name):
+            return None
+        return MappedSource(self.name)
+
+    def resolve_includes(self):
+        """Return paths of the files included by the input file. They
+are searched for in the directory of the input file and in
+`include_dirs`, files not found are ignored.
+"""
+        dirs = [os.path.dirname(self.name)]
+        dirs.extend(self.include_dirs)
+        paths = []
+        for include in self.includes:
+            for path in (os.path.join(d, include) for d in dirs):
+                if os.path.isfile(path):
+                    paths.append(os.path.normpath(path))
+                    break
+        return paths
+
+    def module_files(self):
+        """Return paths of the files defining the modules used by the
+input file, directly or through other modules, as far as found by
+`modules`. Kind aliases and derived types may come from these files.
+"""
+        if self.name.lower().endswith(IR_SUFFIXES):
+            return []
+        try:
+            with open(self.name, 'rb') as data:
+                text = data.read()
+        except (IOError, OSError):
+            return []
+        path = os.path.abspath(self.name)
+        return [i for i in self.modules.dependencies(text) if i != path]
+
+    def gen_depfile(self, dep_name, targets):
+        """Write Make/Ninja style dependency file `dep_name` stating
+that the output files `targets` depend on the input file, the files
+included by it, and the files defining the modules it uses. Returns
+whether the file was written.
+"""
+        def quote(name):
+            return name.replace('$', '$$').replace(' ', '\\ ')
+        deps = [self.name]
+        deps.extend(self.resolve_includes())
+        deps.extend(self.module_files())
+        data = "{}: {}\n".format(
+            " ".join(quote(i) for i in targets),
+            " \\\n  ".join(quote(i) for i in deps))
+        return write_if_changed(dep_name, data.encode('utf-8'))
+
+    def _routine(self, matcher, line, gdict):
+        """Return builder for the routine with declaration `line`,
+`None` if the routine has no `BIND(C)` attribute.
+"""
+        if not gdict['C']:
+            return None
+        if matcher is _SUBROUTINE:
+            return _RoutineBuilder(
+                Subroutine, self.types, line, gdict['cName'], gdict['fName'],
+                gdict['args'].split(','), gdict['prefix'],
+                aliases=self.kind_aliases, derived=self.derived,
+                external=self.external)
+        return _RoutineBuilder(
+            Function, self.types, line, gdict['cName'], gdict['fName'],
+            gdict['args'].split(','), gdict['prefix'], gdict['result'],
+            self.kind_aliases, derived=self.derived, external=self.external)
+
+    @staticmethod
+    def _write(outputs, routines, structs=()):
+        """Write `routines` to several output files at once, while
+iterating over `routines`. `outputs` is a sequence of tuples of output
+file and renderer. `structs` is the list of derived types, growing
+while iterating, new ones are written before the next routine.
+"""
+        for outf, renderer in outputs:
+            outf.write(renderer.begin(outf.name))
+        sep = ""
+        written = 0
+        for routine in chain(routines, (None,)):
+            items = [('struct', i) for i in structs[written:]]
+            written = len(structs)
+            if routine is not None:
+                items.append(('routine', routine))
+            for method, item in items:
+                for outf, renderer in outputs:
+                    outf.write(sep + getattr(renderer, method)(item))
+                sep = "\n"
+        for outf, renderer in outputs:
+            outf.write(renderer.end())
+
+    def gen_chead(self, outf, routines=None, structs=None):
+        """Generating the output file. `routines` and `structs` default
+to the result of `parse`.
+"""
+        renderer = CHeaderRenderer(self, self.restrict, self.attributes)
+        outf.write(renderer.render(
+            outf.name, self.info if routines is None else routines,
+            self.structs if structs is None else structs))
+
+    def gen_pxd(self, outf, header=None, routines=None, structs=None):
+        """Generating the output file. `routines` and `structs` default
+to the result of `parse`.
+"""
+        outf.write(PxdRenderer(self, header).render(
+            outf.name, self.info if routines is None else routines,
+            self.structs if structs is None else structs))
 
-        if (not self.force and os.path.exists(pxd_name) and
-                file_newer(pxd_name, self.input.name)):
-            print("*** fortran2cheader - generating output '{}'.".format(
-                pxd_name))
+    def gen_dtypes(self, outf, structs=None):
+        """Generating the Python module defining NumPy dtypes for the
+derived types. `structs` defaults to the result of `parse`.
+"""
+        outf.write(DtypeRenderer(self).render(
+            outf.name, (), self.structs if structs is None else structs))
+
+    def gen_pyx(self, outf, module=None, routines=None):
+        """Generating the Cython module wrapping the routines declared
+in the pxd file `module`. `routines` defaults to the result of `parse`.
+"""
+        outf.write(PyxRenderer(self, module).render(
+            outf.name, self.info if routines is None else routines))
+
+    def gen_cffi(self, outf, header=None, routines=None, structs=None):
+        """Generating the cffi build script compiling against the C
+header `header`. `routines` and `structs` default to the result of
+`parse`.
+"""
+        outf.write(CffiRenderer(self, header).render(
+            outf.name, self.info if routines is None else routines,
+            self.structs if structs is None else structs))
+
+    def _report(self, ofile):
+        if ofile.status == 'written':
+            print("*** fortran2cheader - generated output '{}'.".format(
+                ofile.name))
         else:
-            print("*** fortran2cheader - output file is newer than input, "
-                  "keeping '{}'.".format(pxd_name))
-            with open(pxd_name, 'w') as ofile:
-                self.gen_pxd(ofile)
+            print("*** fortran2cheader - output unchanged, keeping "
+                  "'{}'.".format(ofile.name))
+
+    def gen_output(self, h_name, pxd_name, dtypes_name=None,
+                   pyx_name=None, cffi_name=None):
+        """Generate the output files. The output files are only
+replaced if their content changed. The NumPy dtypes module
+`dtypes_name`, the Cython module `pyx_name`, and the cffi build script
+`cffi_name` are only written if `generate_dtypes`, `generate_pyx`, or
+`generate_cffi` is set. Returns a dictionary
+mapping the output file names to 'written', 'unchanged', or 'cached' if
+the output cache shows the file to be up to date.
+"""
+        outputs = [(h_name, 'C', self.gen_chead)]
+        if self.generate_pxd:
+            outputs.append((pxd_name, 'pxd', self.gen_pxd))
+        if self.generate_dtypes and dtypes_name:
+            outputs.append((dtypes_name, 'dtypes', self.gen_dtypes))
+        if self.generate_pyx and pyx_name:
+            outputs.append((pyx_name, 'pyx', self.gen_pyx))
+        if self.generate_cffi and cffi_name:
+            outputs.append((cffi_name, 'cffi', self.gen_cffi))
+        status = {}
+        aliases = sorted(self.aliases.items()) if self.aliases_used else None
+        for name, flavour, gen in outputs:
+            key = self.key and ParseCache.key(
+                (self.key,), flavour, os.path.abspath(name), self.name,
+                aliases, self.restrict, self.attributes)
+            if (self.cache and not self.force and
+                    self.cache.output_current(name, key)):
+                print("*** fortran2cheader - output file is up to date, "
+                      "keeping '{}'.".format(name))
+                status[name] = 'cached'
+                continue
+            with OutputFile(name, self.force) as ofile:
+                gen(ofile)
+            self._report(ofile)
+            status[name] = ofile.status
+            if self.cache:
+                self.cache.output_written(name, key)
+        return status
+
+    def _record(self, routines):
+        for routine in routines:
+            self.streamed.append(
+                (routine.name, routine.fname, routine.lineno))
+            yield routine
+
+    def symbols(self):
+        """Return C and Fortran names and line numbers of all routines
+found, also after `stream_output`.
+"""
+        return [(routine.name, routine.fname, routine.lineno)
+                for routine in self.info or ()] + self.streamed
+
+    def stream_output(self, h_name, pxd_name):
+        """Parse the input file and generate the output files in a
+single pass. Every routine is written to the output files as soon as
+its declaration part ends and is not kept afterwards, so memory use
+does not depend on the size of the input file. The cache is not used.
+Returns a dictionary mapping the output file names to 'written' or
+'unchanged'.
+"""
+        outputs = [OutputFile(h_name, self.force)]
+        renderers = [CHeaderRenderer(self, self.restrict, self.attributes)]
+        if self.generate_pxd:
+            outputs.append(OutputFile(pxd_name, self.force))
+            renderers.append(PxdRenderer(self))
+        self.info = []
+        self.streamed = []
+        try:
+            self._write(list(zip(outputs, renderers)),
+                        self._record(self.routines()), self.structs)
+        except BaseException:
+            for ofile in outputs:
+                ofile.discard()
+            raise
+        status = {}
+        for ofile in outputs:
+            ofile.close()
+            self._report(ofile)
+            status[ofile.name] = ofile.status
+        return status
 
 
 class Fortran2CHeaderCMD(Fortran2CHeader):
@@ -567,50 +3594,619 @@ class Fortran2CHeaderCMD(Fortran2CHeader):
     """Command line interface for Fortran2CHeader
 """
 
-    def __init__(self):
-        options = self.parse_cmdline()
+    def __init__(self, data, options, cache=None, modules=None):
         super(Fortran2CHeaderCMD, self).__init__(
-            data=options.infile,
+            data=data,
             signed_to_unsigned_char=options.signed_to_unsigned_char,
             force=options.force,
-            generate_pxd=options.generate_pxd)
+            generate_pxd=options.generate_pxd,
+            generate_dtypes=options.dtypes,
+            generate_pyx=options.pyx,
+            generate_cffi=options.cffi,
+            restrict=options.restrict,
+            attributes=options.attributes,
+            line_budget=options.line_budget,
+            cache_dir=None if options.stream else options.cache_dir,
+            cache=None if options.stream else cache,
+            include_dirs=options.include_dirs,
+            prefilter=options.prefilter,
+            modules=modules or module_table(options))
+        self.output_dir = options.output_dir
+        self.depfile = options.depfile
+        self.stream = options.stream
+        self.write_depfile = options.write_depfile
+        self.ir_format = options.ir
+        self.write_abi = options.abi
 
     @staticmethod
-    def parse_cmdline():
+    def parse_cmdline(args=None):
         """Parsing the command line options.
 """
         parser = argparse.ArgumentParser(description='''
-Generate a C/C++ header file from a Fortran file using C_ISO_BINDINGS.''')
-        parser.add_argument("infile", type=argparse.FileType('r'),
-                            help="Fortran input file")
+Generate a C/C++ header file from a Fortran file using C_ISO_BINDINGS.''',
+                                         fromfile_prefix_chars='@')
+        parser.add_argument("infile", nargs='*', help="""
+Fortran input files, or directories to search for Fortran files. Use
+'@FILE' to read further arguments from FILE, one per line.""")
         parser.add_argument("--signed-to-unsigned-char", "-s",
                             action="store_true", default=False,
                             help="""
 Use 'unsigned char' instead for 'signed char' for 'c_signed_char'""")
         parser.add_argument("--force", "-f", action="store_true",
                             default=False, help="""
-Force generation of output files even if they exist, and are newer
-than the input file.""")
+Force writing the output files even if their content did not
+change.""")
         parser.add_argument("--generate-pxd", "-p", action="store_true",
                             default=False, help="""
 Generate also a pxd file for import in Cython process.""")
-        return parser.parse_args()
+        parser.add_argument("--dtypes", action="store_true", default=False,
+                            help="""
+Generate also a Python module named like the header file with suffix
+'_dtypes.py', defining NumPy structured dtypes for the BIND(C) derived
+types, with offsets and sizes of the C ABI of the generating
+platform.""")
+        parser.add_argument("--pyx", action="store_true", default=False,
+                            help="""
+Generate also a Cython module named like the header file with suffix
+'_wrap.pyx', defining Python wrappers that take arrays as memoryviews
+without copying and release the GIL during the calls. Requires
+--generate-pxd.""")
+        parser.add_argument("--cffi", action="store_true", default=False,
+                            help="""
+Generate also a cffi build script named like the header file with
+suffix '_build.py', declaring the routines and derived types for cffi
+and building an extension module in API mode against the header file,
+without Cython and usable with PyPy.""")
+        parser.add_argument("--restrict", action="store_true",
+                            default=False, help="""
+Declare arguments passed by reference 'restrict' in the C header, using
+'__restrict__' for C++. Fortran does not allow them to alias, this lets
+C compilers vectorize code calling the routines.""")
+        parser.add_argument("--attributes", action="store_true",
+                            default=False, help="""
+Declare PURE and ELEMENTAL routines with GCC 'pure' and 'nothrow'
+attributes in the C header, allowing C compilers to eliminate or hoist
+repeated calls.""")
+        parser.add_argument("--line-budget", type=float, default=1.,
+                            metavar="SECONDS", help="""
+Report statements taking longer than SECONDS to parse.""")
+        parser.add_argument("--output-dir", "-o", default=os.curdir,
+                            metavar="DIR", help="""
+Directory for the generated files, default is the current directory.""")
+        parser.add_argument("--jobs", "-j", type=int, default=1,
+                            metavar="N", help="""
+Process input files in N parallel processes.""")
+        parser.add_argument("--cache-dir", "-c", metavar="DIR", help="""
+Keep parse results and content hashes of the generated files in DIR.
+Input files are then only parsed and output files only regenerated if
+the input content or the options changed.""")
+        parser.add_argument("--stream", action="store_true", default=False,
+                            help="""
+Write the output while parsing, without keeping the parse result in
+memory. The cache directory is not used then.""")
+        parser.add_argument("--write-depfile", "-MD", action="store_true",
+                            default=False, help="""
+Write a Make/Ninja dependency file for every input file, named like
+the header file with suffix '.d'.""")
+        parser.add_argument("--depfile", "-MF", metavar="FILE", help="""
+Write the dependency file to FILE, only possible with a single input
+file.""")
+        parser.add_argument("--no-prefilter", dest="prefilter",
+                            action="store_false", default=True, help="""
+Process every line of the input files, instead of skipping files and
+regions without 'BIND', 'INTERFACE', or 'INCLUDE'.""")
+        parser.add_argument("--include-dir", "-I", metavar="DIR",
+                            dest="include_dirs", action="append",
+                            default=[], help="""
+Search DIR for files named in INCLUDE statements when writing
+dependency files.""")
+        parser.add_argument("--module-dir", "-J", metavar="DIR",
+                            dest="module_dirs", action="append",
+                            default=[], help="""
+Search DIR for Fortran modules defining kind aliases, like 'dp' in
+'INTEGER, PARAMETER :: dp = c_double', or BIND(C) derived types, used by
+the input files. The input files are always searched.""")
+        parser.add_argument("--watch", "-w", action="store_true",
+                            default=False, help="""
+Stay resident and regenerate the output files whenever the content of
+an input file changes.""")
+        parser.add_argument("--poll-interval", type=float, default=.5,
+                            metavar="SECONDS", help="""
+Check the input files for changes every SECONDS in watch mode.""")
+        parser.add_argument("--debounce", type=float, default=.2,
+                            metavar="SECONDS", help="""
+Wait until the input files did not change for SECONDS before
+regenerating in watch mode.""")
+        parser.add_argument("--ir", choices=("json", "binary"), help="""
+Also write the parse result as interface IR file, named like the header
+file with suffix '.ir.json' or '.f2cir'. Input files with these
+suffixes are read as IR files instead of parsing Fortran.""")
+        parser.add_argument("--index", metavar="DB", help="""
+Record the C symbols generated for every input file in the SQLite
+database DB, and report symbols defined more than once, also in watch
+mode and by the build server.""")
+        parser.add_argument("--umbrella", metavar="FILE", help="""
+Write header FILE including the headers of all files in the index.""")
+        parser.add_argument("--which", metavar="NAME", action="append",
+                            default=[], help="""
+Report the files defining C symbol NAME according to the index,
+without processing input files.""")
+        parser.add_argument("--abi", action="store_true", default=False,
+                            help="""
+Also write the ABI fingerprint and the normalized C signatures to a
+file named like the header file with suffix '.abi'. It is only
+replaced if the C interface changed.""")
+        parser.add_argument("--abi-diff", nargs=2, metavar=("OLD", "NEW"),
+                            help="""
+List the signatures added, removed, and changed from OLD to NEW, without
+processing input files. OLD and NEW may be ABI, IR, or Fortran
+files.""")
+        parser.add_argument("--lint", choices=("text", "json"), help="""
+Instead of generating output, report the scalar INTENT(IN) arguments
+without VALUE attribute, which are passed by reference, as text or as
+JSON document on stdout.""")
+        options = parser.parse_args(args)
+        if (options.umbrella or options.which) and not options.index:
+            parser.error("--umbrella and --which require --index")
+        if not (options.infile or options.which or options.abi_diff):
+            parser.error("no input files given")
+        if options.depfile and (len(options.infile) != 1 or
+                                os.path.isdir(options.infile[0])):
+            parser.error("--depfile requires a single input file")
+        if options.ir and options.stream:
+            parser.error("--ir can not be combined with --stream")
+        if options.abi and options.stream:
+            parser.error("--abi can not be combined with --stream")
+        if options.dtypes and options.stream:
+            parser.error("--dtypes can not be combined with --stream")
+        if options.pyx and options.stream:
+            parser.error("--pyx can not be combined with --stream")
+        if options.cffi and options.stream:
+            parser.error("--cffi can not be combined with --stream")
+        if options.pyx and not options.generate_pxd:
+            parser.error("--pyx requires --generate-pxd")
+        return options
 
+    def run(self):
+        """Parse input file and generate output files. Returns the
+status of the output files as `gen_output` does.
+"""
+        h_name = os.path.join(self.output_dir, "%s.h" % self.basename)
+        pxd_name = os.path.join(self.output_dir, "%s.pxd" % self.basename)
+        dtypes_name = os.path.join(
+            self.output_dir, "%s_dtypes.py" % self.basename)
+        pyx_name = os.path.join(self.output_dir, "%s_wrap.pyx" % self.basename)
+        cffi_name = os.path.join(
+            self.output_dir, "%s_build.py" % self.basename)
+        self.h_name = h_name
+        if self.stream and self.info is None:
+            status = self.stream_output(h_name, pxd_name)
+        else:
+            if self.info is None:
+                self.parse()
+            status = self.gen_output(
+                h_name, pxd_name, dtypes_name, pyx_name, cffi_name)
+        ir_name = None
+        if self.ir_format:
+            ir_name = os.path.join(self.output_dir, "%s%s" % (
+                self.basename,
+                ".ir.json" if self.ir_format == 'json' else ".f2cir"))
+            if self.save_ir(ir_name):
+                print("*** fortran2cheader - generated IR file '{}'.".format(
+                    ir_name))
+        abi_name = None
+        if self.write_abi:
+            abi_name = os.path.join(
+                self.output_dir, self.basename + ABI_SUFFIX)
+            if self.save_abi(abi_name):
+                print("*** fortran2cheader - ABI changed, generated "
+                      "'{}'.".format(abi_name))
+            else:
+                print("*** fortran2cheader - ABI unchanged, keeping "
+                      "'{}'.".format(abi_name))
+        dep_name = self.depfile or (
+            self.write_depfile and
+            os.path.join(self.output_dir, "%s.d" % self.basename))
+        if dep_name:
+            targets = [h_name]
+            if self.generate_pxd:
+                targets.append(pxd_name)
+            if self.generate_dtypes:
+                targets.append(dtypes_name)
+            if self.generate_pyx:
+                targets.append(pyx_name)
+            if self.generate_cffi:
+                targets.append(cffi_name)
+            if ir_name:
+                targets.append(ir_name)
+            if abi_name:
+                targets.append(abi_name)
+            self.gen_depfile(dep_name, targets)
+        return status
 
-def main():
-    """Main program
+
+FORTRAN_SUFFIXES = ('.f', '.f90', '.f95', '.f03', '.f08')
+
+
+def input_files(names):
+    """Return Fortran input files from `names`, directories are
+searched recursively for files with one of the `FORTRAN_SUFFIXES`.
+"""
+    for name in names:
+        if not os.path.isdir(name):
+            yield name
+            continue
+        for dirpath, dirnames, filenames in os.walk(name):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                if os.path.splitext(fname)[1].lower() in FORTRAN_SUFFIXES:
+                    yield os.path.join(dirpath, fname)
+
+
+def module_table(options):
+    """Return `ModuleTable` searching the input files and module
+directories of `options`, persistent in the cache directory.
+"""
+    return ModuleTable(
+        options.infile + options.module_dirs,
+        options.cache_dir and ParseCache(options.cache_dir))
+
+
+def process_file(infile, options, cache=None, modules=None):
+    """Generate the output for `infile`, a Fortran source or, if its
+name ends with one of the `IR_SUFFIXES`, an IR file. `modules` is the
+`ModuleTable` shared by all files. Returns the `Fortran2CHeaderCMD`
+instance and the status of the output files.
+"""
+    if infile.lower().endswith(IR_SUFFIXES):
+        header = Fortran2CHeaderCMD.load_ir(infile, options)
+        return header, header.run()
+    with open(infile) as data:
+        header = Fortran2CHeaderCMD(data, options, cache, modules)
+        return header, header.run()
+
+
+# `ModuleTable` of a worker process, shared by all files it processes.
+_worker_modules = None
+
+
+def _init_worker(options):
+    """Initialize a worker process of the process pool.
+"""
+    global _worker_modules
+    _worker_modules = module_table(options)
+
+
+def _process_job(job):
+    """Process the input file of `job`, a tuple of input file name and
+options, in a worker process, see `_process`.
+"""
+    return _process(job[0], job[1], _worker_modules)
+
+
+def _process(infile, options, modules=None):
+    """Process a single input file, return input file name, error
+message (`None` on success), the pre-filter statistics, and the header
+file name and the symbols for the index.
 """
-    fFile = Fortran2CHeaderCMD()
+    try:
+        header, status = process_file(infile, options, modules=modules)
+    except Exception as exc:
+        return infile, "{}: {}".format(type(exc).__name__, exc), None, None
+    return infile, None, (
+        header.skipped_file, header.skipped_bytes, header.total_bytes), (
+            header.h_name, header.symbols())
 
-    h_name = "%s.h" % fFile.basename
-    pxd_name = "%s.pxd" % fFile.basename
 
-    fFile.parse()
-    fFile.gen_output(h_name, pxd_name)
+def _location(path, lineno):
+    return path if lineno is None else "{}:{}".format(path, lineno)
+
+
+def update_index(options, files):
+    """Record the symbols of `files`, tuples of input file, header, and
+symbols as returned by `Fortran2CHeader.symbols`, in the index
+`options.index`, report duplicate symbols, and write the umbrella header
+`options.umbrella`. Returns the duplicate symbols as
+`SymbolIndex.conflicts` does.
+"""
+    index = SymbolIndex(options.index)
+    try:
+        for infile, h_name, symbols in files:
+            index.update(infile, h_name, symbols)
+        index.prune()
+        conflicts = index.conflicts()
+        for name in sorted(conflicts):
+            print("*** fortran2cheader - duplicate symbol '{}' defined "
+                  "in {}.".format(name, ", ".join(
+                      _location(*i) for i in conflicts[name])))
+        if options.umbrella and index.gen_umbrella(options.umbrella):
+            print("*** fortran2cheader - generated umbrella header "
+                  "'{}'.".format(options.umbrella))
+    finally:
+        index.close()
+    return conflicts
+
+
+def _query(options):
+    """Report the files defining the symbols `options.which`.
+"""
+    index = SymbolIndex(options.index)
+    missing = 0
+    try:
+        for name in options.which:
+            found = index.which(name)
+            if not found:
+                missing += 1
+                print("{}: not found".format(name))
+            for path, lineno, header, fname in found:
+                print("{}: {} ({}), header {}".format(
+                    name, _location(path, lineno), fname, header))
+    finally:
+        index.close()
+    return 1 if missing else 0
+
+
+def _lint(options):
+    """Report the findings of the performance lint for the input files,
+in the format `options.lint`.
+"""
+    stdout = sys.stdout
+    if options.lint == 'json':
+        sys.stdout = sys.stderr
+    modules = module_table(options)
+    findings = []
+    files = routines = arguments = failed = 0
+    try:
+        for infile in input_files(options.infile):
+            try:
+                if infile.lower().endswith(IR_SUFFIXES):
+                    header = Fortran2CHeaderCMD.load_ir(infile, options)
+                else:
+                    with open(infile) as data:
+                        header = Fortran2CHeaderCMD(
+                            data, options, modules=modules)
+                        header.parse()
+            except Exception as exc:
+                failed += 1
+                print("*** fortran2cheader - {}: failed, {}: {}".format(
+                    infile, type(exc).__name__, exc))
+                continue
+            files += 1
+            routines += len(header.info)
+            arguments += sum(len(i.args) for i in header.info)
+            findings.extend(header.lint())
+    finally:
+        sys.stdout = stdout
+    if options.lint == 'json':
+        json.dump({'findings': findings,
+                   'summary': {'files': files,
+                               'failed': failed,
+                               'routines': routines,
+                               'arguments': arguments,
+                               'findings': len(findings),
+                               'routines_affected': len(set(
+                                   (i['file'], i['routine'])
+                                   for i in findings))}},
+                  sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        for finding in findings:
+            print("{file}:{line}: {routine}: scalar INTENT(IN) argument "
+                  "'{argument}' passed by reference as '{c_type}', "
+                  "consider VALUE".format(**finding))
+        print("*** fortran2cheader - lint: {} of {} arguments in {} "
+              "routines of {} files passed by reference.".format(
+                  len(findings), arguments, routines, files))
+    return 1 if findings or failed else 0
+
+
+def _abi_diff(options):
+    """Report the differences between the ABIs `options.abi_diff`.
+"""
+    old, new = (read_abi(name, options.signed_to_unsigned_char)
+                for name in options.abi_diff)
+    added, removed, changed = abi_diff(old, new)
+    for signature in added:
+        print("added: {}".format(signature))
+    for signature in removed:
+        print("removed: {}".format(signature))
+    for signatures in changed:
+        print("changed: {} -> {}".format(*signatures))
+    print("fingerprint {} -> {}".format(
+        abi_fingerprint(old), abi_fingerprint(new)))
+    return 1 if added or removed or changed else 0
+
+
+class Watcher(object):
+
+    """Watch the input files, regenerating the output files for those
+whose content changed. Files are polled for changes of their
+modification time or size, the content digest decides whether the
+output is regenerated. The files defining the modules used by the input
+files are watched as well, a change regenerates the output of all input
+files using them. The symbol index `options.index` is updated after
+regenerating.
+"""
+
+    def __init__(self, options):
+        self.options = options
+        self.stats = {}
+        self.digests = {}
+        self.inputs = set()
+        # Maps absolute paths of module files to the input files using
+        # them.
+        self.dependents = {}
+        self.cache = MemoryCache()
+        self.modules = module_table(options)
+
+    def scan(self):
+        """Return the input files and module files whose modification
+time or size changed since the last scan.
+"""
+        current = {}
+        self.inputs = set(input_files(self.options.infile))
+        known = set(os.path.abspath(i) for i in self.inputs)
+        for name in sorted(self.inputs) + sorted(
+                set(self.dependents) - known):
+            try:
+                stat = os.stat(name)
+            except OSError:
+                continue
+            current[name] = (stat.st_mtime, stat.st_size)
+        changed = [name for name in sorted(current)
+                   if self.stats.get(name) != current[name]]
+        for name in set(self.digests) - set(current):
+            del self.digests[name]
+        self.stats = current
+        return changed
+
+    def poll(self):
+        """Check for changed input files and regenerate their output.
+Bursts of changes are collected until no file changed for
+`options.debounce` seconds. Returns a list of tuples of input file
+name and error message (`None` on success) for the regenerated files.
+"""
+        pending = self.scan()
+        if not pending:
+            return []
+        detected = time.time()
+        while True:
+            time.sleep(self.options.debounce)
+            more = self.scan()
+            if not more:
+                break
+            pending.extend(i for i in more if i not in pending)
+        results = []
+        indexed = []
+        self.modules.refresh()
+        digests = {}
+        for name in pending:
+            try:
+                digest = file_digest(name)
+            except (IOError, OSError):
+                continue
+            if self.digests.get(name) != digest:
+                digests[name] = digest
+        names = [name for name in pending
+                 if name in digests and name in self.inputs]
+        for name in pending:
+            if name not in digests:
+                continue
+            if name not in self.inputs:
+                self.digests[name] = digests[name]
+            names.extend(
+                i for i in sorted(self.dependents.get(
+                    os.path.abspath(name), ()))
+                if i in self.inputs and i not in names)
+        for name in names:
+            start = default_timer()
+            header, error = self._regenerate(name)
+            if error is None:
+                if name not in digests:
+                    digests[name] = file_digest(name)
+                self.digests[name] = digests[name]
+                self._depend(name, header.module_files())
+                indexed.append((name, header.h_name, header.symbols()))
+                print("*** fortran2cheader - {}: regenerated in {:.3f}s, "
+                      "{:.3f}s after the change was detected.".format(
+                          name, default_timer() - start,
+                          time.time() - detected))
+            else:
+                print("*** fortran2cheader - {}: failed, {}".format(
+                    name, error))
+            results.append((name, error))
+        if self.options.index and results:
+            update_index(self.options, indexed)
+        return results
+
+    def _depend(self, name, paths):
+        """Record that input file `name` uses the modules defined in
+the files `paths`.
+"""
+        for path in list(self.dependents):
+            self.dependents[path].discard(name)
+            if not self.dependents[path]:
+                del self.dependents[path]
+        for path in paths:
+            self.dependents.setdefault(path, set()).add(name)
+
+    def _regenerate(self, name):
+        try:
+            header = process_file(
+                name, self.options, self.cache, self.modules)[0]
+        except Exception as exc:
+            return None, "{}: {}".format(type(exc).__name__, exc)
+        return header, None
+
+    def run(self):
+        """Poll for changes until interrupted.
+"""
+        print("*** fortran2cheader - watching {}".format(
+            " ".join(self.options.infile)))
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.options.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+
+def main(args=None):
+    """Main program
+"""
+    options = Fortran2CHeaderCMD.parse_cmdline(args)
+    if options.abi_diff:
+        return _abi_diff(options)
+    if options.lint:
+        return _lint(options)
+    if options.which:
+        return _query(options)
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    if options.watch:
+        return Watcher(options).run()
+    jobs = [(infile, options) for infile in input_files(options.infile)]
+    if options.jobs > 1 and len(jobs) > 1:
+        # Every worker builds its own module table once, instead of
+        # receiving a fresh copy with every file.
+        pool = multiprocessing.Pool(
+            min(options.jobs, len(jobs)), _init_worker, (options,))
+        try:
+            results = list(pool.imap(_process_job, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        modules = module_table(options)
+        results = [_process(infile, options, modules)
+                   for infile, _ in jobs]
+
+    failed = 0
+    skipped = [0, 0, 0]
+    indexed = []
+    for infile, error, stats, symbols in results:
+        if error is None:
+            print("*** fortran2cheader - {}: ok".format(infile))
+            skipped = [i + j for i, j in zip(skipped, stats)]
+            indexed.append((infile,) + symbols)
+        else:
+            failed += 1
+            print("*** fortran2cheader - {}: failed, {}".format(
+                infile, error))
+    if skipped[2]:
+        print("*** fortran2cheader - pre-filter skipped {} files and {} of "
+              "{} bytes.".format(*skipped))
+    if len(results) > 1:
+        print("*** fortran2cheader - processed {} files, {} failed.".format(
+            len(results), failed))
+    if options.index and update_index(options, indexed):
+        return 1
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 # Local Variables:
 # mode: python
@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark for Fortran2CHeader.
+
+Synthetic Fortran sources are generated for several typical and
+extreme situations, parsed, and rendered to C header and Cython pxd
+files. The throughput of each phase is measured in source lines per
+second and compared with stored baseline results::
+
+    python -m dnvgl.fortran2cheader.benchmark
+    python -m dnvgl.fortran2cheader.benchmark --update
+
+The first command fails if the throughput of any phase dropped below
+`--threshold` times the baseline value, the second stores the current
+results as new baseline.
+"""
+
+from __future__ import (
+    division, print_function, absolute_import, unicode_literals)
+
+# Standard libraries.
+import io
+import os
+import sys
+import json
+import shutil
+import platform
+import argparse
+import tempfile
+from timeit import default_timer
+
+# DNV GL libraries.
+from dnvgl.fortran2cheader import Fortran2CHeader
+
+# ID: $Id$
+__date__ = "$Date::                            $"[7:-1]
+__scm_version__ = "$Revision$"[10:-1]
+__author__ = "`Berthold Höllmann <berthold.hoellmann@dnvgl.com>`__"
+__copyright__ = "Copyright © 2019 by DNV GL SE"
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+PHASES = ('parse', 'gen_chead', 'gen_pxd')
+
+_TYPES = ('integer(c_int)', 'real(c_double)', 'real(c_float)',
+          'integer(c_long)', 'complex(c_double_complex)', 'type(c_ptr)')
+
+
+def gen_routine(name, n_args, args_per_line=8, bind=True):
+    """Return source of a Fortran subroutine with `n_args` arguments,
+listing `args_per_line` arguments on each continuation line.
+"""
+    args = ["a%d" % i for i in range(n_args)]
+    lines = ["subroutine %s(&" % name]
+    lines.extend("    & %s, &" % ", ".join(args[i:i + args_per_line])
+                 for i in range(0, n_args, args_per_line))
+    tail = ") bind(c, name='%s')" % name if bind else ")"
+    if n_args:
+        lines[-1] = lines[-1][:-3] + tail
+    else:
+        lines[-1] = lines[-1][:-1] + tail
+    lines.append("  use iso_c_binding")
+    for i, arg in enumerate(args):
+        if i % 3 == 0:
+            lines.append("  %s, value :: %s" % (_TYPES[i % len(_TYPES)], arg))
+        elif i % 3 == 1:
+            lines.append("  %s, intent(in) :: %s" % (
+                _TYPES[i % len(_TYPES)], arg))
+        else:
+            lines.append("  %s, dimension(*), intent(inout) :: %s" % (
+                _TYPES[i % len(_TYPES)], arg))
+    lines.append("  ! computation")
+    lines.append("  call work()")
+    lines.append("end subroutine %s" % name)
+    return "\n".join(lines) + "\n"
+
+
+def _count(count, scale):
+    return max(1, int(count * scale))
+
+
+def _module(name, body):
+    return "module %s\n  use iso_c_binding\ncontains\n%send module %s\n" % (
+        name, "".join(body), name)
+
+
+def corpus_small_files(scale):
+    """Many small files with a few short routines each."""
+    return [("small%04d.f90" % i,
+             _module("small%04d" % i, (gen_routine("s%d_%d" % (i, j), 4)
+                                       for j in range(5))))
+            for i in range(_count(200, scale))]
+
+
+def corpus_huge_file(scale):
+    """One huge file mixing BIND(C) and plain Fortran routines."""
+    return [("huge.f90", _module("huge", (
+        gen_routine("h%d" % i, 6, bind=i % 4 == 0)
+        for i in range(_count(20000, scale)))))]
+
+
+def corpus_long_args(scale):
+    """Routines with very long argument lists."""
+    return [("long_args.f90", _module("long_args", (
+        gen_routine("l%d" % i, 1000) for i in range(_count(20, scale)))))]
+
+
+def corpus_deep_continuation(scale):
+    """Routine declarations split over one continuation line per
+argument."""
+    return [("deep.f90", _module("deep", (
+        gen_routine("d%d" % i, 100, args_per_line=1)
+        for i in range(_count(200, scale)))))]
+
+
+def corpus_interfaces(scale):
+    """Large INTERFACE blocks, which are ignored for output."""
+    bodies = [gen_routine("i%d" % i, 6) for i in range(_count(2000, scale))]
+    return [("interfaces.f90", _module("interfaces", (
+        ["interface\n"] + bodies + ["end interface\n"] +
+        [gen_routine("r%d" % i, 6) for i in range(20)])))]
+
+
+CORPORA = (
+    ('small_files', corpus_small_files),
+    ('huge_file', corpus_huge_file),
+    ('long_args', corpus_long_args),
+    ('deep_continuation', corpus_deep_continuation),
+    ('interfaces', corpus_interfaces))
+
+
+class _Discard(io.StringIO):
+
+    """Output file used for rendering, discarding the output.
+"""
+    name = 'benchmark'
+
+    def write(self, text):
+        return len(text)
+
+
+def time_phases(fname):
+    """Return the time needed for parsing file `fname` and generating
+the output files from it.
+"""
+    times = {}
+    stdout = sys.stdout
+    sys.stdout = _Discard()
+    try:
+        with open(fname) as data:
+            header = Fortran2CHeader(data, line_budget=None)
+            start = default_timer()
+            header.parse()
+            times['parse'] = default_timer() - start
+            start = default_timer()
+            header.gen_chead(_Discard())
+            times['gen_chead'] = default_timer() - start
+            start = default_timer()
+            header.gen_pxd(_Discard())
+            times['gen_pxd'] = default_timer() - start
+    finally:
+        sys.stdout = stdout
+    return times
+
+
+def run(scale=1., repeat=3, corpora=None):
+    """Run the benchmark, return a dictionary mapping corpus names to
+dictionaries of the throughput of each phase in lines per second. The
+best of `repeat` runs is used.
+"""
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix="fortran2cheader_bench_")
+    try:
+        for name, gen in CORPORA:
+            if corpora and name not in corpora:
+                continue
+            files = []
+            lines = 0
+            for fname, text in gen(scale):
+                fname = os.path.join(tmpdir, fname)
+                with open(fname, 'w') as ofile:
+                    ofile.write(text)
+                files.append(fname)
+                lines += text.count("\n")
+            best = dict((phase, None) for phase in PHASES)
+            for _ in range(repeat):
+                total = dict((phase, 0.) for phase in PHASES)
+                for fname in files:
+                    for phase, time in time_phases(fname).items():
+                        total[phase] += time
+                for phase in PHASES:
+                    if best[phase] is None or total[phase] < best[phase]:
+                        best[phase] = total[phase]
+            results[name] = dict(
+                (phase, lines / max(best[phase], 1e-9)) for phase in PHASES)
+            results[name]['lines'] = lines
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return descriptions of all phases where the throughput in
+`results` dropped below `threshold` times the `baseline` value.
+"""
+    regressions = []
+    for name in sorted(results):
+        for phase in PHASES:
+            base = baseline.get(name, {}).get(phase)
+            if base and results[name][phase] < threshold * base:
+                regressions.append(
+                    "{}/{}: {:.0f} lines/s, baseline {:.0f} lines/s".format(
+                        name, phase, results[name][phase], base))
+    return regressions
+
+
+def load_baseline(fname=BASELINE):
+    with open(fname) as data:
+        return json.load(data)['results']
+
+
+def save_baseline(results, fname=BASELINE):
+    with open(fname, 'w') as ofile:
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'results': results},
+                  ofile, indent=2, sort_keys=True)
+        ofile.write("\n")
+
+
+def main(args=None):
+    """Main program
+"""
+    parser = argparse.ArgumentParser(description='''
+Benchmark Fortran2CHeader on synthetic Fortran sources.''')
+    parser.add_argument("--scale", type=float, default=1., help="""
+Scale factor for the size of the generated sources.""")
+    parser.add_argument("--repeat", type=int, default=3, help="""
+Number of runs, the best one is used.""")
+    parser.add_argument("--corpus", action="append",
+                        choices=[name for name, gen in CORPORA], help="""
+Run only the named corpus, may be given several times.""")
+    parser.add_argument("--baseline", default=BASELINE, help="""
+File holding the baseline results.""")
+    parser.add_argument("--threshold", type=float, default=.7, help="""
+Fail if throughput drops below THRESHOLD times the baseline.""")
+    parser.add_argument("--update", action="store_true", default=False,
+                        help="""
+Store the results as new baseline instead of comparing.""")
+    options = parser.parse_args(args)
+
+    results = run(options.scale, options.repeat, options.corpus)
+    print("{:<20s}{:>10s}".format("corpus", "lines") + "".join(
+        "{:>14s}".format(phase) for phase in PHASES))
+    for name in sorted(results):
+        print("{:<20s}{:>10d}".format(name, results[name]['lines']) + "".join(
+            "{:>14.0f}".format(results[name][phase]) for phase in PHASES))
+    print("(throughput in lines per second)")
+
+    if options.update:
+        save_baseline(results, options.baseline)
+        print("baseline written to {}".format(options.baseline))
+        return 0
+    regressions = compare(
+        results, load_baseline(options.baseline), options.threshold)
+    for regression in regressions:
+        print("regression: {}".format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# Local Variables:
+# mode: python
+# compile-command: "cd ../.. ; python -m dnvgl.fortran2cheader.benchmark"
+# End:
@@ -0,0 +1,422 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent build server for Fortran2CHeader.
+
+Build drivers calling `fortran2cheader` for many files pay the Python
+startup and the compilation of the regular expressions for every call.
+The server keeps running, holding the compiled patterns and an in-memory
+parse cache, and accepts JSON-RPC 2.0 requests, one JSON object per
+line, on stdin/stdout or on a Unix domain socket::
+
+    python -m dnvgl.fortran2cheader.server
+    python -m dnvgl.fortran2cheader.server --socket /tmp/f2ch.sock
+
+Methods:
+
+generate
+    `{"args": [...]}`, the arguments are those of the
+    `fortran2cheader` command line. Returns the status of the output
+    files and the ABI fingerprint for every input file. With `--index`
+    the symbol index is updated and the duplicate symbols are
+    returned. The options `--watch`, `--lint`, `--which`, `--abi-diff`,
+    and `--jobs` are rejected.
+
+invalidate
+    `{"paths": [...]}`, drop cached results for the given input and
+    output files, all cached results if `paths` is missing.
+
+stats
+    Return request counts, cache statistics, and timing information.
+
+shutdown
+    Stop the server after answering.
+
+Relative paths are relative to the working directory of the server.
+Progress messages are written to stderr, stdout is reserved for the
+responses.
+"""
+
+from __future__ import (
+    division, print_function, absolute_import, unicode_literals)
+
+# Standard libraries.
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+from timeit import default_timer
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# DNV GL libraries.
+from dnvgl.fortran2cheader import (
+    Fortran2CHeaderCMD, MemoryCache, ModuleTable, input_files, process_file,
+    update_index)
+
+# ID: $Id$
+__date__ = "$Date::                            $"[7:-1]
+__scm_version__ = "$Revision$"[10:-1]
+__author__ = "`Berthold Höllmann <berthold.hoellmann@dnvgl.com>`__"
+__copyright__ = "Copyright © 2019 by DNV GL SE"
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# Command line options the `generate` method does not support, as
+# attribute name, option name, and default value.
+UNSUPPORTED_OPTIONS = (
+    ('watch', '--watch', False),
+    ('lint', '--lint', None),
+    ('which', '--which', []),
+    ('abi_diff', '--abi-diff', None),
+    ('jobs', '--jobs', 1))
+
+
+class RPCError(Exception):
+
+    """Error reported to the client as JSON-RPC error object.
+"""
+
+    def __init__(self, code, message):
+        super(RPCError, self).__init__(message)
+        self.code = code
+
+
+def check_params(handler, params):
+    """Raise `RPCError` if the names in `params` do not match the
+parameters of method `handler`.
+"""
+    code = handler.__code__
+    names = code.co_varnames[1:code.co_argcount]
+    required = names[:len(names) - len(handler.__defaults__ or ())]
+    unknown = sorted(set(params) - set(names))
+    if unknown:
+        raise RPCError(INVALID_PARAMS, "unknown parameters: {}".format(
+            ", ".join(unknown)))
+    missing = [i for i in required if i not in params]
+    if missing:
+        raise RPCError(INVALID_PARAMS, "missing parameters: {}".format(
+            ", ".join(missing)))
+
+
+class Server(object):
+
+    """Protocol independent request handling of the build server.
+
+Requests are handled concurrently.
+"""
+
+    def __init__(self):
+        self.cache = MemoryCache()
+        self.keys = {}
+        self.modules = {}
+        self.outputs = {}
+        self.requests = {}
+        self.files = 0
+        self.failed = 0
+        self.generate_time = 0.
+        self.started = default_timer()
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def handle_line(self, line):
+        """Handle request `line`, return the response line, `None` for
+notifications.
+"""
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            return self._dump(None, error=RPCError(PARSE_ERROR, str(exc)))
+        response = self.handle(request)
+        return None if response is None else json.dumps(response)
+
+    @staticmethod
+    def is_shutdown(line):
+        """Return whether request `line` asks for shutdown.
+"""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return False
+        return (isinstance(request, dict) and
+                request.get('method') == 'shutdown')
+
+    def handle(self, request):
+        """Handle decoded `request`, return the response object, `None`
+for notifications.
+"""
+        if not isinstance(request, dict) or not isinstance(
+                request.get('method'), type("")):
+            return self._response(None, error=RPCError(
+                INVALID_REQUEST, "Invalid request"))
+        rid = request.get('id')
+        # Notifications are never answered, not even with an error.
+        notification = 'id' not in request
+        method = request['method']
+        params = request.get('params') or {}
+        handler = getattr(self, 'rpc_' + method, None)
+        try:
+            if handler is None:
+                raise RPCError(
+                    METHOD_NOT_FOUND, "Unknown method '{}'".format(method))
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "params must be an object")
+            check_params(handler, params)
+            with self._stats_lock:
+                self.requests[method] = self.requests.get(method, 0) + 1
+            result = handler(**params)
+        except RPCError as exc:
+            return None if notification else self._response(rid, error=exc)
+        except Exception as exc:
+            if notification:
+                return None
+            return self._response(rid, error=RPCError(
+                INTERNAL_ERROR, "{}: {}".format(type(exc).__name__, exc)))
+        if notification:
+            return None
+        return self._response(rid, result=result)
+
+    @staticmethod
+    def _response(rid, result=None, error=None):
+        response = {'jsonrpc': '2.0', 'id': rid}
+        if error is None:
+            response['result'] = result
+        else:
+            response['error'] = {'code': error.code, 'message': "%s" % error}
+        return response
+
+    def _dump(self, rid, result=None, error=None):
+        return json.dumps(self._response(rid, result, error))
+
+    def rpc_generate(self, args):
+        """Generate output files, `args` are the command line
+arguments of `fortran2cheader`.
+"""
+        if not isinstance(args, list):
+            raise RPCError(INVALID_PARAMS, "args must be a list")
+        try:
+            options = Fortran2CHeaderCMD.parse_cmdline(args)
+        except SystemExit:
+            raise RPCError(INVALID_PARAMS, "invalid arguments: {}".format(
+                " ".join(args)))
+        unsupported = [name for attr, name, default in UNSUPPORTED_OPTIONS
+                       if getattr(options, attr) != default]
+        if unsupported:
+            raise RPCError(
+                INVALID_PARAMS, "options not supported by the server: "
+                "{}".format(", ".join(unsupported)))
+        start = default_timer()
+        if not os.path.isdir(options.output_dir):
+            try:
+                os.makedirs(options.output_dir)
+            except OSError:
+                if not os.path.isdir(options.output_dir):
+                    raise
+        key = tuple(options.infile + options.module_dirs)
+        with self._lock:
+            modules = self.modules.get(key)
+            if modules is None:
+                modules = self.modules[key] = ModuleTable(key)
+        modules.refresh()
+        files = []
+        indexed = []
+        for infile in input_files(options.infile):
+            result, header = self._generate(infile, options, modules)
+            files.append(result)
+            if header is not None:
+                indexed.append((infile, header.h_name, header.symbols()))
+        failed = sum(1 for i in files if i['error'] is not None)
+        result = {'files': files, 'failed': failed}
+        if options.index:
+            with self._lock:
+                result['duplicates'] = update_index(options, indexed)
+        with self._stats_lock:
+            self.generate_time += default_timer() - start
+            self.files += len(files)
+            self.failed += failed
+        return result
+
+    def _generate(self, infile, options, modules):
+        result = {'infile': infile, 'outputs': {}, 'abi': None,
+                  'error': None}
+        try:
+            header, result['outputs'] = process_file(
+                infile, options, self.cache, modules)
+        except Exception as exc:
+            result['error'] = "{}: {}".format(type(exc).__name__, exc)
+            return result, None
+        if not options.stream:
+            result['abi'] = header.fingerprint()
+        path = os.path.abspath(infile)
+        with self._lock:
+            old = self.keys.get(path)
+            if old is not None and old != header.key:
+                self.cache.forget(old)
+            if header.key is not None:
+                self.keys[path] = header.key
+            self.outputs[path] = list(result['outputs'])
+        return result, header
+
+    def rpc_invalidate(self, paths=None):
+        """Drop cached results for the input or output files `paths`,
+for all files if `paths` is `None`.
+"""
+        with self._lock:
+            if paths is None:
+                dropped = len(self.cache.results)
+                self.cache.clear()
+                self.keys.clear()
+                self.outputs.clear()
+                return {'dropped': dropped}
+            dropped = 0
+            for path in (os.path.abspath(i) for i in paths):
+                key = self.keys.pop(path, None)
+                if key is not None and key in self.cache.results:
+                    self.cache.forget(key)
+                    dropped += 1
+                for name in self.outputs.pop(path, [path]):
+                    self.cache.forget_output(name)
+            return {'dropped': dropped}
+
+    def rpc_stats(self):
+        """Return statistics of the server.
+"""
+        with self._stats_lock:
+            return {
+                'requests': dict(self.requests),
+                'files': self.files,
+                'failed': self.failed,
+                'cache': {'entries': len(self.cache.results),
+                          'hits': self.cache.hits,
+                          'misses': self.cache.misses},
+                'generate_time': self.generate_time,
+                'uptime': default_timer() - self.started}
+
+    def rpc_shutdown(self):
+        """Stop the server.
+"""
+        self.stopped.set()
+        return None
+
+
+def serve_stdio(server, instream, outstream):
+    """Serve requests read from `instream`, one per line, writing the
+responses to `outstream`. Every request is handled in its own thread,
+so requests taking long do not block others. The shutdown request is
+answered after all requests read before it. Returns after the shutdown
+request or at the end of input, when all requests are answered.
+"""
+    write_lock = threading.Lock()
+    threads = []
+
+    def answer(line):
+        response = server.handle_line(line)
+        if response is not None:
+            with write_lock:
+                outstream.write(response + "\n")
+                outstream.flush()
+
+    while True:
+        line = instream.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        if server.is_shutdown(line):
+            for thread in threads:
+                thread.join()
+            answer(line)
+            return
+        thread = threading.Thread(target=answer, args=(line,))
+        thread.daemon = True
+        thread.start()
+        threads = [i for i in threads if i.is_alive()] + [thread]
+    for thread in threads:
+        thread.join()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server.rpc_server
+        for line in self.rfile:
+            line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            response = server.handle_line(line)
+            if response is not None:
+                self.wfile.write((response + "\n").encode('utf-8'))
+                self.wfile.flush()
+            if server.stopped.is_set():
+                threading.Thread(target=self.server.shutdown).start()
+                break
+
+
+class UnixServer(socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+
+    """Serve requests on Unix domain socket, one thread per
+connection.
+"""
+
+    daemon_threads = True
+
+    def __init__(self, path, rpc_server):
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+        self.rpc_server = rpc_server
+
+
+def serve_socket(server, path):
+    """Serve requests on the Unix domain socket `path` until the
+shutdown request.
+"""
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError("Unix domain sockets are not supported")
+    unix_server = UnixServer(path, server)
+    try:
+        unix_server.serve_forever()
+    finally:
+        unix_server.server_close()
+        os.unlink(path)
+
+
+def main(args=None):
+    """Main program
+"""
+    parser = argparse.ArgumentParser(description='''
+Persistent Fortran2CHeader build server using JSON-RPC requests.''')
+    parser.add_argument("--socket", metavar="PATH", help="""
+Listen on Unix domain socket PATH instead of stdin/stdout.""")
+    options = parser.parse_args(args)
+
+    server = Server()
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        if options.socket:
+            serve_socket(server, options.socket)
+        else:
+            serve_stdio(server, sys.stdin, stdout)
+    finally:
+        sys.stdout = stdout
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# Local Variables:
+# mode: python
+# compile-command: "cd ../.. ; python setup.py test"
+# End:
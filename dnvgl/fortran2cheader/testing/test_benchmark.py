@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the Fortran2CHeader benchmark.
+"""
+
+from __future__ import (
+    division, print_function, absolute_import, unicode_literals)
+
+# Third party libraries.
+from six.moves import StringIO as _StringIO
+
+# DNV GL libraries.
+from dnvgl.fortran2cheader import Fortran2CHeader
+from dnvgl.fortran2cheader.benchmark import (
+    CORPORA, PHASES, gen_routine, compare, load_baseline, run)
+
+# ID: $Id$"
+__date__ = "$Date$"[6:-1]
+__version__ = "$Revision$"[10:-1]
+__author__ = "`Berthold Höllmann <berthold.hoellmann@dnvgl.com>`__"
+__copyright__ = "Copyright © 2019 by DNV GL SE"
+
+
+class fStringIO(_StringIO):
+    name = 'bench.f90'
+
+
+def test_gen_routine():
+    probe = Fortran2CHeader(fStringIO(gen_routine("r", 10, args_per_line=3)))
+    probe.parse()
+    assert len(probe.info) == 1
+    assert probe.info[0].name == 'r'
+    assert [arg.name for arg in probe.info[0].args] == [
+        'a{}'.format(i) for i in range(10)]
+
+
+def test_corpora():
+    for name, gen in CORPORA:
+        count = 0
+        for fname, text in gen(.01):
+            probe = Fortran2CHeader(fStringIO(text))
+            probe.parse()
+            count += len(probe.info)
+        assert count > 0, name
+
+
+def test_run():
+    results = run(scale=.01, repeat=1, corpora=['small_files'])
+    assert list(results) == ['small_files']
+    assert all(results['small_files'][phase] > 0 for phase in PHASES)
+
+
+def test_compare():
+    baseline = load_baseline()
+    assert sorted(baseline) == sorted(name for name, gen in CORPORA)
+    results = dict(
+        (name, dict((phase, value) for phase, value in data.items()))
+        for name, data in baseline.items())
+    assert compare(results, baseline, .7) == []
+    results['huge_file']['parse'] = .5 * baseline['huge_file']['parse']
+    regressions = compare(results, baseline, .7)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('huge_file/parse:')
@@ -8,14 +8,26 @@ from __future__ import (
     division, print_function, absolute_import, unicode_literals)
 
 # Standard libraries.
-import re
+import os
+import json
+import ctypes
+import time
+import pickle
+import threading
 
 # Third party libraries.
+import pytest
 from six.moves import StringIO as _StringIO
 
 # DNV GL libraries.
 from dnvgl.fortran2cheader import (
-    _ARGS, _BIND, _VARTYPE, _SUBROUTINE, Fortran2CHeader)
+    _VARTYPE, Argument, _FUNCTION, _INTERFACE, _SUBROUTINE,
+    _END_INTERFACE, CHeaderRenderer, PxdRenderer, Renderer, Fortran2CHeader,
+    Fortran2CHeaderCMD, MemoryCache, ModuleTable, ParseCache, SymbolIndex,
+    TypeAlias, Watcher,
+    abi_diff, abi_fingerprint, dump_ir, ir_data, load_ir, split_blocks,
+    struct_layout,
+    _scan_bind, _scan_tail, _statement, input_files, main)
 
 # ID: $Id$"
 __date__ = "$Date$"[6:-1]
@@ -66,12 +78,85 @@ def test_character_3():
         'modifier': ', dimension(*), intent(in) ', 'length': '1'}
 
 
+def test_vartype_1():
+    res = _VARTYPE.match(
+        "real(kind = c_double), dimension(0:n), intent(in) :: x, y")
+    assert res.groupdict() == {
+        'kind': 'c_double', 'ftype': 'real', 'args': 'x, y',
+        'modifier': ', dimension(0:n), intent(in) ', 'length': None}
+
+
+def test_vartype_2():
+    assert _VARTYPE.match("integer(c_int) x") is None
+    assert _VARTYPE.match("integer(c_int :: x") is None
+    assert _VARTYPE.match("integer(c_int, c_long) :: x").group(
+        'kind') == 'c_long'
+
+
+# Lines causing catastrophic backtracking in earlier versions of the
+# regular expressions.
+PATHOLOGICAL = (
+    "integer(" + "a" * 100000 + "!",
+    "integer(" + "a, " * 30000 + ":: x",
+    "integer(" + "kind=a " * 30000 + ") :: x",
+    "integer(c_int)" + ", dimension(n)" * 10000 + " : x",
+    "integer(c_int) :: " + "x, " * 30000 + "!",
+    "function " * 20000,
+    "function " + "a" * 100000,
+    "integer(c_int) " + "function f " * 10000,
+    "subroutine s(" + "a, " * 30000 + ") bind(" + "c " * 30000,
+    "function f(a) result(" + "r " * 30000 + "bind(c)",
+)
+
+
+def test_pathological():
+    for line in PATHOLOGICAL:
+        for matcher in (_SUBROUTINE, _FUNCTION, _VARTYPE):
+            start = time.time()
+            matcher.match(line)
+            assert time.time() - start < .5, line[:40]
+    i_data = mlist(PATHOLOGICAL)
+    i_data.name = 'test.f90'
+    data = Fortran2CHeader(i_data, line_budget=.5)
+    data.parse()
+    assert data.slow_lines == []
+
+
+def test_line_budget():
+    i_data = mlist(("subroutine pstr(s) bind(c,name='pstr')",
+                    "  use iso_c_binding",
+                    "  integer(c_int), &",
+                    "     & value :: s",
+                    "end subroutine pstr"))
+    i_data.name = 'test.f90'
+    data = Fortran2CHeader(i_data, line_budget=0.)
+    data.parse()
+    assert [i[0] for i in data.slow_lines] == [1, 2, 3, 5]
+    data = Fortran2CHeader(i_data)
+    data.parse()
+    assert data.slow_lines == []
+
+
 def test_args_1():
-    assert re.compile(_ARGS, re.VERBOSE).match("(s)")
+    assert _scan_tail("(s) bind(c)", 0, False)['args'] == 's'
+
+
+def test_args_2():
+    assert _scan_tail("( ) bind(c)", 0, False)['args'] == ''
+    assert _scan_tail("(s) result(r) bind(c)", 0, False) is None
+    assert _scan_tail("(s) bind(c)", 0, True) is None
+    assert _scan_tail("(s", 0, False) is None
 
 
 def test_bind_1():
-    assert re.compile(_BIND, re.VERBOSE).match("bind(c,name='pstr')")
+    assert _scan_bind("bind(c,name='pstr')", 0)
+
+
+def test_bind_2():
+    assert _scan_bind('BIND( C, NAME = "pstr" )', 0)['cName'] == 'pstr'
+    assert _scan_bind("bind(name='pstr')", 0)['C'] is None
+    assert _scan_bind("bind()", 0) is None
+    assert _scan_bind("bind(c,name='pstr\")", 0) is None
 
 
 def test_subr_1():
@@ -227,6 +312,1249 @@ cdef extern from "test.h" nogil:
         assert i == j
 
 
+def test_statement_1():
+    assert _statement("subroutine pstr(s) bind(c,name='pstr')") is _SUBROUTINE
+    assert _statement("INTERFACE") is _INTERFACE
+    assert _statement("end interface") is _END_INTERFACE
+    assert _statement("end subroutine pstr") is _END_INTERFACE
+    assert _statement("REAL(C_DOUBLE), VALUE :: x") is _VARTYPE
+    assert _statement("use iso_c_binding") is None
+    assert _statement("x = 1") is None
+    assert _statement("") is None
+
+
+def test_statement_2():
+    assert _statement(
+        "real(c_double) function f(x) result(y) bind(c,name='f')"
+    ) is _FUNCTION
+    assert _statement(
+        "function f(x) result(y) bind(c,name='f')") is _FUNCTION
+    assert _statement("real(c_double) :: function_value") is _VARTYPE
+
+
+def test_func_1():
+    i_data = """
+interface
+  function ext(x) result(y) bind(c,name='ext')
+    real(c_double), value :: x
+    real(c_double) :: y
+  end function ext
+end interface
+real(c_double) function f(x, n) result(y) bind(c,name='f')
+  use iso_c_binding ! C bindings
+  real(c_double), dimension(n), intent(in) :: x
+  integer(c_int), value :: n
+end function f
+"""
+    i_data = mlist(i for i in i_data.split("\n"))
+    i_data.name = 'test.h'
+    data = Fortran2CHeader(i_data)
+    data.parse()
+    assert len(data.info) == 1
+    res = hStringIO()
+    data.gen_chead(res)
+    assert "extern double f(const double* x, int n);" in res.getvalue()
+
+
+def test_long_args():
+    n_args = 5000
+    names = ["a%d" % i for i in range(n_args)]
+    lines = ["subroutine long(&"]
+    lines.extend("    & %s, &" % ", ".join(names[i:i + 50])
+                 for i in range(0, n_args, 50))
+    lines[-1] = lines[-1][:-3] + ") bind(c,name='long')"
+    lines.append("  use iso_c_binding")
+    lines.extend("  real(c_double), value :: %s" % name for name in names)
+    lines.append("end subroutine long")
+    i_data = mlist(lines)
+    i_data.name = 'test.h'
+    start = time.time()
+    data = Fortran2CHeader(i_data)
+    data.parse()
+    assert time.time() - start < 2.
+    assert len(data.info) == 1
+    assert data.info[0].args[-1] == Argument(
+        "a4999", "double", value=True, kind="c_double")
+
+
+F90_SRC = """
+subroutine {0}(s) bind(c,name='{0}')
+  use iso_c_binding ! C bindings
+  integer(c_int), value :: s
+end subroutine {0}
+"""
+
+
+def test_input_files(tmpdir):
+    tmpdir.join("b.f90").write("")
+    tmpdir.join("a.F90").write("")
+    tmpdir.join("c.txt").write("")
+    tmpdir.mkdir("sub").join("d.f").write("")
+    assert [os.path.basename(i) for i in input_files(
+        [str(tmpdir), "x.f90"])] == ["a.F90", "b.f90", "d.f", "x.f90"]
+
+
+def test_main_batch(tmpdir):
+    src = tmpdir.mkdir("src")
+    for name in ("one", "two", "three"):
+        src.join("%s.f90" % name).write(F90_SRC.format(name))
+    tmpdir.join("files.rsp").write("%s\n" % src.join("three.f90"))
+    out = tmpdir.join("out")
+    assert main(["-j", "2", "-p", "-o", str(out),
+                 str(src.join("one.f90")), str(src.join("two.f90")),
+                 "@%s" % tmpdir.join("files.rsp")]) == 0
+    assert sorted(os.listdir(str(out))) == [
+        "one.h", "one.pxd", "three.h", "three.pxd", "two.h", "two.pxd"]
+    assert "extern void two(int s);" in out.join("two.h").read()
+    assert main(["-o", str(out), str(src),
+                 str(src.join("missing.f90"))]) == 1
+
+
+def test_cache_key():
+    key = ParseCache.key(["a\n", "b\n"], False)
+    assert key == ParseCache.key(["a\r\n", "b"], False)
+    assert key != ParseCache.key(["a\n", "b\n"], True)
+    assert key != ParseCache.key(["ab\n"], False)
+
+
+def test_cache(tmpdir):
+    src = tmpdir.join("one.f90")
+    src.write(F90_SRC.format("one"))
+    h_name = str(tmpdir.join("one.h"))
+    pxd_name = str(tmpdir.join("one.pxd"))
+    cache_dir = str(tmpdir.join("cache"))
+
+    def run(**kw):
+        with open(str(src)) as data:
+            header = Fortran2CHeader(
+                data, cache_dir=cache_dir, incremental=False, **kw)
+            header.parse()
+            header.gen_output(h_name, pxd_name)
+        return header
+
+    header = run()
+    assert header.data.lineno == 5
+    h_text = tmpdir.join("one.h").read()
+    # Cached parse result is used, and the outputs are kept.
+    tmpdir.join("one.h").setmtime(1)
+    header = run()
+    assert header.data.lineno == 0
+    assert len(header.info) == 1
+    assert os.path.getmtime(h_name) == 1
+    # Changing the options invalidates the cache, the unchanged output
+    # is not written.
+    header = run(signed_to_unsigned_char=True)
+    assert header.data.lineno == 5
+    assert os.path.getmtime(h_name) == 1
+    assert tmpdir.join("one.h").read() == h_text
+    # Changing the content invalidates the cache.
+    src.write(F90_SRC.format("two"))
+    header = run(signed_to_unsigned_char=True)
+    assert header.data.lineno == 5
+    assert "extern void two(int s);" in tmpdir.join("one.h").read()
+    # Modified outputs are regenerated.
+    tmpdir.join("one.pxd").write("")
+    run(signed_to_unsigned_char=True)
+    assert "void two(int s)" in tmpdir.join("one.pxd").read()
+
+
+def test_gen_output(tmpdir):
+    src = tmpdir.join("one.f90")
+    src.write(F90_SRC.format("one"))
+    h_name = str(tmpdir.join("one.h"))
+    pxd_name = str(tmpdir.join("one.pxd"))
+
+    def run(**kw):
+        with open(str(src)) as data:
+            header = Fortran2CHeader(data, **kw)
+            header.parse()
+            return header.gen_output(h_name, pxd_name)
+
+    assert run() == {h_name: 'written', pxd_name: 'written'}
+    assert os.stat(h_name).st_mode == os.stat(str(src)).st_mode
+    tmpdir.join("one.h").setmtime(1)
+    assert run() == {h_name: 'unchanged', pxd_name: 'unchanged'}
+    assert os.path.getmtime(h_name) == 1
+    assert run(generate_pxd=False, force=True) == {h_name: 'written'}
+    assert os.path.getmtime(h_name) != 1
+    src.write(F90_SRC.format("two"))
+    assert run() == {h_name: 'written', pxd_name: 'written'}
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "one.f90", "one.h", "one.pxd"]
+
+
+def test_depfile(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("one.f90").write(
+        "include 'local.inc'\n"
+        "#include \"common.inc\"\n"
+        "include 'missing.inc'\n" + F90_SRC.format("one"))
+    src.join("local.inc").write("")
+    tmpdir.mkdir("inc").join("common.inc").write("")
+    out = tmpdir.join("out dir")
+    assert main(["-MD", "-p", "-o", str(out), "-I", str(tmpdir.join("inc")),
+                 str(src.join("one.f90"))]) == 0
+    assert out.join("one.d").read() == (
+        "{0}/one.h {0}/one.pxd: {1}/one.f90 \\\n"
+        "  {1}/local.inc \\\n"
+        "  {2}/common.inc\n".format(
+            str(out).replace(" ", "\\ "), src, tmpdir.join("inc")))
+    dep = tmpdir.join("one.dep")
+    assert main(["-MF", str(dep), "-o", str(out),
+                 str(src.join("one.f90"))]) == 0
+    assert dep.read().startswith("{}/one.h: {}/one.f90 ".format(
+        str(out).replace(" ", "\\ "), src))
+
+
+PREFILTER_SRC = """
+module m
+  use iso_c_binding
+{filler}
+  interface
+    subroutine ext(a) bind(c, name='ext')
+      integer(c_int), value :: a
+    end subroutine ext
+  end interface
+contains
+{filler}
+subroutine pstr(s, n, x) &
+   & bi&
+   &nd(c,name='pstr')
+  character(kind=c_char,len=1), intent(in) :: s(*)
+  integer(c_int), value :: n
+  real(c_double), dimension(n), intent(inout) :: x
+end subroutine pstr
+subroutine nob(n)
+  integer(c_long) :: n
+end subroutine
+{filler}
+integer(c_int) function f1(a, b) &
+  result(r) &
+  BIND(C, NAME="f_one")
+  real(c_float), intent(in) :: a
+  type(c_ptr), value :: b
+end function f1
+{filler}
+end module
+"""
+
+
+def test_end_routine():
+    i_data = mlist(("subroutine pstr(s) bind(c,name='pstr')",
+                    "  integer(c_int), value :: s",
+                    "end subroutine pstr",
+                    "subroutine other(s)",
+                    "  real(c_double) :: s",
+                    "endsubroutine"))
+    i_data.name = 'test.h'
+    data = Fortran2CHeader(i_data)
+    data.parse()
+    assert data.info[0].args == (
+        Argument("s", "int", value=True, kind="c_int"),)
+
+
+def test_prefilter_skip_file(tmpdir):
+    src = tmpdir.join("none.f90")
+    src.write("subroutine a(x)\n  integer(c_int) :: x\nend subroutine\n")
+    with open(str(src)) as data:
+        header = Fortran2CHeader(data)
+        header.parse()
+    assert header.info == []
+    assert header.skipped_file
+    assert header.skipped_bytes == header.total_bytes == src.size()
+
+
+def test_prefilter(tmpdir):
+    filler = "\n".join(
+        "subroutine s{0}(x)\n  real(c_double) :: x\n"
+        "  x = 2. * x\nend subroutine s{0}".format(i) for i in range(500))
+    src = tmpdir.join("m.f90")
+    src.write(PREFILTER_SRC.format(filler=filler))
+    results = []
+    for prefilter in (True, False):
+        with open(str(src)) as data:
+            header = Fortran2CHeader(data, prefilter=prefilter, line_budget=0)
+            header.parse()
+        res = hStringIO()
+        header.gen_chead(res)
+        results.append((res.getvalue(), header))
+    assert results[0][0] == results[1][0]
+    assert "extern void pstr(const char* s, int n, double* x);" in (
+        results[0][0])
+    filtered, full = results[0][1], results[1][1]
+    assert not filtered.skipped_file
+    assert filtered.skipped_bytes > .9 * filtered.total_bytes
+    assert full.skipped_bytes == 0
+    assert set(i[0] for i in filtered.slow_lines) < set(
+        i[0] for i in full.slow_lines)
+    header_lines = [
+        i + 1 for i, line in enumerate(src.readlines())
+        if line.startswith(("subroutine pstr", "integer(c_int) function"))]
+    assert set(header_lines) < set(i[0] for i in filtered.slow_lines)
+
+
+def test_prefilter_comment_continuation(tmpdir):
+    src = tmpdir.join("split.f90")
+    src.write("subroutine s(x) bi& ! keyword split\n"
+              "  &nd(c, name='s')\n"
+              "  integer(c_int), value :: x\n"
+              "end subroutine s\n")
+    with open(str(src)) as data:
+        header = Fortran2CHeader(data)
+        header.parse()
+    assert not header.skipped_file
+    assert [i.name for i in header.info] == ['s']
+    assert [len(i) for i in split_blocks(src.read())] == [src.size()]
+
+
+def test_routines_lazy():
+    consumed = []
+
+    class Lines(object):
+        name = 'test.f90'
+
+        def __iter__(self):
+            for i in range(3):
+                for line in F90_SRC.format("r%d" % i).split("\n"):
+                    consumed.append(line)
+                    yield line
+
+    routines = Fortran2CHeader(Lines()).routines()
+    assert next(routines).name == "r0"
+    assert len(consumed) == 5
+    assert [i.name for i in routines] == ["r1", "r2"]
+
+
+def test_stream_output(tmpdir):
+    src = tmpdir.join("m.f90")
+    src.write(PREFILTER_SRC.format(filler=""))
+    results = []
+    for stream in (True, False):
+        out = tmpdir.mkdir("out%d" % stream)
+        with open(str(src)) as data:
+            header = Fortran2CHeader(data)
+            h_name, pxd_name = str(out.join("m.h")), str(out.join("m.pxd"))
+            if stream:
+                status = header.stream_output(h_name, pxd_name)
+                assert header.info == []
+            else:
+                header.parse()
+                status = header.gen_output(h_name, pxd_name)
+        assert status == {h_name: 'written', pxd_name: 'written'}
+        results.append([i.read().replace(str(out), "")
+                        for i in (out.join("m.h"), out.join("m.pxd"))])
+    assert results[0] == results[1]
+    assert "extern int f_one(const float* a, void* b);" in results[0][0]
+    assert "    int f_one(const float* a, void* b)" in results[0][1]
+    with open(str(src)) as data:
+        assert Fortran2CHeader(data).stream_output(h_name, pxd_name) == {
+            h_name: 'unchanged', pxd_name: 'unchanged'}
+    assert sorted(os.listdir(str(out))) == ["m.h", "m.pxd"]
+
+
+def test_watcher(tmpdir):
+    src = tmpdir.join("one.f90")
+    src.write(F90_SRC.format("one"))
+    tmpdir.join("two.f90").write(F90_SRC.format("two"))
+    out = tmpdir.mkdir("out")
+    options = Fortran2CHeaderCMD.parse_cmdline(
+        ['-o', str(out), '--debounce', '0', str(tmpdir)])
+    watcher = Watcher(options)
+    assert watcher.poll() == [(str(src), None),
+                              (str(tmpdir.join("two.f90")), None)]
+    assert watcher.poll() == []
+    stat = os.stat(str(src))
+    # Touched without changing the content.
+    os.utime(str(src), (stat.st_atime, stat.st_mtime + 10))
+    assert watcher.poll() == []
+    src.write(F90_SRC.format("three"))
+    os.utime(str(src), (stat.st_atime, stat.st_mtime + 20))
+    assert watcher.poll() == [(str(src), None)]
+    assert "three" in out.join("one.h").read()
+
+
+def test_watcher_index(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("one.f90").write(F90_SRC.format("one"))
+    db = str(tmpdir.join("index.db"))
+    options = Fortran2CHeaderCMD.parse_cmdline(
+        ['-o', str(tmpdir.mkdir("out")), '--debounce', '0', '--index', db,
+         str(src)])
+    watcher = Watcher(options)
+    watcher.poll()
+    src.join("two.f90").write(F90_SRC.format("one"))
+    watcher.poll()
+    index = SymbolIndex(db)
+    assert index.conflicts() == {'one': [
+        (str(src.join("one.f90")), 2), (str(src.join("two.f90")), 2)]}
+    index.close()
+
+
+def test_render_threads():
+    src = mlist(F90_SRC.format("one").split("\n"))
+    data = Fortran2CHeader(src)
+    data.parse()
+    expected = {}
+    for renderer in (CHeaderRenderer(data), PxdRenderer(data)):
+        expected[type(renderer)] = renderer.render("test", data.info)
+    assert "extern void one(int s);" in expected[CHeaderRenderer]
+    assert "    void one(int s)" in expected[PxdRenderer]
+    results = []
+
+    def render(renderer):
+        for _ in range(200):
+            results.append((type(renderer),
+                            renderer.render("test", data.info)))
+
+    threads = [threading.Thread(target=render, args=(renderer,))
+               for renderer in (CHeaderRenderer(data), PxdRenderer(data))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 800
+    assert all(expected[kind] == text for kind, text in results)
+
+
+def test_renderer_abstract():
+    with pytest.raises(TypeError):
+        Renderer()
+
+    class Incomplete(Renderer):
+        def head(self, name):
+            return name
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_routine_model():
+    src = mlist("""
+function f(a, b, c) result(r) bind(c, name='f')
+  integer(c_signed_char), intent(in) :: a
+  integer(c_signed_char), value :: b
+  real(c_double), dimension(*), intent(in) :: c
+  real(c_double) :: r
+end function f
+""".split("\n"))
+    routines = []
+    for signed_to_unsigned_char in (True, False, True):
+        data = Fortran2CHeader(
+            src, signed_to_unsigned_char=signed_to_unsigned_char)
+        data.parse()
+        routines.append(data.info[0])
+    assert routines[0] == routines[2]
+    assert routines[0].args == (
+        Argument("a", "const unsigned char*", "in", kind="c_signed_char"),
+        Argument("b", "unsigned char", value=True, kind="c_signed_char"),
+        Argument("c", "const double*", "in", dimension=True, shape="*",
+                 kind="c_double"))
+    assert routines[1].args[1] == Argument(
+        "b", "signed char", value=True, kind="c_signed_char")
+    assert routines[0].result_kind == "c_double"
+    assert routines[0].result == "double"
+    assert routines[0].args[2].c_type is routines[1].args[2].c_type
+    with pytest.raises(AttributeError):
+        routines[0].name = "g"
+    assert pickle.loads(pickle.dumps(routines[0])) == routines[0]
+
+
+IR_SRC = """
+module m
+  include 'inc.h'
+contains
+function f(a, b, c) result(r) bind(c, name='f')
+  integer(c_signed_char), intent(in) :: a
+  integer(c_int), value :: b
+  real(c_double), dimension(*), intent(inout) :: c
+  real(c_double) :: r
+end function f
+subroutine s() bind(c, name='s')
+end subroutine s
+end module m
+"""
+
+
+def test_ir():
+    src = mlist(IR_SRC.split("\n"))
+    data = Fortran2CHeader(src, signed_to_unsigned_char=True)
+    data.parse()
+    ir = ir_data(data)
+    assert ir['includes'] == ['inc.h']
+    assert ir['routines'][0]['args'][2] == {
+        'name': 'c', 'c_type': 'double*', 'intent': 'inout',
+        'value': False, 'dimension': True, 'shape': '*', 'kind': 'c_double'}
+    assert ir['routines'][1]['args'] == []
+    for binary in (False, True):
+        raw = dump_ir(ir, binary)
+        assert raw.startswith(b'F2CIR') == binary
+        assert load_ir(raw) == ir
+    with pytest.raises(ValueError):
+        load_ir(b'{"format": "other"}')
+
+
+def test_ir_output(tmpdir):
+    src = tmpdir.join("m.f90")
+    src.write(IR_SRC)
+    out = tmpdir.join("out")
+    assert main(["-p", "-s", "--ir", "binary", "-o", str(out),
+                 str(src)]) == 0
+    expected = dict((name, out.join(name).read())
+                    for name in ("m.h", "m.pxd"))
+    for name in expected:
+        out.join(name).remove()
+    ir_name = str(out.join("m.f2cir"))
+    assert main(["-p", "-o", str(out), ir_name]) == 0
+    for name in expected:
+        assert out.join(name).read() == expected[name]
+    assert "extern double f(const unsigned char* a" in expected["m.h"]
+
+    with open(str(src)) as source:
+        data = Fortran2CHeader(source)
+        data.parse()
+    data.save_ir(str(tmpdir.join("m.ir.json")))
+    loaded = Fortran2CHeader.load_ir(str(tmpdir.join("m.ir.json")))
+    assert loaded.info == data.info
+    assert loaded.name == str(src)
+
+
+def test_index(tmpdir, capsys):
+    src = tmpdir.mkdir("src")
+    src.join("one.f90").write(F90_SRC.format("one"))
+    src.join("two.f90").write(F90_SRC.format("two"))
+    out = tmpdir.join("include")
+    db = str(tmpdir.join("index.db"))
+    umbrella = str(out.join("all.h"))
+    args = ["-o", str(out), "--index", db, "--umbrella", umbrella]
+    assert main(args + [str(src)]) == 0
+    assert out.join("all.h").read().splitlines()[-4:] == [
+        '#include "one.h"', '#include "two.h"', '', '#endif /* ALL_H */']
+    capsys.readouterr()
+    assert main(["--index", db, "--which", "two"]) == 0
+    assert capsys.readouterr()[0] == "two: {}:2 (two), header {}\n".format(
+        src.join("two.f90"), out.join("two.h"))
+    assert main(["--index", db, "--which", "three"]) == 1
+
+    src.join("two.f90").write(F90_SRC.format("one"))
+    assert main(args + [str(src.join("two.f90"))]) == 1
+    assert "duplicate symbol 'one' defined in {}:2, {}:2.".format(
+        src.join("one.f90"), src.join("two.f90")) in capsys.readouterr()[0]
+
+    src.join("two.f90").write(F90_SRC.format("two") * 2)
+    assert main(args + [str(src.join("two.f90"))]) == 1
+    assert "duplicate symbol 'two' defined in {0}:2, {0}:7.".format(
+        src.join("two.f90")) in capsys.readouterr()[0]
+
+    src.join("two.f90").remove()
+    assert main(args + [str(src.join("one.f90"))]) == 0
+    index = SymbolIndex(db)
+    assert index.conflicts() == {}
+    assert index.headers() == [str(out.join("one.h"))]
+    index.close()
+
+
+BLOCKS_SRC = """
+module m
+contains
+subroutine a(x) bind(c, name='a')
+  integer(c_int), value :: x
+  interface
+    subroutine b(y) bind(c, name='b')
+      integer(c_int) :: y
+    end subroutine b
+  end interface
+end subroutine a
+function c(x) &
+  & result(r) bind(c, name='c')
+  include 'c.inc'
+  integer(c_int), intent(in) :: x
+  real(c_double) :: r
+end function c
+subroutine d(x) bind(c, name='d')
+  integer(c_long), value :: x
+  call e(x, &
+end subroutine d
+  & y)
+end subroutine d
+end module m
+"""
+
+
+def test_split_blocks():
+    blocks = split_blocks(BLOCKS_SRC)
+    assert "".join(blocks) == BLOCKS_SRC
+    assert [i.splitlines()[-1] for i in blocks] == [
+        "end subroutine a", "end function c", "end subroutine d",
+        "end module m"]
+
+
+def test_incremental():
+    cache = MemoryCache()
+
+    def parse(text, **kw):
+        data = Fortran2CHeader(mlist(text.splitlines(True)), **kw)
+        data.parse()
+        return data
+
+    cold = parse(BLOCKS_SRC)
+    warm = parse(BLOCKS_SRC, cache=cache)
+    assert warm.parsed_blocks == (4, 4)
+    assert (warm.info, warm.includes) == (cold.info, cold.includes)
+    assert [i.name for i in warm.info] == ['a', 'c', 'd']
+
+    text = BLOCKS_SRC.replace("c_long", "c_short")
+    warm = parse(text, cache=cache)
+    assert warm.parsed_blocks == (1, 4)
+    assert warm.info == parse(text).info
+    assert warm.info[2].args[0].c_type == "short int"
+    assert warm.includes == ['c.inc']
+
+    text = "! moved\n" + text
+    warm = parse(text, cache=cache)
+    assert warm.parsed_blocks == (1, 4)
+    assert warm.info == parse(text).info
+    assert [i.lineno for i in warm.info] == [5, 13, 19]
+
+
+ABI_SRC = """
+subroutine one(a, b) bind(c, name='one')
+  integer(c_int), value :: a
+  real(c_double), intent(inout) :: b
+end subroutine one
+function two(n) result(r) bind(c, name='two')
+  integer(c_long), value :: n
+  real(c_float) :: r
+end function two
+"""
+
+
+def test_abi(tmpdir, capsys):
+    src = tmpdir.join("m.f90")
+    src.write(ABI_SRC)
+    out = tmpdir.join("out")
+    assert main(["--abi", "-o", str(out), str(src)]) == 0
+    abi = out.join("m.abi")
+    lines = abi.read().splitlines()
+    assert lines[1:] == ["void one(int, double*)", "float two(long int)"]
+    mtime = abi.mtime() - 10
+    abi.setmtime(mtime)
+
+    one, two = ABI_SRC.split("end subroutine one\n")
+    src.write("! reordered\n" + two + one.replace(
+        "a, b", "x,  b").replace(":: a", ":: x") + "end subroutine one\n")
+    assert main(["--abi", "-o", str(out), str(src)]) == 0
+    assert abi.mtime() == mtime
+    assert abi.read().splitlines() == lines
+
+    with open(str(src)) as data:
+        header = Fortran2CHeader(data)
+        header.parse()
+    assert lines[0].endswith(header.fingerprint())
+    new = dict(header.abi(), one="void one(int, float*)",
+               three="void three(void)")
+    del new['two']
+    assert abi_diff(header.abi(), new) == (
+        ["void three(void)"], ["float two(long int)"],
+        [("void one(int, double*)", "void one(int, float*)")])
+    assert abi_fingerprint(new) != header.fingerprint()
+
+    old = tmpdir.join("old.abi")
+    abi.copy(old)
+    src.write(ABI_SRC.replace("c_double", "c_float"))
+    capsys.readouterr()
+    assert main(["--abi-diff", str(old), str(src)]) == 1
+    assert capsys.readouterr()[0].splitlines()[-2].startswith(
+        "changed: void one(int, double*) -> void one(int, float*)")
+    assert main(["--abi-diff", str(old), str(abi)]) == 0
+
+
+FUNPTR_SRC = """
+function getf(x) result(r) bind(c, name='getf')
+  use iso_c_binding
+  integer(c_int), value :: x
+  type(c_funptr) :: r
+end function getf
+"""
+
+
+def test_abi_funptr(tmpdir, capsys):
+    src = tmpdir.join("f.f90")
+    src.write(FUNPTR_SRC)
+    assert main(["--abi", "-o", str(tmpdir), str(src)]) == 0
+    abi = str(tmpdir.join("f.abi"))
+    assert tmpdir.join("f.abi").read().splitlines()[1:] == [
+        "(*) getf(int)"]
+    capsys.readouterr()
+    assert main(["--abi-diff", abi, abi]) == 0
+    src.write(FUNPTR_SRC.replace("value :: x", "intent(in) :: x"))
+    assert main(["--abi-diff", abi, str(src)]) == 1
+    assert "changed: (*) getf(int) -> (*) getf(const int*)" in (
+        capsys.readouterr()[0])
+
+
+def test_funptr_result(tmpdir):
+    src = tmpdir.join("f.f90")
+    src.write(FUNPTR_SRC)
+    assert main(["-p", "--cffi", "-o", str(tmpdir), str(src)]) == 0
+    assert "\nextern void (*getf(int x))(void);\n" in tmpdir.join(
+        "f.h").read()
+    assert "\n    void (*getf(int x))()" in tmpdir.join("f.pxd").read()
+    assert "\nvoid (*getf(int x))(void);\n" in tmpdir.join(
+        "f_build.py").read()
+
+
+KINDS_SRC = """
+module kinds
+  use, intrinsic :: iso_c_binding
+  integer, parameter :: dp = c_double, &
+       ik = c_int  ! kinds
+contains
+  subroutine x()
+    integer, parameter :: hidden = c_float
+  end subroutine x
+end module kinds
+"""
+
+PREC_SRC = """
+module prec
+  use kinds, only: wp => dp
+  integer(c_int), parameter :: long = c_long
+end module prec
+"""
+
+USER_SRC = """
+module user
+  use prec
+contains
+  subroutine s(a, b, c, n) bind(c, name='s')
+    use kinds, only: ik
+    real(wp), value :: a
+    real(kind=wp), dimension(*) :: b
+    integer(long), intent(in) :: c
+    integer(ik), value :: n
+  end subroutine s
+end module user
+"""
+
+
+def test_modules(tmpdir):
+    mods = tmpdir.mkdir("mods")
+    mods.join("kinds.f90").write(KINDS_SRC)
+    mods.join("prec.f90").write(PREC_SRC)
+    modules = ModuleTable([str(mods)])
+    assert modules.kinds('kinds') == {'dp': 'c_double', 'ik': 'c_int'}
+    assert modules.kinds('prec') == {'wp': 'c_double', 'long': 'c_long'}
+    assert modules.aliases(USER_SRC) == {
+        'wp': 'c_double', 'long': 'c_long', 'ik': 'c_int'}
+
+    expected = "extern void s(double a, double* b, const long int* c, int n);"
+    src = tmpdir.join("user.f90")
+    src.write(USER_SRC)
+    out = tmpdir.join("out")
+    args = ["-o", str(out), "-J", str(mods), "-c", str(tmpdir.join("cache"))]
+    assert main(args + [str(src)]) == 0
+    assert expected in out.join("user.h").read()
+    assert main(args + ["--no-prefilter", str(src)]) == 0
+    assert expected in out.join("user.h").read()
+
+    mods.join("kinds.f90").write(KINDS_SRC.replace("c_double", "c_float"))
+    assert main(args + [str(src)]) == 0
+    assert "extern void s(float a, float* b," in out.join("user.h").read()
+
+    # Input read only once, aliases are collected while parsing.
+    data = Fortran2CHeader(mlist((PREC_SRC + USER_SRC).split("\n")),
+                           modules=ModuleTable([str(mods)]))
+    data.parse()
+    assert [i.c_type for i in data.info[0].args] == [
+        "float", "float*", "const long int*", "int"]
+
+
+def test_module_dependencies(tmpdir):
+    mods = tmpdir.mkdir("mods")
+    mods.join("kinds.f90").write(KINDS_SRC)
+    mods.join("prec.f90").write(PREC_SRC)
+    src = tmpdir.mkdir("src")
+    src.join("user.f90").write(USER_SRC)
+    out = tmpdir.mkdir("out")
+    assert main(["-MD", "-o", str(out), "-J", str(mods),
+                 str(src.join("user.f90"))]) == 0
+    assert out.join("user.d").read().endswith(
+        ": {} \\\n  {} \\\n  {}\n".format(
+            src.join("user.f90"), mods.join("kinds.f90"),
+            mods.join("prec.f90")))
+
+    options = Fortran2CHeaderCMD.parse_cmdline(
+        ['-o', str(out), '-J', str(mods), '--debounce', '0', str(src)])
+    watcher = Watcher(options)
+    assert watcher.poll() == [(str(src.join("user.f90")), None)]
+    assert "extern void s(double a," in out.join("user.h").read()
+    stat = os.stat(str(mods.join("kinds.f90")))
+    mods.join("kinds.f90").write(KINDS_SRC.replace("c_double", "c_float"))
+    os.utime(str(mods.join("kinds.f90")),
+             (stat.st_atime, stat.st_mtime + 10))
+    assert watcher.poll() == [(str(src.join("user.f90")), None)]
+    assert "extern void s(float a," in out.join("user.h").read()
+    assert watcher.poll() == []
+
+
+SHAPES_SRC = """
+module shapes
+  use iso_c_binding
+  type, bind(c) :: Rec
+    real(c_double) :: w, h
+  end type Rec
+end module shapes
+"""
+
+AREA_SRC = """
+module area
+  use shapes, only: rec
+contains
+  subroutine take(r, n) bind(c, name='take')
+    type(rec), intent(in) :: r
+    integer(c_int), value :: n
+  end subroutine take
+end module area
+"""
+
+
+def test_module_types(tmpdir):
+    mods = tmpdir.mkdir("mods")
+    mods.join("shapes.f90").write(SHAPES_SRC)
+    modules = ModuleTable([str(mods)])
+    assert modules.kinds('shapes') == {
+        'rec': TypeAlias('Rec', str(mods.join("shapes.f90")))}
+
+    src = tmpdir.join("area.f90")
+    src.write(AREA_SRC)
+    out = tmpdir.join("out")
+    assert main(["-p", "--pyx", "--cffi", "-o", str(out), "-J", str(mods),
+                 str(src)]) == 0
+    header = out.join("area.h").read()
+    assert '#define AREA_H\n\n#include "shapes.h"\n' in header
+    assert "extern void take(const Rec* r, int n);" in header
+    assert "from shapes cimport Rec\n" in out.join("area.pxd").read()
+    assert "def take(area.Rec r, int n):" in out.join("area_wrap.pyx").read()
+    assert "typedef struct Rec { ...; } Rec;" in out.join(
+        "area_build.py").read()
+
+    # The types used are kept with cached results and in IR files.
+    args = ["-o", str(out), "-J", str(mods), "-c", str(tmpdir.join("cache"))]
+    for _ in range(2):
+        out.join("area.h").remove()
+        assert main(args + ["--ir", "binary", str(src)]) == 0
+        assert out.join("area.h").read() == header
+    mods.join("shapes.f90").remove()
+    out.join("area.h").remove()
+    assert main(["-o", str(out), str(out.join("area.f2cir"))]) == 0
+    assert out.join("area.h").read() == header
+
+    # Without the module, the routine is not declared.
+    out.join("area.f2cir").remove()
+    assert main(["-o", str(out), str(src)]) == 0
+    header = out.join("area.h").read()
+    assert "/* take: not declared, argument 'r' has no C type. */" in header
+    assert "#include" not in header
+
+
+LINT_SRC = """
+module m
+contains
+subroutine hot(n, x, y, a, v) bind(c, name='hot')
+  integer(c_int), intent(in) :: n
+  real(c_double), intent(in) :: x(*)
+  real(c_double), dimension(n), intent(inout) :: y
+  real(c_double), intent(in) :: a
+  integer(c_int), value :: v
+end subroutine hot
+end module m
+"""
+
+
+def test_lint(tmpdir, capsys):
+    src = tmpdir.join("m.f90")
+    src.write(LINT_SRC)
+    with open(str(src)) as data:
+        header = Fortran2CHeader(data)
+        header.parse()
+    assert [(i['line'], i['argument'], i['c_type'])
+            for i in header.lint()] == [
+                (4, 'n', 'const int*'), (4, 'a', 'const double*')]
+
+    capsys.readouterr()
+    assert main(["--lint", "text", str(src)]) == 1
+    assert "{}:4: hot: scalar INTENT(IN) argument 'a' passed by " \
+        "reference as 'const double*', consider VALUE".format(src) in (
+            capsys.readouterr()[0])
+    assert main(["--lint", "json", str(src)]) == 1
+    result = json.loads(capsys.readouterr()[0])
+    assert result['summary'] == {
+        'files': 1, 'failed': 0, 'routines': 1, 'arguments': 5,
+        'findings': 2, 'routines_affected': 1}
+    assert result['findings'][0] == {
+        'file': str(src), 'line': 4, 'routine': 'hot', 'fname': 'hot',
+        'argument': 'n', 'c_type': 'const int*'}
+
+
+RESTRICT_SRC = """
+subroutine axpy(n, a, x, y, p, q) bind(c, name='axpy')
+  integer(c_int), value :: n
+  real(c_double), intent(in) :: a
+  real(c_double), dimension(*), intent(in) :: x
+  real(c_double), dimension(n), intent(inout) :: y
+  type(c_ptr), value :: p
+  type(c_ptr), intent(inout) :: q
+end subroutine axpy
+"""
+
+
+def test_restrict(tmpdir):
+    src = tmpdir.join("axpy.f90")
+    src.write(RESTRICT_SRC)
+    out = tmpdir.join("out")
+    assert main(["-p", "-o", str(out), str(src)]) == 0
+    assert "F2CH_RESTRICT" not in out.join("axpy.h").read()
+    pxd = out.join("axpy.pxd").read()
+    assert main(["-p", "--restrict", "-o", str(out), str(src)]) == 0
+    header = out.join("axpy.h").read()
+    assert "#define F2CH_RESTRICT __restrict__\n" in header
+    assert ("extern void axpy(int n, const double* F2CH_RESTRICT a, "
+            "const double* F2CH_RESTRICT x, double* F2CH_RESTRICT y, "
+            "void* p, void** F2CH_RESTRICT q);") in header
+    assert out.join("axpy.pxd").read() == pxd
+    assert ("void axpy(int n, const double* a, const double* x, double* y, "
+            "void* p, void** q)") in pxd
+
+
+ATTRIBUTES_SRC = """
+module m
+contains
+pure integer(c_int) function norm(n, x) result(r) bind(c, name='norm')
+  integer(c_int), value :: n
+  real(c_double), dimension(n), intent(in) :: x
+end function norm
+elemental real(kind=c_double) function sq(x) result(r) bind(c, name='sq')
+  real(c_double), value :: x
+end function sq
+impure elemental function log1(x) result(r) bind(c, name='log1')
+  real(c_double), value :: x
+  real(c_double) :: r
+end function log1
+PURE RECURSIVE SUBROUTINE scale(n, x) BIND(C, NAME='scale')
+  integer(c_int), value :: n
+  real(c_double), dimension(n), intent(inout) :: x
+END SUBROUTINE scale
+end module m
+"""
+
+
+def test_attributes(tmpdir):
+    assert _SUBROUTINE.match(
+        "pure elemental subroutine a(b) bind(c)").group('prefix') == (
+            "pure elemental ")
+    data = Fortran2CHeader(mlist(ATTRIBUTES_SRC.split("\n")))
+    data.parse()
+    routines = data.info
+    assert [(i.name, i.prefix, i.pure) for i in routines] == [
+        ('norm', ('pure',), True), ('sq', ('elemental',), True),
+        ('log1', ('impure', 'elemental'), False),
+        ('scale', ('pure', 'recursive'), True)]
+    assert [i.result for i in routines] == ['int', 'double', 'double', 'void']
+    assert routines[0].moved(2).prefix == ('pure',)
+    ir = ir_data(data)
+    assert ir['routines'][3]['prefix'] == ['pure', 'recursive']
+    for binary in (False, True):
+        assert load_ir(dump_ir(ir, binary)) == ir
+
+    src = tmpdir.join("m.f90")
+    src.write(ATTRIBUTES_SRC)
+    out = tmpdir.join("out")
+    assert main(["-o", str(out), str(src)]) == 0
+    assert "F2CH_PURE" not in out.join("m.h").read()
+    assert main(["--attributes", "-o", str(out), str(src)]) == 0
+    header = out.join("m.h").read()
+    assert ("#define F2CH_PURE __attribute__((__pure__, __nothrow__))\n"
+            in header)
+    assert "extern int norm(int n, const double* x) F2CH_PURE;" in header
+    assert "extern double sq(double x) F2CH_PURE;" in header
+    assert "extern void scale(int n, double* x) F2CH_NOTHROW;" in header
+
+
+DERIVED_SRC = """
+module geo
+  use iso_c_binding
+  integer, parameter :: dp = c_double
+  type, bind(c) :: point
+    real(dp) :: x, y
+    integer(c_int) :: tag(2, 3)
+  end type point
+  type, bind(c), public :: particle
+    type(point) :: pos
+    character(kind=c_char) :: label(16)
+    logical(c_bool) :: active
+    type(c_funptr) :: cb
+  end type particle
+  type :: plain
+    integer :: i
+  end type plain
+  type, bind(c) :: bad
+    integer(c_int) :: a(n)
+  end type bad
+contains
+  subroutine move(n, ps, d) bind(c, name='move')
+    integer(c_int), value :: n
+    type(particle), dimension(n), intent(inout) :: ps
+    type(Point), intent(in) :: d
+  end subroutine move
+  subroutine keep(q) bind(c, name='keep')
+    type(plain), intent(in) :: q
+  end subroutine keep
+end module geo
+"""
+
+
+def test_derived_types(tmpdir):
+    data = Fortran2CHeader(mlist(DERIVED_SRC.split("\n")))
+    data.parse()
+    assert [(i.name, i.lineno) for i in data.structs] == [
+        ('point', 5), ('particle', 9)]
+    assert [tuple(i) for i in data.structs[0].fields] == [
+        ('x', 'double', 'c_double', ()), ('y', 'double', 'c_double', ()),
+        ('tag', 'int', 'c_int', (3, 2))]
+    assert [[i.c_type for i in j.args] for j in data.info] == [
+        ['int', 'particle*', 'const point*'], [None]]
+
+    class Point(ctypes.Structure):
+        _fields_ = [('x', ctypes.c_double), ('y', ctypes.c_double),
+                    ('tag', ctypes.c_int * 2 * 3)]
+
+    class Particle(ctypes.Structure):
+        _fields_ = [('pos', Point), ('label', ctypes.c_char * 16),
+                    ('active', ctypes.c_bool), ('cb', ctypes.c_void_p)]
+
+    layouts = {}
+    for derived, cls in zip(data.structs, (Point, Particle)):
+        layouts[derived.name] = layout = struct_layout(derived, layouts)
+        assert layout == (
+            tuple(getattr(cls, i[0]).offset for i in cls._fields_),
+            ctypes.sizeof(cls), ctypes.alignment(cls))
+
+    ir = ir_data(data)
+    for binary in (False, True):
+        assert load_ir(dump_ir(ir, binary)) == ir
+    abi = data.abi()
+    assert "struct point" in abi
+    assert "move" in abi
+    assert "keep" not in abi
+
+    src = tmpdir.join("geo.f90")
+    src.write(DERIVED_SRC)
+    out = tmpdir.join("out")
+    assert main(["-p", "--dtypes", "-o", str(out), str(src)]) == 0
+    header = out.join("geo.h").read()
+    assert ("typedef struct point {\n    double x;\n    double y;\n"
+            "    int tag[3][2];\n} point;\n") in header
+    assert "    void (*cb)(void);\n} particle;" in header
+    assert "bad" not in header
+    assert ("extern void move(int n, particle* ps, const point* d);"
+            in header)
+    assert ("/* keep: not declared, argument 'q' has no C type. */"
+            in header)
+    assert "None" not in header
+    pxd = out.join("geo.pxd").read()
+    assert "# keep: not declared, argument 'q' has no C type." in pxd
+    assert ("    ctypedef struct particle:\n        point pos\n"
+            "        char label[16]\n        char active\n"
+            "        void (*cb)()\n") in pxd
+    dtypes = out.join("geo_dtypes.py").read()
+    compile(dtypes, "geo_dtypes.py", "exec")
+    assert "    'formats': [point, 'S16', '?', 'u%d'],\n" % ctypes.sizeof(
+        ctypes.c_void_p) in dtypes
+    assert "    'itemsize': %d,\n" % ctypes.sizeof(Particle) in dtypes
+
+    cache = MemoryCache()
+    for _ in range(2):
+        with open(str(src)) as source:
+            cached = Fortran2CHeader(source, cache=cache)
+            cached.parse()
+        assert cached.structs == data.structs
+        assert cached.info == data.info
+    stream = tmpdir.join("stream")
+    assert main(["-p", "--stream", "-o", str(stream), str(src)]) == 0
+    assert stream.join("geo.h").read().replace(str(stream), str(out)) == (
+        header)
+    assert stream.join("geo.pxd").read().replace(str(stream), str(out)) == (
+        pxd)
+
+
+PYX_SRC = """
+module kern
+  use iso_c_binding
+  type, bind(c) :: point
+    real(c_double) :: x, y
+  end type point
+contains
+  subroutine axpy(n, a, x, y) bind(c, name='axpy')
+    integer(c_int), value :: n
+    real(c_double), intent(in) :: a
+    real(c_double), dimension(*), intent(in) :: x
+    real(c_double), dimension(n), intent(inout) :: y
+  end subroutine axpy
+  function dot(n, x, info) result(r) bind(c, name='dot')
+    integer(c_int), value :: n
+    complex(c_double_complex), dimension(n), intent(in) :: x
+    integer(c_int), intent(out) :: info
+    complex(c_double_complex) :: r
+  end function dot
+  subroutine handle(h, p, pts) bind(c, name='handle')
+    type(c_ptr), value :: h
+    type(c_ptr), intent(inout) :: p
+    type(point), dimension(*), intent(in) :: pts
+  end subroutine handle
+  subroutine scale(m, v) bind(c, name='scale')
+    integer(c_int), intent(in) :: m
+    real(c_double), intent(inout) :: v(m, 0:1)
+  end subroutine scale
+  subroutine cb(f) bind(c, name='cb')
+    type(c_funptr), value :: f
+  end subroutine cb
+end module kern
+"""
+
+
+def test_pyx(tmpdir):
+    src = tmpdir.join("kern.f90")
+    src.write(PYX_SRC)
+    out = tmpdir.join("out")
+    with pytest.raises(SystemExit):
+        Fortran2CHeaderCMD.parse_cmdline(["--pyx", str(src)])
+    assert main(["-p", "--pyx", "-o", str(out), str(src)]) == 0
+    pyx = out.join("kern_wrap.pyx").read()
+    assert "\ncimport kern\n\n\ndef axpy(" in pyx
+    assert """
+def axpy(int n, double a, const double[::1] x not None, \
+double[::1] y not None):
+    \"\"\"axpy(n, a, x, y)
+
+    Call FORTRAN routine 'axpy' with the GIL released.
+    \"\"\"
+    cdef double _a = a
+    cdef const double* _x = &x[0] if x.shape[0] else NULL
+    cdef double* _y = &y[0] if y.shape[0] else NULL
+    if y.shape[0] < n:
+        raise ValueError(
+            "argument 'y' needs %d elements, got %d" %
+            (n, y.shape[0]))
+    with nogil:
+        kern.axpy(n, &_a, _x, _y)
+""" in pyx
+    assert """
+    cdef double complex _result
+    cdef const double complex* _x = &x[0] if x.shape[0] else NULL
+    cdef int _info
+    if x.shape[0] < n:
+        raise ValueError(
+            "argument 'x' needs %d elements, got %d" %
+            (n, x.shape[0]))
+    with nogil:
+        _result = kern.dot(n, _x, &_info)
+    return _result, _info
+""" in pyx
+    assert ("def handle(size_t h, size_t p, "
+            "const kern.point[::1] pts not None):") in pyx
+    assert "        kern.handle(<void*>h, &_p, _pts)\n" in pyx
+    assert "    return <size_t>_p\n" in pyx
+    assert """
+    cdef double* _v = &v[0] if v.shape[0] else NULL
+    if v.shape[0] < m * 2:
+        raise ValueError(
+            "argument 'v' needs %d elements, got %d" %
+            (m * 2, v.shape[0]))
+    with nogil:
+        kern.scale(&_m, _v)
+""" in pyx
+    assert pyx.endswith("\n# cb: not wrapped, argument 'f' is a procedure.\n")
+
+
+def test_pyx_large_module():
+    names = ["a%d" % i for i in range(50)]
+    lines = ["module big", "  use iso_c_binding", "contains"]
+    for i in range(400):
+        lines.append("subroutine r%d(%s) bind(c, name='r%d')" % (
+            i, ", ".join(names), i))
+        lines.extend("  integer(c_int), value :: %s" % name
+                     for name in names)
+        lines.append("end subroutine r%d" % i)
+    lines.append("end module big")
+    data = Fortran2CHeader(mlist(lines))
+    data.parse()
+    assert len(data.info) == 400
+    res = hStringIO()
+    start = time.time()
+    data.gen_pyx(res)
+    assert time.time() - start < 2.
+    assert "\ndef r399(int a0, int a1, " in res.getvalue()
+
+
+CFFI_SRC = """
+module sig
+  use iso_c_binding
+  type, bind(c) :: wave
+    real(c_double) :: t
+    complex(c_long_double_complex) :: z
+  end type wave
+contains
+  function amp(n, w, c) result(r) bind(c, name='amp')
+    integer(c_int), value :: n
+    type(wave), dimension(n), intent(in) :: w
+    complex(c_double_complex), value :: c
+    complex(c_double_complex) :: r
+  end function amp
+  subroutine on_done(f, g, ok) bind(c, name='on_done')
+    type(c_funptr), value :: f
+    type(c_funptr), intent(inout) :: g
+    logical(c_bool), value :: ok
+  end subroutine on_done
+  function done(flag) result(r) bind(c, name='done')
+    logical(c_bool), intent(in) :: flag
+    logical(c_bool) :: r
+  end function done
+  subroutine ext(x) bind(c, name='ext')
+    complex(c_long_double_complex), intent(in) :: x
+  end subroutine ext
+end module sig
+"""
+
+
+def test_cffi(tmpdir):
+    src = tmpdir.join("sig.f90")
+    src.write(CFFI_SRC)
+    out = tmpdir.join("out")
+    with pytest.raises(SystemExit):
+        Fortran2CHeaderCMD.parse_cmdline(["--cffi", "--stream", str(src)])
+    assert main(["--cffi", "-o", str(out), str(src)]) == 0
+    assert "extern void on_done(void (*f)(void), void (**g)(void), " \
+        "char ok);" in out.join("sig.h").read()
+    assert "extern char done(const char* flag);" in out.join("sig.h").read()
+    build = out.join("sig_build.py").read()
+    compile(build, "sig_build.py", "exec")
+    assert 'MODULE = "_sig_cffi"\nHEADER = "sig.h"\n' in build
+    assert """
+typedef struct wave {
+    double t;
+    ...;
+} wave;
+""" in build
+    assert ("double _Complex amp(int n, const wave* w, "
+            "double _Complex c);\n") in build
+    assert ("void on_done(void (*f)(void), void (**g)(void), "
+            "_Bool ok);\n") in build
+    assert "_Bool done(const char* flag);\n" in build
+    assert ("/* ext: not declared, cffi does not support "
+            "'const long double _Complex*'. */\n") in build
+    assert "ffibuilder.cdef(CDEF)\n" in build
+
 # Local Variables:
 # mode: python
 # ispell-local-dictionary: "english"
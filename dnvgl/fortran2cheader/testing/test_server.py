@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the Fortran2CHeader build server.
+"""
+
+from __future__ import (
+    division, print_function, absolute_import, unicode_literals)
+
+# Standard libraries.
+import os
+import json
+import socket
+import threading
+
+# Third party libraries.
+import pytest
+from six.moves import StringIO
+
+# DNV GL libraries.
+from dnvgl.fortran2cheader.server import (
+    Server, serve_stdio, UnixServer, METHOD_NOT_FOUND, INVALID_PARAMS,
+    INTERNAL_ERROR, PARSE_ERROR)
+
+# ID: $Id$"
+__date__ = "$Date$"[6:-1]
+__version__ = "$Revision$"[10:-1]
+__author__ = "`Berthold Höllmann <berthold.hoellmann@dnvgl.com>`__"
+__copyright__ = "Copyright © 2019 by DNV GL SE"
+
+F90_SRC = """
+subroutine {0}(s) bind(c,name='{0}')
+  use iso_c_binding
+  integer(c_int), value :: s
+end subroutine {0}
+"""
+
+
+def request(method, rid=1, **params):
+    return {'jsonrpc': '2.0', 'id': rid, 'method': method, 'params': params}
+
+
+def test_errors():
+    server = Server()
+    assert server.handle(request('frobnicate'))['error']['code'] == (
+        METHOD_NOT_FOUND)
+    assert server.handle(request('generate'))['error']['code'] == (
+        INVALID_PARAMS)
+    assert server.handle(request(
+        'generate', args=['--no-such-option']))['error']['code'] == (
+            INVALID_PARAMS)
+    for args, name in ((['--watch'], '--watch'),
+                       (['--lint', 'text'], '--lint'),
+                       (['--index', 'f.db', '--which', 'f'], '--which'),
+                       (['--abi-diff', 'old.abi', 'new.abi'], '--abi-diff'),
+                       (['-j', '2'], '--jobs')):
+        error = server.handle(request('generate', args=args + ['a.f90']))[
+            'error']
+        assert error['code'] == INVALID_PARAMS
+        assert error['message'] == (
+            "options not supported by the server: " + name)
+    assert json.loads(server.handle_line("{"))['error']['code'] == (
+        PARSE_ERROR)
+    assert server.handle(request('stats', verbose=True))['error'][
+        'code'] == INVALID_PARAMS
+    # Notifications are not answered, even if they fail.
+    for method, params in (('frobnicate', {}), ('generate', {}),
+                           ('stats', {'verbose': True})):
+        assert server.handle({'jsonrpc': '2.0', 'method': method,
+                              'params': params}) is None
+
+
+def test_internal_error(tmpdir):
+    blocker = tmpdir.join("file")
+    blocker.write("")
+    tmpdir.join("one.f90").write(F90_SRC.format("one"))
+    response = Server().handle(request('generate', args=[
+        '-o', str(blocker.join("out")), str(tmpdir.join("one.f90"))]))
+    assert response['error']['code'] == INTERNAL_ERROR
+
+
+def test_generate(tmpdir):
+    src = tmpdir.join("one.f90")
+    src.write(F90_SRC.format("one"))
+    out = tmpdir.join("out")
+    h_name = str(out.join("one.h"))
+    server = Server()
+    args = ['-o', str(out), str(src)]
+
+    result = server.handle(request('generate', args=args))['result']
+    assert result['failed'] == 0
+    assert result['files'][0]['outputs'] == {h_name: 'written'}
+    assert "extern void one(int s);" in out.join("one.h").read()
+    abi = result['files'][0]['abi']
+    assert len(abi) == 40
+
+    result = server.handle(request('generate', args=args))['result']
+    assert result['files'][0]['outputs'] == {h_name: 'cached'}
+    assert result['files'][0]['abi'] == abi
+    stats = server.handle(request('stats'))['result']
+    assert stats['requests'] == {'generate': 2, 'stats': 1}
+    assert stats['cache'] == {'entries': 2, 'hits': 1, 'misses': 2}
+
+    assert server.handle(request('invalidate', paths=[str(src)]))[
+        'result'] == {'dropped': 1}
+    result = server.handle(request('generate', args=args))['result']
+    assert result['files'][0]['outputs'] == {h_name: 'unchanged'}
+
+    src.write(F90_SRC.format("two"))
+    result = server.handle(request('generate', args=args))['result']
+    assert result['files'][0]['outputs'] == {h_name: 'written'}
+    assert server.handle(request('stats'))['result']['cache'][
+        'entries'] == 2
+
+    result = server.handle(request(
+        'generate', args=['-o', str(out), str(tmpdir.join("none.f90"))]))
+    assert result['result']['failed'] == 1
+
+
+def test_generate_index(tmpdir):
+    tmpdir.join("one.f90").write(F90_SRC.format("one"))
+    tmpdir.join("two.f90").write(F90_SRC.format("one"))
+    db = str(tmpdir.join("index.db"))
+    result = Server().handle(request('generate', args=[
+        '-o', str(tmpdir.join("out")), '--index', db, str(tmpdir)]))
+    assert result['result']['duplicates'] == {'one': [
+        (str(tmpdir.join("one.f90")), 2), (str(tmpdir.join("two.f90")), 2)]}
+
+
+def test_stdio(tmpdir):
+    tmpdir.join("one.f90").write(F90_SRC.format("one"))
+    instream = StringIO("\n".join(json.dumps(i) for i in (
+        request('generate', rid=1, args=['-o', str(tmpdir), str(tmpdir)]),
+        request('stats', rid=2),
+        request('shutdown', rid=3),
+        request('stats', rid=4))) + "\n")
+    outstream = StringIO()
+    serve_stdio(Server(), instream, outstream)
+    responses = [json.loads(i) for i in outstream.getvalue().splitlines()]
+    assert sorted(i['id'] for i in responses) == [1, 2, 3]
+    assert responses[-1] == {'jsonrpc': '2.0', 'id': 3, 'result': None}
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason="requires Unix domain sockets")
+def test_socket(tmpdir):
+    path = str(tmpdir.join("server.sock"))
+    unix_server = UnixServer(path, Server())
+    thread = threading.Thread(target=unix_server.serve_forever)
+    thread.start()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        stream = client.makefile('rwb')
+        for method in ('stats', 'shutdown'):
+            stream.write((json.dumps(request(method)) + "\n").encode('utf-8'))
+            stream.flush()
+            response = json.loads(stream.readline().decode('utf-8'))
+            assert 'result' in response
+        stream.close()
+        client.close()
+        thread.join(10)
+        assert not thread.is_alive()
+    finally:
+        unix_server.server_close()
+        os.unlink(path)
@@ -47,10 +47,13 @@ C function calls in the `FORTRAN` code.''',
         packages=find_packages('.', exclude=[
             "*.__pycache__", "*.__pycache__.*", "__pycache__.*",
             "__pycache__", "flycheck*.py[cd]?"]),
+        package_data={'dnvgl.fortran2cheader': ['benchmark_baseline.json']},
         use_2to3=True,
         entry_points={
             'console_scripts': [
-                'fortran2cheader = dnvgl.fortran2cheader:main']})
+                'fortran2cheader = dnvgl.fortran2cheader:main',
+                'fortran2cheader-server = '
+                'dnvgl.fortran2cheader.server:main']})
 
 # Local Variables:
 # mode: python